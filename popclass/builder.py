@@ -0,0 +1,191 @@
+"""
+Streaming construction of population models from raw simulation catalogs.
+Catalog chunks (e.g. one PopSyCLE field at a time) are assigned to classes
+with a user rule, reduced to the model parameters, and appended to an HDF5
+file readable with ``PopulationModel.from_hdf5``, so peak memory is bounded
+by the chunk size. Requires ``h5py``, installed with the ``hdf5`` extra
+(``pip install popclass[hdf5]``).
+"""
+import os
+
+import numpy as np
+
+from popclass.model import _import_h5py
+
+
+class PopulationModelBuilder:
+    """
+    Incrementally build a population model file from catalog chunks.
+
+    Every chunk is a mapping of column names to arrays (a dict, a structured
+    numpy array, an h5py group, a pandas DataFrame, ...). Class counts are
+    accumulated over every assigned row and become the class weights, even
+    when ``reservoir_size`` keeps only a uniform random subsample of each class.
+    Used as a context manager, the file is finalized when the block completes
+    and removed when it raises, so a partial ingest never looks like a model.
+    """
+
+    def __init__(
+        self,
+        path,
+        model_name,
+        parameters,
+        class_rule,
+        columns=None,
+        citation=None,
+        reservoir_size=None,
+        chunk_rows=2**16,
+        compression=None,
+        random_state=0,
+    ):
+        """
+        Create the output file.
+
+        Args:
+            path (str): path of the HDF5 file to write.
+            model_name (str): Name of the model to be saving in the file.
+            parameters (list[str]): model parameters, in the model order.
+            class_rule (callable):
+                function of a chunk returning the class name of every row.
+                Rows assigned None or an empty string are dropped.
+            columns (dict, optional):
+                key is a parameter and value is either the catalog column
+                holding it or a function of a chunk returning it, e.g.
+                ``lambda chunk: np.log10(chunk["t_E"])``. Parameters missing
+                from the dictionary are read from the column of the same name.
+                Default: None.
+            citation (list, optional): list of DOI entries for citing the model.
+            reservoir_size (int, optional):
+                keep at most this many uniformly drawn samples per class.
+                Default: keep every sample.
+            chunk_rows (int, optional): rows per HDF5 chunk. Default: 65536.
+            compression (str, optional): HDF5 compression filter. Default: None.
+            random_state (int, optional): seed of the reservoir sampling. Default: 0.
+        """
+        self.path = path
+        self.parameters = list(parameters)
+        self.class_rule = class_rule
+        self.columns = {} if columns is None else dict(columns)
+        self.reservoir_size = reservoir_size
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.class_counts = {}
+        self._reservoirs = {}
+        self._rng = np.random.default_rng(random_state)
+
+        self._file = _import_h5py().File(path, "w")
+        self._file.attrs["model_name"] = model_name
+        self._file.attrs["parameters"] = self.parameters
+        self._file.attrs["citation"] = list(citation or [])
+        self._class_data = self._file.create_group("class_data")
+
+    def _parameter_values(self, chunk):
+        values = []
+        for parameter in self.parameters:
+            column = self.columns.get(parameter, parameter)
+            value = column(chunk) if callable(column) else chunk[column]
+            values.append(np.asarray(value, dtype=np.float64))
+        return np.column_stack(values)
+
+    def add_chunk(self, chunk):
+        """
+        Assign the rows of a catalog chunk to classes and add them to the model.
+
+        Args:
+            chunk (mapping): catalog columns, each an array with one value per row.
+
+        Raises:
+            ValueError: if the class rule does not return one class per row.
+        """
+        labels = np.asarray(self.class_rule(chunk), dtype=object)
+        values = self._parameter_values(chunk)
+        if labels.shape != (len(values),):
+            raise ValueError("class_rule must return one class name per row.")
+
+        keep = np.array(
+            [label is not None and label != "" for label in labels], dtype=bool
+        )
+        for class_name in np.unique(labels[keep]):
+            class_values = values[labels == class_name]
+            class_name = str(class_name)
+            if self.reservoir_size is None:
+                self._append(class_name, class_values)
+            else:
+                self._sample(class_name, class_values)
+            self.class_counts[class_name] = self.class_counts.get(class_name, 0) + len(
+                class_values
+            )
+
+    def _append(self, class_name, class_values):
+        if class_name not in self._class_data:
+            group = self._class_data.create_group(class_name)
+            for parameter in self.parameters:
+                group.create_dataset(
+                    parameter,
+                    shape=(0,),
+                    maxshape=(None,),
+                    dtype=np.float64,
+                    chunks=(self.chunk_rows,),
+                    compression=self.compression,
+                )
+        group = self._class_data[class_name]
+        for index, parameter in enumerate(self.parameters):
+            dataset = group[parameter]
+            start = dataset.shape[0]
+            dataset.resize((start + len(class_values),))
+            dataset[start:] = class_values[:, index]
+
+    def _sample(self, class_name, class_values):
+        """
+        Reservoir sampling (algorithm R) of the class rows, vectorized per chunk.
+        """
+        seen = self.class_counts.get(class_name, 0)
+        reservoir = self._reservoirs.get(class_name)
+        if reservoir is None:
+            reservoir = np.empty((0, len(self.parameters)))
+
+        fill = max(0, min(self.reservoir_size - len(reservoir), len(class_values)))
+        reservoir = np.concatenate([reservoir, class_values[:fill]])
+        rest = class_values[fill:]
+        if len(rest):
+            positions = self._rng.integers(
+                0, np.arange(seen + fill, seen + len(class_values)) + 1
+            )
+            replace = positions < self.reservoir_size
+            # Later rows win when several replace the same reservoir slot.
+            slots, last = np.unique(positions[replace][::-1], return_index=True)
+            reservoir[slots] = rest[replace][::-1][last]
+        self._reservoirs[class_name] = reservoir
+
+    def close(self):
+        """
+        Write the reservoirs and class weights and close the file.
+
+        Returns:
+            Dictionary of class names and class weights.
+        """
+        for class_name, reservoir in self._reservoirs.items():
+            self._append(class_name, reservoir)
+        self._reservoirs = {}
+
+        total = sum(self.class_counts.values())
+        class_weights = {
+            class_name: count / total for class_name, count in self.class_counts.items()
+        }
+        for class_name, class_weight in class_weights.items():
+            self._class_data[class_name].attrs["class_weight"] = class_weight
+        self._file.attrs["classes"] = list(self.class_counts)
+        self._file.close()
+        return class_weights
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self._file.id.valid:
+            return
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self.path)
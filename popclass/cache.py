@@ -0,0 +1,249 @@
+"""
+Content-addressed result cache for ``popclass.classify``.
+Classifications are keyed by a hash of the inference data, the population model
+(including its density estimator and class weights), the parameters and the
+uncertainty quantification configuration, and stored on local disk so repeated
+requests across processes and restarts skip the density evaluations.
+"""
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+_SUFFIX = ".json"
+
+# Fraction of ``max_bytes`` the cache is trimmed to once it is exceeded, so
+# the directory is only scanned again after a batch of new entries.
+_LOW_WATERMARK = 0.9
+
+
+def update_digest(digest, value):
+    """
+    Feed a value into a hash, hashing array contents in full.
+
+    Arrays (of any size) are hashed by dtype, shape and bytes rather than by
+    their ``repr``, which numpy truncates. Dictionaries are hashed in key
+    order, and lists and tuples element by element.
+
+    Args:
+        digest (hashlib hash): hash object to update.
+        value: array, dictionary, list, tuple or value with a stable ``repr``.
+    """
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        digest.update(repr(("ndarray", array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+    elif isinstance(value, dict):
+        digest.update(repr(("dict", len(value))).encode())
+        for key in sorted(value, key=repr):
+            update_digest(digest, key)
+            update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(repr((type(value).__name__, len(value))).encode())
+        for item in value:
+            update_digest(digest, item)
+    elif isinstance(value, np.generic):
+        update_digest(digest, value.item())
+    else:
+        digest.update(repr(value).encode())
+
+
+def classification_key(
+    inference_data, population_model, parameters, additive_uq=None, return_result=False
+):
+    """
+    Content hash identifying a classification.
+
+    Args:
+        inference_data (popclass.InferenceData):
+            popclass InferenceData object
+        population_model (popclass.PopulationModel):
+            popclass PopulationModel object
+        parameters (list):
+            Parameters to use for classification.
+        additive_uq (popclass.uq.additiveUQ, optional):
+            uncertainty quantification to apply. Must provide a ``fingerprint``
+            (e.g. ``NoneClassUQ``). Default: None.
+        return_result (bool, optional):
+            Whether the cached value is a ``ClassificationResult``. Default: False.
+
+    Returns:
+        Hex digest string.
+
+    Raises:
+        ValueError: if ``additive_uq`` does not provide a ``fingerprint``.
+    """
+    if additive_uq and not hasattr(additive_uq, "fingerprint"):
+        raise ValueError("Caching requires an additive UQ that provides a fingerprint.")
+    digest = hashlib.sha256()
+    digest.update(inference_data.fingerprint.encode())
+    digest.update(population_model.fingerprint.encode())
+    update_digest(digest, [str(parameter) for parameter in parameters])
+    update_digest(digest, additive_uq.fingerprint if additive_uq else None)
+    # Results are keyed by their storage layout, so older layouts are not read back.
+    digest.update(repr("result-v2" if return_result else False).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded, least-recently-used cache of classification results on local disk.
+
+    Each entry is a small JSON file named by its key. Entries are written to a
+    temporary file and atomically renamed into place, so any number of threads
+    and processes can share a cache directory. Reads refresh the modification
+    time of an entry. Each instance keeps a running estimate of the directory
+    size, and only when it exceeds ``max_bytes`` is the directory scanned and
+    the oldest entries evicted, down to 90% of ``max_bytes``. Entries written
+    by other processes are counted at the next scan, so the bound is
+    approximate between scans. Recently used entries are also kept in memory,
+    so repeated requests in the same process do not touch the disk. Values are
+    deep-copied into and out of memory, so callers never share them.
+    """
+
+    def __init__(self, directory, max_bytes=100 * 2**20, max_memory_entries=1024):
+        """
+        Initialize ResultCache.
+
+        Args:
+            directory (str): directory to store the cache in. Created if missing.
+            max_bytes (int, optional):
+                maximum total size of the cache files. Default: 100 MiB.
+            max_memory_entries (int, optional):
+                number of entries kept in memory. Default: 1024.
+        """
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        Look up a cached value.
+
+        Args:
+            key (str): cache key, e.g. from ``classification_key``.
+
+        Returns:
+            The cached value, or None if the key is not in the cache.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return copy.deepcopy(self._memory[key])
+
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, concurrently evicted or unreadable entries are misses.
+            return None
+        self._remember(key, value)
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        """
+        Store a value and evict least recently used entries if over size.
+
+        Args:
+            key (str): cache key, e.g. from ``classification_key``.
+            value: JSON-serializable value.
+        """
+        data = json.dumps(value).encode()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._remember(key, copy.deepcopy(value))
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self._evict()
+
+    def _scan(self):
+        """
+        List the cache entries as (mtime, size, path) and their total size.
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def _evict(self):
+        """
+        Scan the directory and, if it exceeds ``max_bytes``, remove the least
+        recently used entries until it fits 90% of ``max_bytes``.
+        """
+        entries, total = self._scan()
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= _LOW_WATERMARK * self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    # Another process already evicted it.
+                    pass
+                total -= size
+        with self._lock:
+            self._size = total
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._size = None
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(_SUFFIX):
+                    try:
+                        os.unlink(entry.path)
+                    except OSError:
+                        pass
+
+    def __len__(self):
+        with os.scandir(self.directory) as it:
+            return sum(1 for entry in it if entry.name.endswith(_SUFFIX))
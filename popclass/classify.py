@@ -4,10 +4,30 @@ Will take an ``InferenceData`` and ``PopulationModel`` object and return
 object class probabilities for classes in ``PopulationModel.classes()``.
 
 """
+import asyncio
+import functools
+import weakref
+from collections import namedtuple
+
 import numpy as np
 
+from popclass.cache import classification_key
+from popclass.uq import UQContext
+
+_MarginalSamples = namedtuple("_MarginalSamples", ["samples", "parameter_labels"])
+
+# Per event loop: density batchers keyed by (model id, executor id, parameters).
+_batchers = weakref.WeakKeyDictionary()
 
-def classify(inference_data, population_model, parameters, additive_uq=None):
+
+def classify(
+    inference_data,
+    population_model,
+    parameters,
+    additive_uq=None,
+    return_result=False,
+    cache=None,
+):
     """
     ``popclass`` classification function.
     Takes in ``popclass.InferenceData`` and ``popclass.PopulationModel`` objects,
@@ -20,38 +40,796 @@ def classify(inference_data, population_model, parameters, additive_uq=None):
             popclass PopulationModel object
         parameters (list):
             Parameters to use for classification.
+        additive_uq (popclass.uq.additiveUQ, optional):
+            uncertainty quantification to apply, e.g. a ``popclass.uq.UQPipeline``
+            of several stages. It receives the marginalized posterior and
+            importance weights through a ``popclass.uq.UQContext``. Default: None.
+        return_result (bool, optional):
+            Return a ``ClassificationResult`` keeping the unweighted class
+            integrals and their covariance, instead of the probability
+            dictionary. The additive UQ, if any, must provide ``integrand``
+            and ``none_class_weight`` (e.g. ``NoneClassUQ``, or a
+            ``UQPipeline`` whose only stage changing the probabilities is such
+            a None class stage). Default: False.
+        cache (popclass.cache.ResultCache, optional):
+            result cache to look the classification up in and store it to.
+            The additive UQ, if any, must provide ``fingerprint``. Default: None.
 
     Returns:
         Dictionary of classes in ``PopulationModel.classes()`` and associated
-        probability.
+        probability, or a ``ClassificationResult`` if ``return_result``.
     """
+    if cache is not None:
+        key = classification_key(
+            inference_data, population_model, parameters, additive_uq, return_result
+        )
+        cached = cache.get(key)
+        if cached is None:
+            cached = classify(
+                inference_data,
+                population_model,
+                parameters,
+                additive_uq=additive_uq,
+                return_result=return_result,
+            )
+            cached = vars(cached) if return_result else cached
+            cache.put(key, cached)
+        if return_result:
+            return ClassificationResult(**cached)
+        return dict(cached)
+
     class_names = population_model.classes
     posterior = inference_data.posterior.marginal(parameters)
-    posterior_samples = posterior.samples
+    importance_weights = _importance_weights(inference_data)
 
-    unnormalized_prob = {}
-    for class_name in class_names:
-        class_kde = population_model.evaluate_density(
-            class_name=class_name,
-            parameters=posterior.parameter_labels,
-            points=posterior_samples,
+    integrands = {
+        class_name: _class_integrand(
+            population_model, class_name, posterior, importance_weights
         )
-        integrated_posterior = np.mean(class_kde / inference_data.prior_density)
-        weighted_integrated_posterior = (
-            integrated_posterior * population_model.class_weight(class_name)
+        for class_name in class_names
+    }
+    unnormalized_prob = {
+        class_name: np.mean(integrand) * population_model.class_weight(class_name)
+        for class_name, integrand in integrands.items()
+    }
+    class_weights = {
+        class_name: float(population_model.class_weight(class_name))
+        for class_name in class_names
+    }
+
+    if return_result:
+        none_class_weight = None
+        if additive_uq:
+            if not hasattr(additive_uq, "integrand"):
+                raise ValueError(
+                    "return_result requires an additive UQ that provides integrand()."
+                )
+            integrands["None"] = additive_uq.integrand(
+                inference_data,
+                parameters,
+                context=UQContext(
+                    inference_data,
+                    population_model,
+                    parameters,
+                    posterior=posterior,
+                    importance_weights=importance_weights,
+                ),
+            )
+            none_class_weight = float(additive_uq.none_class_weight)
+        return ClassificationResult.from_integrands(
+            integrands, class_weights, none_class_weight
         )
-        unnormalized_prob[class_name] = weighted_integrated_posterior
+
     if additive_uq:
-        additive_uq.apply_uq(
-            unnormalized_prob=unnormalized_prob,
-            inference_data=inference_data,
-            population_model=population_model,
-            parameters=parameters,
+        unnormalized_prob = _apply_uq(
+            additive_uq,
+            unnormalized_prob,
+            inference_data,
+            population_model,
+            parameters,
+            posterior,
+            importance_weights,
         )
 
+    return _normalize(unnormalized_prob)
+
+
+class ClassificationResult:
+    """
+    Classification result keeping the unweighted per-class integrals of the
+    posterior (the class evidence) and their Monte Carlo covariance, so class
+    probabilities and their errors can be recomputed under new class weights,
+    None class weights or class subsets without evaluating any density again.
+    """
+
+    def __init__(
+        self, evidence, evidence_covariance, class_weights, none_class_weight=None
+    ):
+        """
+        Initialize ClassificationResult.
+
+        Args:
+            evidence (dict):
+                unweighted posterior integral of each class density, with the
+                prior divided out. Includes ``"None"`` if the None class was used.
+            evidence_covariance (dict):
+                Monte Carlo covariance of the entries in ``evidence``, as
+                ``evidence_covariance[class_a][class_b]``. The integrals share
+                the posterior samples, so they are correlated.
+            class_weights (dict):
+                class weights of the population model classes.
+            none_class_weight (float, optional):
+                weight of the None class, if used. Default: None.
+        """
+        self.evidence = evidence
+        self.evidence_covariance = evidence_covariance
+        self.class_weights = class_weights
+        self.none_class_weight = none_class_weight
+
+    @classmethod
+    def from_integrands(cls, integrands, class_weights, none_class_weight=None):
+        """
+        Build a result from the per-sample class integrands.
+
+        Args:
+            integrands (dict):
+                class density times importance weight at every posterior
+                sample, for each class (and ``"None"`` if used).
+            class_weights (dict):
+                class weights of the population model classes.
+            none_class_weight (float, optional):
+                weight of the None class, if used. Default: None.
+
+        Returns:
+            ClassificationResult
+        """
+        names = list(integrands.keys())
+        stacked = np.vstack([integrands[name] for name in names])
+        covariance = np.atleast_2d(np.cov(stacked, bias=True)) / stacked.shape[1]
+        return cls(
+            evidence={
+                name: float(value) for name, value in zip(names, stacked.mean(axis=1))
+            },
+            evidence_covariance={
+                name: {other: float(value) for other, value in zip(names, row)}
+                for name, row in zip(names, covariance)
+            },
+            class_weights=class_weights,
+            none_class_weight=none_class_weight,
+        )
+
+    @property
+    def classes(self):
+        """
+        Return all classes in the result, including ``"None"`` if used.
+
+        Returns:
+            List of class names.
+        """
+        return list(self.evidence.keys())
+
+    @property
+    def evidence_variance(self):
+        """
+        Monte Carlo variance of each class integral.
+
+        Returns:
+            Dictionary of class names and variances.
+        """
+        return {name: self.evidence_covariance[name][name] for name in self.classes}
+
+    def _scales(self, class_weights=None, classes=None, none_class_weight=None):
+        """
+        Factor multiplying each class integral before normalization.
+        """
+        weights = dict(self.class_weights)
+        if class_weights is not None:
+            weights.update(class_weights)
+        if none_class_weight is None:
+            none_class_weight = self.none_class_weight
+        if classes is None:
+            classes = self.classes
+
+        scales = {}
+        for class_name in classes:
+            if class_name == "None":
+                scales[class_name] = none_class_weight
+            else:
+                weight = weights[class_name]
+                if none_class_weight is not None and "None" in self.evidence:
+                    weight = weight * (1 - none_class_weight)
+                scales[class_name] = weight
+        return scales
+
+    def unnormalized(self, class_weights=None, classes=None, none_class_weight=None):
+        """
+        Weighted class integrals before normalization.
+
+        Args:
+            class_weights (dict, optional):
+                class weights overriding the stored ones. Classes not in the
+                dictionary keep their stored weight. Default: None.
+            classes (list[str], optional):
+                subset of classes to keep. Default: all classes.
+            none_class_weight (float, optional):
+                None class weight overriding the stored one. Default: None.
+
+        Returns:
+            Dictionary of class names and weighted integrals.
+        """
+        scales = self._scales(class_weights, classes, none_class_weight)
+        return {
+            class_name: self.evidence[class_name] * scale
+            for class_name, scale in scales.items()
+        }
+
+    def probabilities(self, class_weights=None, classes=None, none_class_weight=None):
+        """
+        Class probabilities, optionally under new weights or for a class subset.
+        With the default arguments this matches the output of ``classify``.
+
+        Args:
+            class_weights (dict, optional):
+                class weights overriding the stored ones. Default: None.
+            classes (list[str], optional):
+                subset of classes to normalize over. Default: all classes.
+            none_class_weight (float, optional):
+                None class weight overriding the stored one. Default: None.
+
+        Returns:
+            Dictionary of class names and probabilities.
+        """
+        return _normalize(
+            self.unnormalized(
+                class_weights=class_weights,
+                classes=classes,
+                none_class_weight=none_class_weight,
+            )
+        )
+
+    def probability_errors(
+        self, class_weights=None, classes=None, none_class_weight=None
+    ):
+        """
+        Monte Carlo standard errors of the class probabilities, propagated to
+        first order through the normalization from the covariance of the
+        class integrals.
+
+        Args:
+            class_weights (dict, optional):
+                class weights overriding the stored ones. Default: None.
+            classes (list[str], optional):
+                subset of classes to normalize over. Default: all classes.
+            none_class_weight (float, optional):
+                None class weight overriding the stored one. Default: None.
+
+        Returns:
+            Dictionary of class names and probability standard errors.
+        """
+        scales = self._scales(class_weights, classes, none_class_weight)
+        names = list(scales.keys())
+        scale = np.array([scales[name] for name in names])
+        values = scale * np.array([self.evidence[name] for name in names])
+        covariance = np.outer(scale, scale) * np.array(
+            [[self.evidence_covariance[a][b] for b in names] for a in names]
+        )
+        normalization = np.sum(values)
+        jacobian = (
+            np.eye(len(names)) * normalization - values[:, np.newaxis]
+        ) / normalization**2
+        variances = np.einsum("ij,jk,ik->i", jacobian, covariance, jacobian)
+        errors = np.sqrt(np.maximum(variances, 0.0))
+        return {name: float(error) for name, error in zip(names, errors)}
+
+
+def classify_ensemble(
+    inference_data,
+    population_models,
+    parameters,
+    model_weights=None,
+    additive_uq=None,
+    executor=None,
+):
+    """
+    Classify one event against several population models at once.
+
+    The posterior marginal and the prior division are computed once and shared
+    by every model, and the per-class density evaluations of all models are
+    scheduled together, optionally on an executor.
+
+    Args:
+        inference_data (popclass.InferenceData):
+            popclass InferenceData object
+        population_models (list[popclass.PopulationModel]):
+            population models to classify against.
+        parameters (list):
+            Parameters to use for classification.
+        model_weights (list[float], optional):
+            relative weight of each model in the model average. Normalized
+            internally. Default: equal weights.
+        additive_uq (list[popclass.uq.additiveUQ], optional):
+            one UQ object (or None) per population model. Default: None.
+        executor (concurrent.futures.Executor, optional):
+            executor to evaluate the class densities on. If None, they are
+            evaluated serially. A process pool pickles the population models
+            for every task, so prefer ``SharedMemoryPopulationModel`` there.
+            Default: None.
+
+    Returns:
+        Dictionary with ``"models"``, the list of per-model class probability
+        dictionaries in the order of ``population_models``, and ``"average"``,
+        the model-weighted average class probabilities.
+
+    Raises:
+        ValueError: if ``model_weights`` or ``additive_uq`` do not match the
+            number of population models.
+    """
+    num_models = len(population_models)
+    if model_weights is None:
+        model_weights = np.ones(num_models)
+    model_weights = np.asarray(model_weights, dtype=float)
+    if model_weights.shape != (num_models,):
+        raise ValueError("model_weights must have one entry per population model.")
+    model_weights = model_weights / np.sum(model_weights)
+
+    if additive_uq is None:
+        additive_uq = [None] * num_models
+    if len(additive_uq) != num_models:
+        raise ValueError("additive_uq must have one entry per population model.")
+
+    posterior = inference_data.posterior.marginal(parameters)
+    importance_weights = _importance_weights(inference_data)
+
+    tasks = [
+        (population_model, class_name)
+        for population_model in population_models
+        for class_name in population_model.classes
+    ]
+
+    evaluate = functools.partial(_integrate_task, posterior, importance_weights)
+    mapper = map if executor is None else executor.map
+    integrals = iter(list(mapper(evaluate, tasks)))
+
+    model_probs = []
+    for population_model, uq in zip(population_models, additive_uq):
+        unnormalized_prob = {
+            class_name: next(integrals) * population_model.class_weight(class_name)
+            for class_name in population_model.classes
+        }
+        if uq:
+            unnormalized_prob = _apply_uq(
+                uq,
+                unnormalized_prob,
+                inference_data,
+                population_model,
+                parameters,
+                posterior,
+                importance_weights,
+            )
+        model_probs.append(_normalize(unnormalized_prob))
+
+    average = {}
+    for weight, class_prob in zip(model_weights, model_probs):
+        for class_name, value in class_prob.items():
+            average[class_name] = average.get(class_name, 0.0) + float(weight * value)
+
+    return {"models": model_probs, "average": average}
+
+
+def classify_subsets(
+    inference_data,
+    population_model,
+    parameter_subsets,
+    additive_uq=None,
+    executor=None,
+):
+    """
+    Classify one event with several parameter subsets in a single call.
+
+    The posterior is marginalized and validated once over the union of all
+    subsets, and each subset takes its columns from that marginal. The
+    per-subset class density evaluations are scheduled together, optionally on
+    an executor, and the fitted class estimators are reused from the
+    population model's cache.
+
+    Args:
+        inference_data (popclass.InferenceData):
+            popclass InferenceData object
+        population_model (popclass.PopulationModel):
+            popclass PopulationModel object
+        parameter_subsets (list[list[str]]):
+            Parameter lists to classify with.
+        additive_uq (dict, optional):
+            UQ object to apply for a subset, keyed by ``tuple(subset)``.
+            Subsets without an entry are classified without UQ. Default: None.
+        executor (concurrent.futures.Executor, optional):
+            executor to evaluate the class densities on. If None, they are
+            evaluated serially. A process pool pickles the population model
+            for every task, so prefer ``SharedMemoryPopulationModel`` there.
+            Default: None.
+
+    Returns:
+        Dictionary keyed by ``tuple(subset)`` with the class probability
+        dictionary for that subset.
+    """
+    additive_uq = {} if additive_uq is None else additive_uq
+    subsets = [tuple(subset) for subset in parameter_subsets]
+    union = list(dict.fromkeys(p for subset in subsets for p in subset))
+
+    posterior = inference_data.posterior.marginal(union)
+    importance_weights = _importance_weights(inference_data)
+    marginals = {}
+    for subset in subsets:
+        columns = [posterior.parameter_labels.index(p) for p in subset]
+        marginals[subset] = _MarginalSamples(
+            samples=posterior.samples[:, columns], parameter_labels=list(subset)
+        )
+
+    tasks = [
+        (marginals[subset], class_name)
+        for subset in subsets
+        for class_name in population_model.classes
+    ]
+    evaluate = functools.partial(
+        _integrate_subset_task, population_model, importance_weights
+    )
+    mapper = map if executor is None else executor.map
+    integrals = iter(list(mapper(evaluate, tasks)))
+
+    results = {}
+    for subset in subsets:
+        unnormalized_prob = {
+            class_name: next(integrals) * population_model.class_weight(class_name)
+            for class_name in population_model.classes
+        }
+        uq = additive_uq.get(subset)
+        if uq:
+            unnormalized_prob = _apply_uq(
+                uq,
+                unnormalized_prob,
+                inference_data,
+                population_model,
+                list(subset),
+                marginals[subset],
+                importance_weights,
+            )
+        results[subset] = _normalize(unnormalized_prob)
+
+    return results
+
+
+async def classify_async(
+    inference_data,
+    population_model,
+    parameters,
+    additive_uq=None,
+    executor=None,
+    timeout=None,
+):
+    """
+    Asynchronous ``classify`` for asyncio applications.
+
+    Posterior marginalization, density evaluation and uncertainty
+    quantification run in ``executor``, so the event loop is not blocked.
+    Calls made concurrently against the same population model, parameters and
+    executor are coalesced: their posterior samples are evaluated together in
+    one density evaluation per class. The result equals that of ``classify``.
+
+    Args:
+        inference_data (popclass.InferenceData):
+            popclass InferenceData object
+        population_model (popclass.PopulationModel):
+            popclass PopulationModel object
+        parameters (list):
+            Parameters to use for classification.
+        additive_uq (popclass.uq.additiveUQ, optional):
+            uncertainty quantification to apply. Default: None.
+        executor (concurrent.futures.Executor, optional):
+            executor running the density evaluations. A process pool pickles
+            the population model for every batch, so prefer a
+            ``SharedMemoryPopulationModel`` there. Default: the event loop's
+            default executor.
+        timeout (float, optional):
+            deadline in seconds for this call. Default: None.
+
+    Returns:
+        Dictionary of classes in ``PopulationModel.classes()`` and associated
+        probability.
+
+    Raises:
+        asyncio.TimeoutError: if the deadline passes. Cancelling the call (or
+            its deadline passing) drops its samples from batches not yet
+            started.
+    """
+    return await asyncio.wait_for(
+        _classify_async(
+            inference_data, population_model, parameters, additive_uq, executor
+        ),
+        timeout,
+    )
+
+
+async def classify_batch_async(
+    inference_data,
+    population_model,
+    parameters,
+    additive_uq=None,
+    executor=None,
+    timeout=None,
+):
+    """
+    Asynchronously classify several events against one population model.
+    The events are submitted together, so their density evaluations are
+    coalesced into shared batches.
+
+    Args:
+        inference_data (list[popclass.InferenceData]):
+            popclass InferenceData objects, one per event.
+        population_model (popclass.PopulationModel):
+            popclass PopulationModel object
+        parameters (list):
+            Parameters to use for classification.
+        additive_uq (popclass.uq.additiveUQ, optional):
+            uncertainty quantification to apply. Default: None.
+        executor (concurrent.futures.Executor, optional):
+            executor running the density evaluations. Default: the event
+            loop's default executor.
+        timeout (float, optional):
+            deadline in seconds for each event. Default: None.
+
+    Returns:
+        List of class probability dictionaries, in the order of ``inference_data``.
+    """
+    return list(
+        await asyncio.gather(
+            *[
+                classify_async(
+                    data,
+                    population_model,
+                    parameters,
+                    additive_uq=additive_uq,
+                    executor=executor,
+                    timeout=timeout,
+                )
+                for data in inference_data
+            ]
+        )
+    )
+
+
+async def _classify_async(
+    inference_data, population_model, parameters, additive_uq, executor
+):
+    loop = asyncio.get_running_loop()
+    loop_batchers = _batchers.setdefault(loop, {})
+    key = (id(population_model), id(executor), tuple(parameters))
+    if key not in loop_batchers:
+        loop_batchers[key] = _DensityBatcher(
+            loop, population_model, parameters, executor
+        )
+        # Later calls start a new batch once this one is flushed.
+        loop.call_soon(loop_batchers.pop, key, None)
+    # The posterior is marginalized in the executor, together with the batch.
+    posterior, importance_weights, integrals = await loop_batchers[key].evaluate(
+        inference_data
+    )
+
+    unnormalized_prob = {
+        class_name: integrals[class_name] * population_model.class_weight(class_name)
+        for class_name in population_model.classes
+    }
+    if additive_uq:
+        unnormalized_prob = await loop.run_in_executor(
+            executor,
+            _apply_uq,
+            additive_uq,
+            unnormalized_prob,
+            inference_data,
+            population_model,
+            parameters,
+            posterior,
+            importance_weights,
+        )
+    return _normalize(unnormalized_prob)
+
+
+class _DensityBatcher:
+    """
+    Coalesces classification requests made in the same event loop iteration
+    into one executor task, which prepares their posteriors and evaluates
+    their samples in one density evaluation per class.
+    """
+
+    def __init__(self, loop, population_model, parameters, executor):
+        self.loop = loop
+        self.population_model = population_model
+        self.parameters = list(parameters)
+        self.executor = executor
+        self._pending = []
+
+    def evaluate(self, inference_data):
+        future = self.loop.create_future()
+        if not self._pending:
+            self.loop.call_soon(self._flush)
+        self._pending.append((inference_data, future))
+        return future
+
+    def _flush(self):
+        batch = [
+            (inference_data, future)
+            for inference_data, future in self._pending
+            if not future.done()
+        ]
+        self._pending = []
+        if not batch:
+            return
+        result = self.loop.run_in_executor(
+            self.executor,
+            _integrate_batch,
+            self.population_model,
+            self.parameters,
+            [inference_data for inference_data, _ in batch],
+        )
+        result.add_done_callback(lambda result: self._resolve(batch, result))
+
+    def _resolve(self, batch, result):
+        if result.cancelled():
+            for _, future in batch:
+                future.cancel()
+            return
+        if result.exception() is not None:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(result.exception())
+            return
+        for (_, future), value in zip(batch, result.result()):
+            if future.done():
+                continue
+            if isinstance(value, Exception):
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+
+
+def _integrate_batch(population_model, parameters, inference_data):
+    """
+    Marginalize the posteriors of a batch of events and integrate every class
+    over them. The samples of events sharing a parameter order are evaluated
+    together, in one density evaluation per class.
+
+    Returns:
+        List with, per event, a tuple of the marginalized posterior, its
+        importance weights and the class integrals, or the exception raised
+        while preparing the event's posterior.
+    """
+    results = []
+    for data in inference_data:
+        try:
+            results.append(
+                (data.posterior.marginal(parameters), _importance_weights(data))
+            )
+        except Exception as error:
+            results.append(error)
+
+    groups = {}
+    for index, value in enumerate(results):
+        if not isinstance(value, Exception):
+            groups.setdefault(tuple(value[0].parameter_labels), []).append(index)
+    for labels, indices in groups.items():
+        sizes = [len(results[index][0].samples) for index in indices]
+        densities = _evaluate_classes(
+            population_model,
+            list(labels),
+            np.concatenate([results[index][0].samples for index in indices]),
+        )
+        offsets = np.cumsum([0] + sizes)
+        for index, start, stop in zip(indices, offsets[:-1], offsets[1:]):
+            posterior, importance_weights = results[index]
+            integrals = {
+                class_name: np.mean(density[start:stop] * importance_weights)
+                for class_name, density in densities.items()
+            }
+            results[index] = (posterior, importance_weights, integrals)
+    return results
+
+
+def _evaluate_classes(population_model, parameters, points):
+    """
+    Density of every class at the points.
+    """
+    return {
+        class_name: population_model.evaluate_density(
+            class_name=class_name, parameters=parameters, points=points
+        )
+        for class_name in population_model.classes
+    }
+
+
+def _apply_uq(
+    additive_uq,
+    unnormalized_prob,
+    inference_data,
+    population_model,
+    parameters,
+    posterior,
+    importance_weights,
+):
+    """
+    Apply an additive UQ, sharing the marginalized posterior and importance
+    weights through a ``UQContext`` if the UQ supports it.
+    """
+    if hasattr(additive_uq, "apply_uq_context"):
+        context = UQContext(
+            inference_data,
+            population_model,
+            parameters,
+            posterior=posterior,
+            importance_weights=importance_weights,
+        )
+        return additive_uq.apply_uq_context(unnormalized_prob, context)
+    additive_uq.apply_uq(
+        unnormalized_prob=unnormalized_prob,
+        inference_data=inference_data,
+        population_model=population_model,
+        parameters=parameters,
+    )
+    return unnormalized_prob
+
+
+def _importance_weights(inference_data):
+    """
+    Importance weights (inverse prior density times sample weights) of the
+    posterior samples.
+    """
+    return inference_data.importance_weights
+
+
+def _class_integrand(population_model, class_name, posterior, importance_weights):
+    """
+    Class density at every posterior sample, with the prior divided out.
+    """
+    class_kde = population_model.evaluate_density(
+        class_name=class_name,
+        parameters=posterior.parameter_labels,
+        points=posterior.samples,
+    )
+    return class_kde * importance_weights
+
+
+def _integrate_task(posterior, importance_weights, task):
+    """
+    Integrate a (population model, class name) task. Defined at module level
+    so process pool executors can pickle it.
+    """
+    population_model, class_name = task
+    return _integrate_class(population_model, class_name, posterior, importance_weights)
+
+
+def _integrate_subset_task(population_model, importance_weights, task):
+    """
+    Integrate a (marginal posterior, class name) task. Defined at module level
+    so process pool executors can pickle it.
+    """
+    posterior, class_name = task
+    return _integrate_class(population_model, class_name, posterior, importance_weights)
+
+
+def _integrate_class(population_model, class_name, posterior, importance_weights):
+    """
+    Monte Carlo integral of a class density over the posterior, with the prior
+    divided out.
+    """
+    return np.mean(
+        _class_integrand(population_model, class_name, posterior, importance_weights)
+    )
+
+
+def _normalize(unnormalized_prob):
+    """
+    Normalize unnormalized class probabilities to sum to unity.
+    """
     normalization = sum(unnormalized_prob.values())
-    class_prob = {
+    return {
         class_name: float(value / normalization)
         for class_name, value in unnormalized_prob.items()
     }
-    return class_prob
@@ -0,0 +1,276 @@
+"""
+Command-line batch classifier, installed as the ``popclass`` console command.
+Classifies a directory or manifest of posterior files saved with
+``InferenceData.to_asdf`` against a library or asdf population model, using a
+pool of worker processes. Results are streamed to a JSON lines output file,
+which doubles as the checkpoint: rerunning the same command skips every event
+already classified in the output and retries the events that failed.
+"""
+import argparse
+import json
+import os
+import sys
+import warnings
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+
+import asdf
+
+from popclass.cache import ResultCache
+from popclass.classify import classify
+from popclass.model import AVAILABLE_MODELS
+from popclass.model import MixturePopulationModel
+from popclass.model import PopulationModel
+from popclass.posterior import InferenceData
+
+_worker_state = {}
+
+
+def load_population_model(model):
+    """
+    Load a population model from the library or from an asdf file.
+
+    Args:
+        model (str):
+            name of a library model (see ``popclass.model.AVAILABLE_MODELS``) or
+            path to an asdf file written by ``PopulationModel.to_asdf`` or
+            ``MixturePopulationModel.to_asdf``.
+
+    Returns:
+        PopulationModel or MixturePopulationModel.
+    """
+    if model in AVAILABLE_MODELS:
+        return PopulationModel.from_library(model)
+    with asdf.open(model, lazy_load=True) as tree:
+        is_mixture = "class_mixtures" in tree
+    if is_mixture:
+        return MixturePopulationModel.from_asdf(model)
+    return PopulationModel.from_asdf(model)
+
+
+def find_events(source):
+    """
+    List the posterior files to classify.
+
+    Args:
+        source (str):
+            directory of ``.asdf`` posterior files, or a manifest text file with
+            one posterior file path per line. Blank lines and lines starting with
+            ``#`` are skipped, and relative paths are relative to the manifest.
+
+    Returns:
+        List of (event name, path) tuples. The event name is the path relative
+        to the directory, or the path as written in the manifest.
+    """
+    if os.path.isdir(source):
+        return [
+            (name, os.path.join(source, name))
+            for name in sorted(os.listdir(source))
+            if name.endswith(".asdf")
+        ]
+
+    base = os.path.dirname(os.path.abspath(source))
+    events = []
+    with open(source) as f:
+        for line in f:
+            name = line.strip()
+            if name and not name.startswith("#"):
+                events.append((name, os.path.join(base, name)))
+    return events
+
+
+def read_checkpoint(output):
+    """
+    Read the events already classified in an output file.
+
+    Only events with a ``probabilities`` record count as finished, so events
+    that failed are retried. Records without an event name are skipped with
+    a warning. A partially written last line, left by an interrupted run, is
+    truncated away so the file can be appended to.
+
+    Args:
+        output (str): path to the JSON lines output file.
+
+    Returns:
+        Set of finished event names.
+    """
+    finished = set()
+    if not os.path.exists(output):
+        return finished
+
+    good_bytes = 0
+    skipped = 0
+    with open(output, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            good_bytes += len(line)
+            if not isinstance(record, dict) or "event" not in record:
+                skipped += 1
+            elif "probabilities" in record:
+                finished.add(record["event"])
+    if good_bytes != os.path.getsize(output):
+        with open(output, "r+b") as f:
+            f.truncate(good_bytes)
+    if skipped:
+        warnings.warn(f"Skipped {skipped} records without an event name in {output}.")
+    return finished
+
+
+def _init_worker(model, parameters, cache_directory):
+    _worker_state["population_model"] = load_population_model(model)
+    _worker_state["parameters"] = parameters
+    _worker_state["cache"] = (
+        ResultCache(cache_directory) if cache_directory is not None else None
+    )
+
+
+def _classify_event(event):
+    name, path = event
+    try:
+        inference_data = InferenceData.from_asdf(path)
+        probabilities = classify(
+            inference_data=inference_data,
+            population_model=_worker_state["population_model"],
+            parameters=_worker_state["parameters"],
+            cache=_worker_state["cache"],
+        )
+    except Exception as error:
+        return {"event": name, "error": f"{type(error).__name__}: {error}"}
+    return {"event": name, "probabilities": probabilities}
+
+
+def run(
+    source,
+    model,
+    parameters,
+    output,
+    workers=1,
+    cache_directory=None,
+    max_pending=None,
+):
+    """
+    Classify every event in ``source`` not already in ``output``.
+
+    Args:
+        source (str): directory or manifest of posterior files, see ``find_events``.
+        model (str): library model name or asdf model path.
+        parameters (list[str]): parameters to use for classification.
+        output (str): JSON lines output file, appended to.
+        workers (int, optional):
+            number of worker processes. With 1, events are classified in this
+            process. Default: 1.
+        cache_directory (str, optional):
+            directory of a ``popclass.cache.ResultCache`` shared by the workers.
+            Default: None.
+        max_pending (int, optional):
+            maximum number of events submitted to the workers at once.
+            Default: 4 per worker.
+
+    Returns:
+        Tuple of the number of events classified and the number that failed.
+    """
+    finished = read_checkpoint(output)
+    events = [event for event in find_events(source) if event[0] not in finished]
+    initargs = (model, list(parameters), cache_directory)
+    classified, failed = 0, 0
+
+    with open(output, "a") as f:
+
+        def write(record):
+            nonlocal classified, failed
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            classified += 1
+            failed += "error" in record
+
+        if workers <= 1:
+            _init_worker(*initargs)
+            for event in events:
+                write(_classify_event(event))
+            return classified, failed
+
+        if max_pending is None:
+            max_pending = 4 * workers
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=initargs
+        ) as executor:
+            remaining = iter(events)
+            pending = set()
+            while True:
+                for event in remaining:
+                    pending.add(executor.submit(_classify_event, event))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future.result())
+
+    return classified, failed
+
+
+def main(argv=None):
+    """
+    Entry point of the ``popclass`` console command.
+
+    Args:
+        argv (list[str], optional): command-line arguments. Default: ``sys.argv[1:]``.
+
+    Returns:
+        Exit status: 0 if the output holds a classification of every event, 1
+        if any event is still unclassified after the run.
+    """
+    parser = argparse.ArgumentParser(
+        prog="popclass",
+        description="Classify a batch of posterior files saved with InferenceData.to_asdf.",
+    )
+    parser.add_argument(
+        "source", help="directory of .asdf posterior files, or a manifest of paths"
+    )
+    parser.add_argument(
+        "--model",
+        required=True,
+        help=f"library model ({', '.join(AVAILABLE_MODELS)}) or asdf model path",
+    )
+    parser.add_argument(
+        "--parameters",
+        required=True,
+        nargs="+",
+        help="parameters to use for classification",
+    )
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="JSON lines output file; rerunning resumes from it",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="number of worker processes"
+    )
+    parser.add_argument(
+        "--cache", default=None, help="result cache directory shared by the workers"
+    )
+    args = parser.parse_args(argv)
+
+    classified, failed = run(
+        source=args.source,
+        model=args.model,
+        parameters=args.parameters,
+        output=args.output,
+        workers=args.workers,
+        cache_directory=args.cache,
+    )
+    print(f"classified {classified} events, {failed} failed", file=sys.stderr)
+    finished = read_checkpoint(args.output)
+    unfinished = [name for name, _ in find_events(args.source) if name not in finished]
+    return 1 if unfinished else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,13 +4,28 @@ we must define a galactic model.
 ``popclass`` allows the user to either specify one of the models included with
 the library or supply their own, given that it is in ASDF file format.
 """
+import contextlib
+import copy
+import hashlib
+import threading
+import warnings
+import weakref
+from collections.abc import Mapping
+from multiprocessing import shared_memory
+
 import asdf
 import numpy as np
 import pkg_resources
+from scipy.special import logsumexp
 from scipy.stats import gaussian_kde
 from scipy.stats import multivariate_normal
+from sklearn.mixture import GaussianMixture
 from sklearn.neighbors import KernelDensity
 
+from popclass.cache import update_digest
+
+STATISTICS_QUANTILES = [0.01, 0.05, 0.16, 0.5, 0.84, 0.95, 0.99]
+
 AVAILABLE_MODELS = [
     "popsycle_singles_raithel18",
     "popsycle_singles_spera15",
@@ -49,41 +64,90 @@ class PopulationModel:
             density_estimator: (scipy.stats.gaussian_kde like):
                 Kernel density estimator used to compute density from
                 population data.
+
+        The dictionaries are copied, so updating the model (e.g. with
+        ``set_class_weight`` or ``add_class``) leaves the caller's unchanged.
         """
 
-        self._class_weights = class_weights
-        self._population_samples = population_samples
+        self._class_weights = copy.copy(class_weights)
+        self._population_samples = copy.copy(population_samples)
         self._density_estimator = density_estimator
         self._density_kwargs = density_kwargs
         self._parameters = parameters
         self._citation = citation
+        self._density_cache = {}
+        self._density_lock = threading.RLock()
+        self._fingerprints = {}
+        self._statistics = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_density_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._density_lock = threading.RLock()
 
     @classmethod
-    def from_asdf(cls, path):
+    def from_asdf(cls, path, classes=None):
         """
         Build population model from data in an asdf file.
         This file can be user-generated, but must adhere to the schema
-        of the files included in the library.
+        of the files included in the library. Compressed and reduced
+        precision files written by ``to_asdf`` are read transparently, with
+        the samples returned as float64.
 
         Args:
             path (str): path to the asdf file
+            classes (list[str], optional):
+                classes to load. Each class is stored in its own blocks, so
+                only these are read and decompressed. Default: all classes.
 
         Returns:
             PopulationModel populated with the data from the asdf file.
         """
 
-        with asdf.open(path, lazy_load=False) as tree:
-            population_samples = tree["class_data"]
+        with asdf.open(path, lazy_load=classes is not None, memmap=False) as tree:
+            if classes is None:
+                classes = list(tree["class_data"].keys())
+            population_samples = {
+                class_name: _stored_to_float64(tree["class_data"][class_name])
+                for class_name in classes
+            }
             parameters = tree["parameters"]
-            class_weights = tree["class_weights"]
+            class_weights = {
+                class_name: tree["class_weights"][class_name] for class_name in classes
+            }
             citation = tree["citation"]
+            stored_statistics = (
+                tree["class_statistics"] if "class_statistics" in tree else {}
+            )
+            statistics = {}
+            for class_name in classes:
+                if class_name not in stored_statistics:
+                    continue
+                class_statistics = _checked_statistics(
+                    stored_statistics[class_name],
+                    tree["class_data"][class_name],
+                    parameters,
+                )
+                if class_statistics is None:
+                    warnings.warn(
+                        f"Ignoring stored statistics of {class_name} in {path}, "
+                        "which do not match its samples."
+                    )
+                else:
+                    statistics[class_name] = class_statistics
 
-        return cls(
+        population_model = cls(
             population_samples=population_samples,
             parameters=parameters,
             class_weights=class_weights,
             citation=citation,
         )
+        population_model._statistics = statistics
+        return population_model
 
     @classmethod
     def from_library(cls, model_name, library_path=None):
@@ -175,6 +239,123 @@ class PopulationModel:
         """
         return self._class_weights[class_name]
 
+    def set_class_weight(self, class_name, class_weight):
+        """
+        Set the class weight for a given class. Fitted density estimators are
+        unaffected, as they do not depend on the class weights.
+
+        Args:
+            class_name (str): name of the class.
+            class_weight (float): new class weight, between [0,1].
+
+        Raises:
+            ValueError: if the class is not in the population model.
+        """
+        if class_name not in self.classes:
+            raise ValueError(f"{class_name} not in population model classes.")
+        self._class_weights[class_name] = class_weight
+
+    def add_class(self, class_name, samples, class_weight):
+        """
+        Add a new class to the population model. Cached structures of the
+        existing classes are kept.
+
+        Args:
+            class_name (str): name of the new class.
+            samples (np.ndarray):
+                parameter samples with shape (n_samples, n_parameters), with
+                the second dimension ordered as ``parameters``.
+            class_weight (float): class weight, between [0,1].
+
+        Raises:
+            ValueError: if the class already exists or the samples have the
+                wrong number of parameters.
+        """
+        if class_name in self.classes:
+            raise ValueError(f"{class_name} already in population model classes.")
+        self._population_samples[class_name] = self._check_new_samples(samples)
+        self._class_weights[class_name] = class_weight
+
+    def add_samples(self, class_name, samples):
+        """
+        Append samples to an existing class.
+
+        Only the cached structures of this class are invalidated. Cached density
+        estimators that provide an ``update(data)`` method (e.g.
+        ``MultivariateGaussianKernel``) are updated in place instead of refit.
+
+        Args:
+            class_name (str): name of the class.
+            samples (np.ndarray):
+                parameter samples with shape (n_samples, n_parameters), with
+                the second dimension ordered as ``parameters``.
+
+        Raises:
+            ValueError: if the class is not in the population model or the
+                samples have the wrong number of parameters.
+        """
+        if class_name not in self.classes:
+            raise ValueError(f"{class_name} not in population model classes.")
+        new_samples = self._check_new_samples(samples)
+        self._population_samples[class_name] = np.concatenate(
+            [self._population_samples[class_name], new_samples]
+        )
+        self._invalidate_class(class_name, new_samples)
+
+    def _invalidate_class(self, class_name, new_samples):
+        """
+        Update or drop the cached structures of a class after samples were added.
+        """
+        with self._density_lock:
+            for key in [key for key in self._density_cache if key[0] == class_name]:
+                estimator = self._density_cache[key]
+                if hasattr(estimator, "update"):
+                    _, indices, _ = np.intersect1d(
+                        self.parameters, key[1], return_indices=True
+                    )
+                    order = np.array(key[1]).argsort().argsort()
+                    estimator.update(new_samples[:, indices][:, order].swapaxes(0, 1))
+                else:
+                    del self._density_cache[key]
+        self._fingerprints.pop(class_name, None)
+        self._statistics.pop(class_name, None)
+
+    def _check_new_samples(self, samples):
+        samples = np.atleast_2d(samples)
+        if samples.shape[1] != len(self.parameters):
+            raise ValueError(
+                f"Samples must have shape (n_samples, {len(self.parameters)})."
+            )
+        return samples
+
+    def density_estimator(self, class_name, parameters):
+        """
+        Return the fitted density estimator for a class over a set of parameters.
+
+        The estimator is built from the class samples on first use and cached,
+        so repeated evaluations for the same class and parameters do not refit.
+        Fitting is guarded by a lock, so threads sharing the model fit each
+        estimator once.
+
+        Args:
+            class_name (str):
+                name of class to get the density estimator for.
+            parameters (list[str]):
+                parameters the estimator is built over. Order sets the order
+                of the dimensions the estimator expects.
+
+        Returns:
+            Fitted density estimator (scipy.stats.gaussian_kde like).
+        """
+        key = (class_name, _parameter_key(parameters))
+        with self._density_lock:
+            if key not in self._density_cache:
+                class_samples = self.samples(class_name, parameters).swapaxes(0, 1)
+                self._density_cache[key] = self._density_estimator(
+                    class_samples, **self._density_kwargs
+                )
+            return self._density_cache[key]
+
     def evaluate_density(self, class_name, parameters, points):
         """
         Evaluate the kernel density estimate of a point
@@ -193,117 +374,1630 @@ class PopulationModel:
         Returns:
             density_evaluation (np.ndarray)
         """
-        class_samples = self.samples(class_name, parameters).swapaxes(0, 1)
-        kernel = self._density_estimator(class_samples, **self._density_kwargs)
+        kernel = self.density_estimator(class_name, parameters)
         return kernel.evaluate(points.swapaxes(0, 1))
 
-    def to_asdf(self, path, model_name):
+    def class_statistics(self, class_name, parameters=None):
+        """
+        Return summary statistics of the samples of a class.
+
+        The statistics are computed over all model parameters once, cached,
+        and saved with ``to_asdf``, so they are not recomputed when the model
+        is loaded again. Stored statistics whose shapes, parameters, count or
+        storage type do not match the stored samples are ignored and
+        recomputed.
+
+        Args:
+            class_name (str): name of the class.
+            parameters (list[str], optional):
+                parameters to return statistics for, setting their order.
+                Default: all model parameters.
+
+        Returns:
+            Dictionary with the sample ``count``, per parameter ``min``,
+            ``max`` and ``mean`` arrays, the ``covariance`` matrix, and the
+            ``quantiles`` of shape (len(quantile_levels), len(parameters)) at
+            ``quantile_levels`` (``STATISTICS_QUANTILES``).
+        """
+        if class_name not in self._statistics:
+            self._statistics[class_name] = self._compute_statistics(class_name)
+        statistics = self._statistics[class_name]
+        if parameters is None:
+            return statistics
+
+        indices = [list(self.parameters).index(p) for p in _parameter_key(parameters)]
+        return {
+            "count": statistics["count"],
+            "min": statistics["min"][indices],
+            "max": statistics["max"][indices],
+            "mean": statistics["mean"][indices],
+            "covariance": statistics["covariance"][np.ix_(indices, indices)],
+            "quantile_levels": statistics["quantile_levels"],
+            "quantiles": statistics["quantiles"][:, indices],
+        }
+
+    def _compute_statistics(self, class_name):
+        return _sample_statistics(self.samples(class_name, self.parameters))
+
+    def bounds(self, parameters, padding=0.1):
+        """
+        Return the extent of the samples of all classes, from the cached class
+        statistics.
+
+        Args:
+            parameters (list[str]): parameters to return bounds for.
+            padding (float, optional):
+                fraction of the extent added beyond the minimum and maximum.
+                Default: 0.1.
+
+        Returns:
+            numpy.ndarray of lower and upper bounds, shape (len(parameters), 2).
+        """
+        statistics = [
+            self.class_statistics(class_name, parameters) for class_name in self.classes
+        ]
+        lower = np.min([stats["min"] for stats in statistics], axis=0)
+        upper = np.max([stats["max"] for stats in statistics], axis=0)
+        extent = upper - lower
+        return np.column_stack([lower - padding * extent, upper + padding * extent])
+
+    def class_fingerprint(self, class_name):
+        """
+        Return a content hash of a class.
+
+        The hash covers the class samples, the parameter names and the density
+        estimator configuration, so it changes whenever a density computed for
+        the class could change. It is computed once and cached.
+
+        Args:
+            class_name (str): name of class to fingerprint.
+
+        Returns:
+            Hex digest string.
+        """
+        if class_name not in self._fingerprints:
+            samples = np.ascontiguousarray(self._population_samples[class_name])
+            digest = hashlib.sha256()
+            digest.update(repr((class_name, list(self._parameters))).encode())
+            digest.update(repr((samples.dtype.str, samples.shape)).encode())
+            digest.update(samples.tobytes())
+            digest.update(_estimator_description(self).encode())
+            self._fingerprints[class_name] = digest.hexdigest()
+        return self._fingerprints[class_name]
+
+    @property
+    def fingerprint(self):
+        """
+        Return a content hash of the whole population model.
+
+        Combines the fingerprints of every class with the class weights.
+
+        Returns:
+            Hex digest string.
+        """
+        digest = hashlib.sha256()
+        for class_name in self.classes:
+            digest.update(self.class_fingerprint(class_name).encode())
+            digest.update(repr(float(self.class_weight(class_name))).encode())
+        return digest.hexdigest()
+
+    def to_asdf(self, path, model_name, compression=None, dtype=None):
         """
-        Save population model to asdf file.
+        Save population model to asdf file. Every class is written to its own
+        blocks, so readers can load and decompress one class at a time.
 
         Args:
             path (str): path to save the asdf file
             model_name (str): Name of the model to be saving in the asdf file.
+            compression (str, optional):
+                asdf block compression, "zlib", "bzp2" or "lz4" (requires the
+                ``lz4`` package). Default: None.
+            dtype (str or numpy.dtype, optional):
+                floating point type to store the class samples as, e.g.
+                "float32" to halve the file size. The stored type is recorded as
+                ``storage_dtype`` and ``from_asdf`` converts back to float64.
+                The saved class statistics are computed from the converted
+                samples, so they match the samples that load back.
+                Default: None (store as is).
         """
+        class_data = dict(self._population_samples.items())
+        if dtype is not None:
+            class_data = {
+                class_name: np.asarray(samples, dtype=dtype)
+                for class_name, samples in class_data.items()
+            }
+        if dtype is None:
+            statistics = {
+                class_name: self.class_statistics(class_name)
+                for class_name in self.classes
+            }
+        else:
+            statistics = {
+                class_name: _sample_statistics(_stored_to_float64(samples))
+                for class_name, samples in class_data.items()
+            }
         tree = {
-            "class_data": self._population_samples,
+            "class_data": class_data,
             "parameters": self._parameters,
             "class_weights": self._class_weights,
             "model_name": model_name,
             "citation": self._citation,
+            "class_statistics": {
+                class_name: dict(
+                    class_statistics,
+                    parameters=list(self._parameters),
+                    dtype=str(np.asarray(class_data[class_name]).dtype),
+                )
+                for class_name, class_statistics in statistics.items()
+            },
         }
+        if dtype is not None:
+            tree["storage_dtype"] = np.dtype(dtype).name
         af = asdf.AsdfFile(tree)
-        af.write_to(path)
+        af.write_to(path, all_array_compression=compression)
 
+    @classmethod
+    def from_hdf5(cls, path, **kwargs):
+        """
+        Open a population model stored in an HDF5 file without loading it.
+        Samples are read on demand, one parameter column and row block at a
+        time. Requires ``h5py``.
 
-class MultivariateGaussianKernel:
-    """An example of defining a custom kernel for a PopulationModel. Wraps scipy.stats.multivariate_normal to conform to the template needed by PopulationModel and classify."""
+        Args:
+            path (str): path to an HDF5 file written by ``PopulationModel.to_hdf5``.
+            kwargs: extra arguments passed to ``HDF5PopulationModel``.
 
-    def __init__(self, data):
-        """Initialization.
+        Returns:
+            HDF5PopulationModel backed by the file.
+        """
+        return HDF5PopulationModel(path, **kwargs)
+
+    def to_hdf5(self, path, model_name, chunk_rows=2**16, compression=None):
+        """
+        Save population model to an HDF5 file with one chunked dataset per
+        class and parameter, readable with ``PopulationModel.from_hdf5``.
+        Requires ``h5py``.
 
         Args:
-            data (numpy.array): shape [# dims, # samples]. Same as scipy.stats.gaussian_kde
-        Returns:
-            None
+            path (str): path to save the HDF5 file
+            model_name (str): Name of the model to be saving in the HDF5 file.
+            chunk_rows (int, optional): rows per HDF5 chunk. Default: 65536.
+            compression (str, optional): HDF5 compression filter. Default: None.
         """
-        self.mean = np.mean(data, axis=1)
-        self.cov = np.cov(data)
+        h5py = _import_h5py()
 
-    def evaluate(self, pts):
-        """Evaluation method for calculating the pdf of the kernel at a set of points.
+        with h5py.File(path, "w") as f:
+            f.attrs["model_name"] = model_name
+            f.attrs["parameters"] = list(self.parameters)
+            f.attrs["citation"] = list(self.citation or [])
+            f.attrs["classes"] = self.classes
+            class_data = f.create_group("class_data")
+            for class_name in self.classes:
+                group = class_data.create_group(class_name)
+                group.attrs["class_weight"] = self.class_weight(class_name)
+                class_samples = self.samples(class_name, self.parameters)
+                for index, parameter in enumerate(self.parameters):
+                    group.create_dataset(
+                        parameter,
+                        data=class_samples[:, index],
+                        chunks=(min(chunk_rows, max(len(class_samples), 1)),),
+                        maxshape=(None,),
+                        compression=compression,
+                    )
+
+    def to_mixture_model(self, n_components=20, **kwargs):
+        """
+        Compress the population model into a Gaussian mixture per class.
 
         Args:
-            pts (numpy.array): array of points to evaluate the density on. Shape: [# dimensions, # of points].
+            n_components (int):
+                number of Gaussian components per class. Default: 20.
+            kwargs:
+                extra arguments passed to ``GaussianMixtureDensity``, also
+                used when the mixture model later refits a class.
+
         Returns:
-            evaluated_density (numpy.array): the probability density values at each of the corresponding points.
+            MixturePopulationModel with one mixture over all parameters per class.
         """
-        return multivariate_normal.pdf(pts.T, mean=self.mean, cov=self.cov)
+        class_mixtures = {}
+        class_counts = {}
+        for class_name in self.classes:
+            class_samples = self.samples(class_name, self.parameters)
+            class_mixtures[class_name] = GaussianMixtureDensity(
+                class_samples.swapaxes(0, 1), n_components=n_components, **kwargs
+            )
+            class_counts[class_name] = len(class_samples)
 
+        return MixturePopulationModel(
+            class_mixtures=class_mixtures,
+            class_weights=self._class_weights,
+            parameters=self.parameters,
+            citation=self.citation,
+            class_counts=class_counts,
+            n_components=n_components,
+            mixture_kwargs=kwargs,
+        )
 
-def validate_asdf_population_model(asdf_object):
-    """
-    Check if PopulationModel asdf file is valid.
+    def to_shared_memory(self, estimator_parameters=None):
+        """
+        Copy the population model into shared memory for multi-process workers.
 
-    Args:
-        asdf_object (asdf): asdf file to validate against a
-            Population model required format.
+        Args:
+            estimator_parameters (list[list[str]], optional):
+                parameter lists whose density estimator inputs are also placed
+                in shared memory, so workers fit their estimators on the shared
+                arrays rather than on private copies. Default: None.
 
-    Returns:
-        True if asdf is valid. False otherwise.
+        Returns:
+            SharedMemoryPopulationModel owning the shared memory segments.
+        """
+        return SharedMemoryPopulationModel(
+            population_samples=self._population_samples,
+            class_weights=self._class_weights,
+            parameters=self._parameters,
+            citation=self._citation,
+            density_estimator=self._density_estimator,
+            density_kwargs=self._density_kwargs,
+            estimator_parameters=estimator_parameters,
+        )
+
+
+class SharedMemoryPopulationModel(PopulationModel):
+    """
+    PopulationModel whose class samples live in ``multiprocessing.shared_memory``
+    segments. Pickling only sends the segment names and metadata, and unpickling
+    attaches to the same segments, so every worker process reads one copy of the
+    model. The creating instance owns the segments and unlinks them on
+    ``close``, when used as a context manager, or when it is garbage collected.
+    Usually built with ``PopulationModel.to_shared_memory``.
     """
-    valid_key_set = [
-        "model_name",
-        "class_weights",
-        "parameters",
-        "class_data",
-        "citation",
-    ]
-    keys_present = [name in asdf_object for name in valid_key_set]
 
-    if all(keys_present):
-        number_of_classes = len(asdf_object["class_data"])
-        number_of_parameters = len(asdf_object["parameters"])
-        # valid_class_data = [isinstance(data, np.ndarray) for data in asdf_object['class_data'].values()]
-        valid_class_data_dim = [
-            data.shape[1] == number_of_parameters
-            for data in asdf_object["class_data"].values()
-        ]
+    def __init__(
+        self,
+        population_samples,
+        class_weights,
+        parameters,
+        citation=None,
+        density_estimator=gaussian_kde,
+        density_kwargs={},
+        estimator_parameters=None,
+    ):
+        """
+        Initialize SharedMemoryPopulationModel, copying the samples into new
+        shared memory segments.
 
-        # Validating the citation field
-        citation = asdf_object["citation"]
-        valid_citation = isinstance(citation, list) and all(
-            isinstance(doi, str) for doi in citation
+        Args:
+            population_samples (dict):
+                key is a class name and value is numpy array of parameter
+                samples with shape (n_samples, n_parameters).
+            class_weights (dict):
+                key is a class name and value is a number between [0,1].
+            parameters (list(str)):
+                list of parameter names sets the order for the second dimension
+                in population_samples.
+            citation (list):
+                list of DOI entries for citing the model.
+            density_estimator: (scipy.stats.gaussian_kde like):
+                Kernel density estimator used to compute density from
+                population data.
+            density_kwargs (dict):
+                extra arguments for the density estimator.
+            estimator_parameters (list[list[str]], optional):
+                parameter lists whose density estimator inputs (class samples of
+                shape (n_parameters, n_samples)) are also placed in shared memory.
+        """
+        super().__init__(
+            population_samples={},
+            class_weights=class_weights,
+            parameters=parameters,
+            citation=citation,
+            density_estimator=density_estimator,
+            density_kwargs=density_kwargs,
         )
+        segments = []
+        self._handles = {}
+        self._population_samples = {}
+        for class_name, samples in population_samples.items():
+            self._population_samples[class_name] = _to_shared_array(
+                samples, segments, self._handles, ("samples", class_name)
+            )
+        self._estimator_inputs = {}
+        for estimator_parameter_list in estimator_parameters or []:
+            for class_name in self.classes:
+                class_samples = self.samples(class_name, estimator_parameter_list)
+                key = (class_name, _parameter_key(estimator_parameter_list))
+                self._estimator_inputs[key] = _to_shared_array(
+                    class_samples.swapaxes(0, 1),
+                    segments,
+                    self._handles,
+                    ("estimator", key),
+                )
+        self._attach_segments(segments, owner=True)
 
-        valid = all(valid_class_data_dim) and valid_citation
-    else:
-        valid = False
-    return valid
-
+    def _attach_segments(self, segments, owner):
+        self._segments = segments
+        self._owner = owner
+        self._finalizer = weakref.finalize(
+            self, _release_shared_memory, segments, owner
+        )
 
-class CustomKernelDensity:
-    """An example of defining a custom kernel for a PopulationModel. Wraps sklearn.neighbors.KernelDensity to conform to the template needed by PopulationModel and classify."""
+    def density_estimator(self, class_name, parameters):
+        """
+        Return the fitted density estimator for a class over a set of parameters.
+        If the estimator input was placed in shared memory, the estimator is fit
+        directly on the shared array.
 
-    def __init__(self, data, **kwargs):
-        """Initialization.
         Args:
-            data (numpy.array): shape [# dims, # samples]. Same as scipy.stats.gaussian_kde
-            kernel_type (str): matches 'kernel' argument of KernelDensity. Default: "tophat".
-            bandwidth (float): matches 'bandwidth' argument of KernelDensity. Default: 0.4.
+            class_name (str):
+                name of class to get the density estimator for.
+            parameters (list[str]):
+                parameters the estimator is built over.
+
         Returns:
-            None
+            Fitted density estimator (scipy.stats.gaussian_kde like).
         """
-        self.data = data
-        self.density_kwargs = kwargs
+        key = (class_name, _parameter_key(parameters))
+        with self._density_lock:
+            if key in self._estimator_inputs and key not in self._density_cache:
+                self._density_cache[key] = self._density_estimator(
+                    self._estimator_inputs[key], **self._density_kwargs
+                )
+            return super().density_estimator(class_name, parameters)
 
-    def evaluate(self, pts):
-        """Evaluation method for calculating the pdf of the kernel at a set of points.
+    def add_class(self, class_name, samples, class_weight):
+        """
+        Add a new class, copying its samples into a new shared memory segment.
+        Only the owning instance can add classes, and only copies pickled
+        afterwards see the new class.
 
         Args:
-            pts (numpy.array): array of points to evaluate the density on. Shape: [# dimensions, # of points].
-        Returns:
-            evaluated_density (numpy.array): the probability density values at each of the corresponding points.
+            class_name (str): name of the new class.
+            samples (np.ndarray):
+                parameter samples with shape (n_samples, n_parameters), with
+                the second dimension ordered as ``parameters``.
+            class_weight (float): class weight, between [0,1].
+
+        Raises:
+            ValueError: if this instance does not own the shared memory, the
+                class already exists or the samples have the wrong number of
+                parameters.
+        """
+        self._check_owner()
+        super().add_class(class_name, samples, class_weight)
+        self._share_samples(class_name)
+
+    def add_samples(self, class_name, samples):
+        """
+        Append samples to an existing class, moving the class into a new shared
+        memory segment. Only the owning instance can add samples, and only copies
+        pickled afterwards see them. The previous segment is released on ``close``.
+
+        Args:
+            class_name (str): name of the class.
+            samples (np.ndarray):
+                parameter samples with shape (n_samples, n_parameters), with
+                the second dimension ordered as ``parameters``.
+
+        Raises:
+            ValueError: if this instance does not own the shared memory, the
+                class is not in the population model or the samples have the
+                wrong number of parameters.
+        """
+        self._check_owner()
+        super().add_samples(class_name, samples)
+        for key in [key for key in self._estimator_inputs if key[0] == class_name]:
+            del self._estimator_inputs[key]
+            del self._handles[("estimator", key)]
+        self._share_samples(class_name)
+
+    def _check_owner(self):
+        if not self._owner:
+            raise ValueError(
+                "Only the instance that created the shared memory can update it."
+            )
+
+    def _share_samples(self, class_name):
+        self._population_samples[class_name] = _to_shared_array(
+            self._population_samples[class_name],
+            self._segments,
+            self._handles,
+            ("samples", class_name),
+        )
+
+    def close(self):
+        """
+        Release the shared memory. The owning instance also unlinks the
+        segments, after which other processes can no longer attach to them.
         """
-        kernel = KernelDensity(**self.density_kwargs).fit(self.data.T)
-        return np.exp(kernel.score_samples(pts.T))
+        self._density_cache.clear()
+        self._population_samples = {}
+        self._estimator_inputs = {}
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __reduce__(self):
+        state = {
+            "class_weights": self._class_weights,
+            "parameters": self._parameters,
+            "citation": self._citation,
+            "density_estimator": self._density_estimator,
+            "density_kwargs": self._density_kwargs,
+            "handles": self._handles,
+        }
+        return (_attach_shared_population_model, (state,))
+
+
+def _to_shared_array(array, segments, handles, key):
+    """
+    Copy an array into a new shared memory segment and return a view on it.
+    The segment is appended to segments and its (name, shape, dtype) handle
+    stored in handles under key.
+    """
+    array = np.ascontiguousarray(array)
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+    shared[...] = array
+    segments.append(segment)
+    handles[key] = (segment.name, array.shape, array.dtype.str)
+    return shared
+
+
+def _attach_shared_memory(name):
+    """
+    Attach to an existing shared memory segment without taking ownership.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no ``track`` argument. Processes started by
+        # multiprocessing share the owner's resource tracker, so attaching
+        # does not hand cleanup to this process.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _attach_shared_population_model(state):
+    """
+    Rebuild a SharedMemoryPopulationModel from pickled segment handles.
+    """
+    segments = {}
+
+    def attach(handle):
+        name, shape, dtype = handle
+        if name not in segments:
+            segments[name] = _attach_shared_memory(name)
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segments[name].buf)
+
+    model = SharedMemoryPopulationModel.__new__(SharedMemoryPopulationModel)
+    PopulationModel.__init__(
+        model,
+        population_samples={},
+        class_weights=state["class_weights"],
+        parameters=state["parameters"],
+        citation=state["citation"],
+        density_estimator=state["density_estimator"],
+        density_kwargs=state["density_kwargs"],
+    )
+    model._handles = state["handles"]
+    model._estimator_inputs = {}
+    for (kind, key), handle in model._handles.items():
+        if kind == "samples":
+            model._population_samples[key] = attach(handle)
+        else:
+            model._estimator_inputs[key] = attach(handle)
+    model._attach_segments(list(segments.values()), owner=False)
+    return model
+
+
+def _release_shared_memory(segments, unlink):
+    """
+    Close shared memory segments and, for the owner, unlink them.
+    """
+    for segment in segments:
+        try:
+            segment.close()
+        except BufferError:
+            # Arrays handed out by this process still reference the buffer;
+            # the mapping is released when they are garbage collected.
+            pass
+        if unlink:
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _import_h5py():
+    """
+    Import the optional ``h5py`` dependency of the HDF5 storage.
+    """
+    try:
+        import h5py
+    except ImportError as error:
+        raise ImportError(
+            "HDF5 storage requires h5py. Install it with `pip install popclass[hdf5]`."
+        ) from error
+    return h5py
+
+
+def _sample_statistics(samples):
+    """
+    Summary statistics of class samples of shape (n_samples, n_parameters).
+    """
+    return {
+        "count": len(samples),
+        "min": np.min(samples, axis=0),
+        "max": np.max(samples, axis=0),
+        "mean": np.mean(samples, axis=0),
+        "covariance": np.atleast_2d(np.cov(samples.T)),
+        "quantile_levels": np.asarray(STATISTICS_QUANTILES),
+        "quantiles": np.quantile(samples, STATISTICS_QUANTILES, axis=0),
+    }
+
+
+def _checked_statistics(stored, samples, parameters):
+    """
+    Stored class statistics converted to arrays, or None if they do not match
+    the stored samples: missing keys, other parameters or shapes, or a
+    different count or storage type than the samples. Only the array metadata
+    of the samples is inspected, so no sample data is read.
+    """
+    num_parameters = len(parameters)
+    try:
+        # Files written before the labels were stored carry no "parameters"
+        # or "dtype".
+        if "parameters" in stored and list(stored["parameters"]) != list(parameters):
+            return None
+        if "dtype" in stored and np.dtype(stored["dtype"]) != np.dtype(samples.dtype):
+            return None
+        statistics = {
+            key: int(stored[key]) if key == "count" else np.array(stored[key])
+            for key in ["count", "min", "max", "mean", "covariance"]
+            + ["quantile_levels", "quantiles"]
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    num_levels = statistics["quantile_levels"].shape
+    shapes = {
+        "min": (num_parameters,),
+        "max": (num_parameters,),
+        "mean": (num_parameters,),
+        "covariance": (num_parameters, num_parameters),
+        "quantile_levels": num_levels,
+        "quantiles": num_levels + (num_parameters,),
+    }
+    if any(statistics[key].shape != shape for key, shape in shapes.items()):
+        return None
+    if statistics["quantile_levels"].ndim != 1:
+        return None
+    if tuple(samples.shape) != (statistics["count"], num_parameters):
+        return None
+    return statistics
+
+
+def _stored_to_float64(samples):
+    """
+    Read stored class samples into memory as float64.
+    """
+    samples = np.asarray(samples)
+    if samples.dtype != np.float64 and np.issubdtype(samples.dtype, np.floating):
+        return samples.astype(np.float64)
+    return np.array(samples)
+
+
+def _parameter_key(parameters):
+    """
+    Hashable key for a parameter selection, accepting a single name or a list.
+    """
+    return tuple(np.atleast_1d(parameters).tolist())
+
+
+def _estimator_description(population_model):
+    """
+    Stable text description of a model's density estimator and its kwargs.
+    """
+    estimator = population_model._density_estimator
+    name = getattr(estimator, "__qualname__", type(estimator).__qualname__)
+    module = getattr(estimator, "__module__", "")
+    digest = hashlib.sha256()
+    update_digest(digest, dict(population_model._density_kwargs))
+    return f"{module}.{name}:{digest.hexdigest()}"
+
+
+class MultivariateGaussianKernel:
+    """An example of defining a custom kernel for a PopulationModel. Wraps scipy.stats.multivariate_normal to conform to the template needed by PopulationModel and classify."""
+
+    def __init__(self, data):
+        """Initialization.
+
+        Args:
+            data (numpy.array): shape [# dims, # samples]. Same as scipy.stats.gaussian_kde
+        Returns:
+            None
+        """
+        self.mean = np.mean(data, axis=1)
+        self.cov = np.cov(data)
+        self.n = np.shape(data)[1]
+
+    def update(self, data):
+        """Exactly update the mean and covariance with additional samples, without the original data.
+
+        Args:
+            data (numpy.array): new samples, shape [# dims, # samples].
+        Returns:
+            None
+        """
+        data = np.atleast_2d(data)
+        n_new = data.shape[1]
+        n_total = self.n + n_new
+        mean_new = np.mean(data, axis=1)
+        deviations = data - mean_new[:, np.newaxis]
+        delta = np.atleast_1d(mean_new - self.mean)
+        scatter = (
+            np.atleast_2d(self.cov) * (self.n - 1)
+            + deviations @ deviations.T
+            + np.outer(delta, delta) * self.n * n_new / n_total
+        )
+        self.mean = (self.n * self.mean + n_new * mean_new) / n_total
+        self.cov = np.reshape(scatter / (n_total - 1), np.shape(self.cov))
+        self.n = n_total
+
+    def evaluate(self, pts):
+        """Evaluation method for calculating the pdf of the kernel at a set of points.
+
+        Args:
+            pts (numpy.array): array of points to evaluate the density on. Shape: [# dimensions, # of points].
+        Returns:
+            evaluated_density (numpy.array): the probability density values at each of the corresponding points.
+        """
+        return multivariate_normal.pdf(pts.T, mean=self.mean, cov=self.cov)
+
+
+class GaussianMixtureDensity:
+    """Gaussian mixture density estimator for a PopulationModel, the multi-component generalization of MultivariateGaussianKernel. Wraps sklearn.mixture.GaussianMixture for fitting, then evaluates with precomputed Cholesky factors so the cost scales with the number of components rather than the number of population samples."""
+
+    def __init__(
+        self,
+        data,
+        n_components=20,
+        min_samples_per_component=20,
+        random_state=0,
+        **kwargs,
+    ):
+        """Initialization. Fits the mixture to the data.
+
+        Args:
+            data (numpy.array): shape [# dims, # samples]. Same as scipy.stats.gaussian_kde
+            n_components (int): maximum number of Gaussian components. Default: 20.
+            min_samples_per_component (int): the number of components is reduced so that each has at least this many samples on average, which keeps sparse classes from collapsing onto single samples. Default: 20.
+            random_state (int): seed for the mixture fit. Default: 0.
+            kwargs: extra arguments passed to sklearn.mixture.GaussianMixture.
+        Returns:
+            None
+        """
+        data = np.atleast_2d(data)
+        n_components = max(
+            1, min(n_components, data.shape[1] // min_samples_per_component)
+        )
+        mixture = GaussianMixture(
+            n_components=n_components,
+            covariance_type="full",
+            random_state=random_state,
+            **kwargs,
+        ).fit(data.T)
+        self._set_components(mixture.weights_, mixture.means_, mixture.covariances_)
+
+    @classmethod
+    def from_components(cls, weights, means, covariances):
+        """Build a mixture directly from its components.
+
+        Args:
+            weights (numpy.array): component weights, shape [# components].
+            means (numpy.array): component means, shape [# components, # dims].
+            covariances (numpy.array): component covariances, shape [# components, # dims, # dims].
+        Returns:
+            GaussianMixtureDensity
+        """
+        mixture = cls.__new__(cls)
+        mixture._set_components(weights, means, covariances)
+        return mixture
+
+    def _set_components(self, weights, means, covariances):
+        self.weights = np.asarray(weights, dtype=float)
+        self.means = np.asarray(means, dtype=float)
+        self.covariances = np.asarray(covariances, dtype=float)
+        cholesky = np.linalg.cholesky(self.covariances)
+        self._inverse_cholesky = np.linalg.inv(cholesky)
+        ndim = self.means.shape[1]
+        self._log_normalization = (
+            np.log(self.weights)
+            - 0.5 * ndim * np.log(2 * np.pi)
+            - np.sum(np.log(np.diagonal(cholesky, axis1=1, axis2=2)), axis=1)
+        )
+
+    def marginal(self, indices):
+        """Exact marginal mixture over a subset of the dimensions.
+
+        Args:
+            indices (list[int]): dimensions to keep, in the order of the returned mixture.
+        Returns:
+            GaussianMixtureDensity
+        """
+        indices = np.asarray(indices)
+        return GaussianMixtureDensity.from_components(
+            self.weights,
+            self.means[:, indices],
+            self.covariances[:, indices][:, :, indices],
+        )
+
+    def logpdf(self, pts):
+        """Log-density of the mixture at a set of points.
+
+        Args:
+            pts (numpy.array): array of points to evaluate the density on. Shape: [# dimensions, # of points].
+        Returns:
+            evaluated_log_density (numpy.array): the log probability density values at each of the corresponding points.
+        """
+        pts = np.atleast_2d(pts)
+        diff = pts.T[np.newaxis, :, :] - self.means[:, np.newaxis, :]
+        whitened = np.einsum("knd,ked->kne", diff, self._inverse_cholesky)
+        mahalanobis = np.sum(whitened**2, axis=-1)
+        return logsumexp(
+            self._log_normalization[:, np.newaxis] - 0.5 * mahalanobis, axis=0
+        )
+
+    def evaluate(self, pts):
+        """Evaluation method for calculating the pdf of the mixture at a set of points.
+
+        Args:
+            pts (numpy.array): array of points to evaluate the density on. Shape: [# dimensions, # of points].
+        Returns:
+            evaluated_density (numpy.array): the probability density values at each of the corresponding points.
+        """
+        return np.exp(self.logpdf(pts))
+
+    def sample(self, size, random_state=0):
+        """Draw samples from the mixture.
+
+        Args:
+            size (int): number of samples.
+            random_state (int): seed. Default: 0.
+        Returns:
+            samples (numpy.array): shape [size, # dims].
+        """
+        rng = np.random.default_rng(random_state)
+        components = rng.choice(len(self.weights), size=size, p=self.weights)
+        standard = rng.standard_normal((size, self.means.shape[1]))
+        cholesky = np.linalg.cholesky(self.covariances)
+        return self.means[components] + np.einsum(
+            "nde,ne->nd", cholesky[components], standard
+        )
+
+
+class MixturePopulationModel(PopulationModel):
+    """
+    Compact PopulationModel storing one Gaussian mixture per class instead of
+    the simulation samples. Densities over any subset of parameters are exact
+    marginals of the class mixtures. Usually built with
+    ``PopulationModel.to_mixture_model``.
+    """
+
+    def __init__(
+        self,
+        class_mixtures,
+        class_weights,
+        parameters,
+        citation=None,
+        class_counts=None,
+        n_components=None,
+        mixture_kwargs=None,
+    ):
+        """
+        Initialize MixturePopulationModel.
+
+        Args:
+            class_mixtures (dict):
+                key is a class name and value is a GaussianMixtureDensity over
+                all parameters, in the order of ``parameters``.
+            class_weights (dict):
+                key is a class name and value is a number between [0,1].
+            parameters (list(str)):
+                list of parameter names setting the dimension order of the mixtures.
+            citation (list):
+                list of DOI entries for citing the model.
+            class_counts (dict):
+                number of simulation samples each class mixture was fit to.
+                Sets how many samples ``samples`` draws. Default: 1000 per class.
+            n_components (int, optional):
+                number of Gaussian components of mixtures fit by ``add_class``
+                and ``add_samples``. Default: the largest number of components
+                of the class mixtures.
+            mixture_kwargs (dict, optional):
+                extra arguments passed to ``GaussianMixtureDensity`` by
+                ``add_class`` and ``add_samples``, e.g. ``random_state``.
+                Default: None.
+        """
+        super().__init__(
+            population_samples={},
+            class_weights=class_weights,
+            parameters=parameters,
+            citation=citation,
+            density_estimator=GaussianMixtureDensity,
+        )
+        self._class_mixtures = dict(class_mixtures)
+        self._class_counts = (
+            {class_name: 1000 for class_name in class_mixtures}
+            if class_counts is None
+            else dict(class_counts)
+        )
+        if n_components is None:
+            n_components = max(
+                [len(mixture.weights) for mixture in class_mixtures.values()],
+                default=20,
+            )
+        self.n_components = n_components
+        self.mixture_kwargs = {} if mixture_kwargs is None else dict(mixture_kwargs)
+
+    @classmethod
+    def from_asdf(cls, path):
+        """
+        Build a mixture population model from an asdf file written by
+        ``MixturePopulationModel.to_asdf``.
+
+        Args:
+            path (str): path to the asdf file
+
+        Returns:
+            MixturePopulationModel populated with the data from the asdf file.
+        """
+        with asdf.open(path, lazy_load=False) as tree:
+            class_mixtures = {
+                class_name: GaussianMixtureDensity.from_components(
+                    np.array(mixture["weights"]),
+                    np.array(mixture["means"]),
+                    np.array(mixture["covariances"]),
+                )
+                for class_name, mixture in tree["class_mixtures"].items()
+            }
+            parameters = list(tree["parameters"])
+            class_weights = dict(tree["class_weights"])
+            citation = tree["citation"]
+            class_counts = dict(tree["class_counts"])
+            # Files written before the fit settings were stored fall back to
+            # the defaults.
+            n_components = tree["n_components"] if "n_components" in tree else None
+            mixture_kwargs = (
+                dict(tree["mixture_kwargs"]) if "mixture_kwargs" in tree else None
+            )
+
+        return cls(
+            class_mixtures=class_mixtures,
+            class_weights=class_weights,
+            parameters=parameters,
+            citation=citation,
+            class_counts=class_counts,
+            n_components=n_components,
+            mixture_kwargs=mixture_kwargs,
+        )
+
+    @property
+    def classes(self):
+        """
+        Return all classes available in the population model.
+
+        Returns:
+            List of all classes available.
+        """
+        return list(self._class_mixtures.keys())
+
+    def samples(self, class_name, parameters):
+        """
+        Return samples drawn from the class mixture for a given list of parameters.
+        Draws are reproducible and match the number of simulation samples the
+        mixture was fit to.
+
+        Args:
+            class_name: (str):
+                name of class to get samples for.
+            parameters: (list[str]):
+                List of parameters to get samples for.
+
+        Returns:
+            samples of shape (`num_samples, len(parameters)`) with
+            the order of the second dimension being set by the order of parameters.
+        """
+        indices = [self.parameters.index(p) for p in _parameter_key(parameters)]
+        draws = self._class_mixtures[class_name].sample(self._class_counts[class_name])
+        return draws[:, indices]
+
+    def density_estimator(self, class_name, parameters):
+        """
+        Return the class mixture marginalized onto a set of parameters.
+
+        Args:
+            class_name (str):
+                name of class to get the density estimator for.
+            parameters (list[str]):
+                parameters the estimator is built over.
+
+        Returns:
+            GaussianMixtureDensity
+        """
+        key = (class_name, _parameter_key(parameters))
+        with self._density_lock:
+            if key not in self._density_cache:
+                indices = [self.parameters.index(p) for p in key[1]]
+                self._density_cache[key] = self._class_mixtures[class_name].marginal(
+                    indices
+                )
+            return self._density_cache[key]
+
+    def add_class(self, class_name, samples, class_weight):
+        """
+        Add a new class, fitting a Gaussian mixture with ``n_components``
+        components to its samples.
+
+        Args:
+            class_name (str): name of the new class.
+            samples (np.ndarray):
+                parameter samples with shape (n_samples, n_parameters), with
+                the second dimension ordered as ``parameters``.
+            class_weight (float): class weight, between [0,1].
+
+        Raises:
+            ValueError: if the class already exists or the samples have the
+                wrong number of parameters.
+        """
+        if class_name in self.classes:
+            raise ValueError(f"{class_name} already in population model classes.")
+        samples = self._check_new_samples(samples)
+        self._class_mixtures[class_name] = GaussianMixtureDensity(
+            samples.swapaxes(0, 1),
+            n_components=self.n_components,
+            **self.mixture_kwargs,
+        )
+        self._class_counts[class_name] = len(samples)
+        self._class_weights[class_name] = class_weight
+
+    def add_samples(self, class_name, samples):
+        """
+        Add samples to an existing class by refitting its mixture.
+
+        The simulation samples the mixture was fit to are not kept, so the new
+        mixture is fit to the new samples together with as many draws from the
+        current mixture as it was fit to (see ``samples``). The result
+        approximates a mixture fit to all the simulation samples.
+
+        Args:
+            class_name (str): name of the class.
+            samples (np.ndarray):
+                parameter samples with shape (n_samples, n_parameters), with
+                the second dimension ordered as ``parameters``.
+
+        Raises:
+            ValueError: if the class is not in the population model or the
+                samples have the wrong number of parameters.
+        """
+        if class_name not in self.classes:
+            raise ValueError(f"{class_name} not in population model classes.")
+        new_samples = self._check_new_samples(samples)
+        all_samples = np.concatenate(
+            [self.samples(class_name, self.parameters), new_samples]
+        )
+        self._class_mixtures[class_name] = GaussianMixtureDensity(
+            all_samples.swapaxes(0, 1),
+            n_components=self.n_components,
+            **self.mixture_kwargs,
+        )
+        self._class_counts[class_name] = len(all_samples)
+        self._invalidate_class(class_name, new_samples)
+
+    def class_fingerprint(self, class_name):
+        """
+        Return a content hash of a class mixture.
+
+        Args:
+            class_name (str): name of class to fingerprint.
+
+        Returns:
+            Hex digest string.
+        """
+        if class_name not in self._fingerprints:
+            mixture = self._class_mixtures[class_name]
+            digest = hashlib.sha256()
+            digest.update(repr((class_name, list(self._parameters))).encode())
+            for array in (mixture.weights, mixture.means, mixture.covariances):
+                digest.update(np.ascontiguousarray(array).tobytes())
+            self._fingerprints[class_name] = digest.hexdigest()
+        return self._fingerprints[class_name]
+
+    def to_asdf(self, path, model_name):
+        """
+        Save mixture population model to asdf file, including the fit
+        settings used by ``add_class`` and ``add_samples``.
+
+        Args:
+            path (str): path to save the asdf file
+            model_name (str): Name of the model to be saving in the asdf file.
+        """
+        tree = {
+            "class_mixtures": {
+                class_name: {
+                    "weights": mixture.weights,
+                    "means": mixture.means,
+                    "covariances": mixture.covariances,
+                }
+                for class_name, mixture in self._class_mixtures.items()
+            },
+            "class_counts": self._class_counts,
+            "n_components": self.n_components,
+            "mixture_kwargs": self.mixture_kwargs,
+            "parameters": list(self._parameters),
+            "class_weights": self._class_weights,
+            "model_name": model_name,
+            "citation": self._citation,
+        }
+        af = asdf.AsdfFile(tree)
+        af.write_to(path)
+
+
+class HDF5PopulationModel(PopulationModel):
+    """
+    PopulationModel backed by an HDF5 file with one chunked dataset per class
+    and parameter, for class catalogs too large to load. Only the parameter
+    columns a request needs are read. Classes with more than
+    ``max_memory_rows`` samples are never loaded whole: with the default
+    ``gaussian_kde`` estimator they get a ``BlockedGaussianKDE`` that streams
+    row blocks from the file. The file is reopened by path when the model is
+    unpickled in worker processes. ``add_class`` and ``add_samples`` write to
+    the file, which must not be open elsewhere at the time. Usually built with
+    ``PopulationModel.from_hdf5``.
+    """
+
+    def __init__(
+        self,
+        path,
+        density_estimator=gaussian_kde,
+        density_kwargs={},
+        max_memory_rows=10**6,
+        block_rows=2**16,
+    ):
+        """
+        Initialize HDF5PopulationModel. Only the file metadata is read.
+
+        Args:
+            path (str): path to an HDF5 file written by ``PopulationModel.to_hdf5``.
+            density_estimator: (scipy.stats.gaussian_kde like):
+                Kernel density estimator used to compute density from
+                population data.
+            density_kwargs (dict):
+                extra arguments for the density estimator.
+            max_memory_rows (int, optional):
+                largest class loaded into memory to fit ``density_estimator``.
+                Default: 10**6.
+            block_rows (int, optional):
+                rows per block read when streaming larger classes. Default: 65536.
+        """
+        self._path = path
+        self._open()
+        class_samples = self._population_samples
+        super().__init__(
+            population_samples={},
+            class_weights={
+                class_name: float(class_samples.group(class_name).attrs["class_weight"])
+                for class_name in class_samples
+            },
+            parameters=list(self._file.attrs["parameters"]),
+            citation=list(self._file.attrs["citation"]),
+            density_estimator=density_estimator,
+            density_kwargs=density_kwargs,
+        )
+        self._population_samples = class_samples
+        self.max_memory_rows = max_memory_rows
+        self.block_rows = block_rows
+
+    def _open(self):
+        h5py = _import_h5py()
+
+        self._file = h5py.File(self._path, "r")
+        self._population_samples = _HDF5ClassSamples(
+            self._file["class_data"],
+            list(self._file.attrs["classes"]),
+            list(self._file.attrs["parameters"]),
+        )
+
+    def num_samples(self, class_name):
+        """
+        Return the number of simulation samples of a class without reading them.
+
+        Args:
+            class_name (str): name of the class.
+
+        Returns:
+            Number of samples.
+        """
+        return self._population_samples.num_samples(class_name)
+
+    def samples(self, class_name, parameters):
+        """
+        Return simulation samples for a given class and given list of parameters,
+        reading only those parameter columns from the file.
+
+        Args:
+            class_name: (str):
+                name of class to get population samples for.
+            parameters: (list[str]):
+                List of parameters to get samples for.
+
+        Returns:
+            samples of shape (`num_samples, len(parameters)`) with
+            the order of the second dimension being set by the order of parameters.
+        """
+        group = self._population_samples.group(class_name)
+        return np.column_stack([group[p][:] for p in _parameter_key(parameters)])
+
+    def sample_blocks(self, class_name, parameters):
+        """
+        Iterate over the simulation samples of a class in row blocks.
+
+        Args:
+            class_name: (str):
+                name of class to get population samples for.
+            parameters: (list[str]):
+                List of parameters to get samples for.
+
+        Returns:
+            Iterator of arrays of shape (len(parameters), block size).
+        """
+        group = self._population_samples.group(class_name)
+        datasets = [group[p] for p in _parameter_key(parameters)]
+        for start in range(0, self.num_samples(class_name), self.block_rows):
+            stop = start + self.block_rows
+            yield np.vstack([dataset[start:stop] for dataset in datasets])
+
+    def density_estimator(self, class_name, parameters):
+        """
+        Return the fitted density estimator for a class over a set of parameters.
+        Classes over ``max_memory_rows`` samples use a ``BlockedGaussianKDE``
+        streaming from the file, with ``density_kwargs`` passed through.
+
+        Args:
+            class_name (str):
+                name of class to get the density estimator for.
+            parameters (list[str]):
+                parameters the estimator is built over.
+
+        Returns:
+            Fitted density estimator (scipy.stats.gaussian_kde like).
+
+        Raises:
+            ValueError: if the class is over ``max_memory_rows`` samples and the
+                density estimator is not ``gaussian_kde``.
+        """
+        key = (class_name, _parameter_key(parameters))
+        with self._density_lock:
+            if (
+                key not in self._density_cache
+                and self.num_samples(class_name) > self.max_memory_rows
+            ):
+                if self._density_estimator is not gaussian_kde:
+                    raise ValueError(
+                        f"{class_name} has more than {self.max_memory_rows} samples, "
+                        "which is only supported with the gaussian_kde estimator."
+                    )
+                self._density_cache[key] = BlockedGaussianKDE(
+                    lambda: self.sample_blocks(class_name, key[1]),
+                    **self._density_kwargs,
+                )
+            return super().density_estimator(class_name, parameters)
+
+    def _compute_statistics(self, class_name):
+        """
+        Class statistics, reading the samples in row blocks for the moments
+        and one parameter column at a time for the quantiles.
+        """
+        n, mean, scatter, lower, upper = _block_moments(
+            self.sample_blocks(class_name, self.parameters)
+        )
+        group = self._population_samples.group(class_name)
+        return {
+            "count": n,
+            "min": lower,
+            "max": upper,
+            "mean": mean,
+            "covariance": scatter / (n - 1),
+            "quantile_levels": np.asarray(STATISTICS_QUANTILES),
+            "quantiles": np.column_stack(
+                [
+                    np.quantile(group[p][:], STATISTICS_QUANTILES)
+                    for p in self.parameters
+                ]
+            ),
+        }
+
+    def class_fingerprint(self, class_name):
+        """
+        Return a content hash of a class, reading the samples in row blocks.
+
+        Args:
+            class_name (str): name of class to fingerprint.
+
+        Returns:
+            Hex digest string.
+        """
+        if class_name not in self._fingerprints:
+            digest = hashlib.sha256()
+            digest.update(repr((class_name, list(self._parameters))).encode())
+            digest.update(repr(self.num_samples(class_name)).encode())
+            for block in self.sample_blocks(class_name, self.parameters):
+                digest.update(np.ascontiguousarray(block).tobytes())
+            digest.update(_estimator_description(self).encode())
+            self._fingerprints[class_name] = digest.hexdigest()
+        return self._fingerprints[class_name]
+
+    def add_class(self, class_name, samples, class_weight):
+        """
+        Add a new class, writing its samples and class weight to the file.
+
+        Args:
+            class_name (str): name of the new class.
+            samples (np.ndarray):
+                parameter samples with shape (n_samples, n_parameters), with
+                the second dimension ordered as ``parameters``.
+            class_weight (float): class weight, between [0,1].
+
+        Raises:
+            ValueError: if the class already exists or the samples have the
+                wrong number of parameters.
+        """
+        if class_name in self.classes:
+            raise ValueError(f"{class_name} already in population model classes.")
+        samples = self._check_new_samples(samples)
+        with self._writable() as f:
+            group = f["class_data"].create_group(class_name)
+            group.attrs["class_weight"] = class_weight
+            for index, parameter in enumerate(self.parameters):
+                group.create_dataset(
+                    parameter,
+                    data=samples[:, index],
+                    chunks=(min(self.block_rows, max(len(samples), 1)),),
+                    maxshape=(None,),
+                )
+            f.attrs["classes"] = self.classes + [class_name]
+        self._class_weights[class_name] = class_weight
+
+    def add_samples(self, class_name, samples):
+        """
+        Append samples to an existing class in the file. Only the cached
+        structures of this class are invalidated.
+
+        Args:
+            class_name (str): name of the class.
+            samples (np.ndarray):
+                parameter samples with shape (n_samples, n_parameters), with
+                the second dimension ordered as ``parameters``.
+
+        Raises:
+            ValueError: if the class is not in the population model or the
+                samples have the wrong number of parameters.
+        """
+        if class_name not in self.classes:
+            raise ValueError(f"{class_name} not in population model classes.")
+        new_samples = self._check_new_samples(samples)
+        with self._writable() as f:
+            group = f["class_data"][class_name]
+            for index, parameter in enumerate(self.parameters):
+                dataset = group[parameter]
+                start = dataset.shape[0]
+                dataset.resize((start + len(new_samples),))
+                dataset[start:] = new_samples[:, index]
+        self._invalidate_class(class_name, new_samples)
+
+    @contextlib.contextmanager
+    def _writable(self):
+        """
+        Reopen the file for writing, then read-only again with the new contents.
+        """
+        h5py = _import_h5py()
+
+        self._file.close()
+        try:
+            with h5py.File(self._path, "r+") as f:
+                yield f
+        finally:
+            self._open()
+
+    def close(self):
+        """
+        Close the HDF5 file.
+        """
+        self._density_cache.clear()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __reduce__(self):
+        state = {
+            "class_weights": self._class_weights,
+            "density_estimator": self._density_estimator,
+            "density_kwargs": self._density_kwargs,
+            "max_memory_rows": self.max_memory_rows,
+            "block_rows": self.block_rows,
+        }
+        return (_restore_hdf5_population_model, (self._path, state))
+
+
+def _restore_hdf5_population_model(path, state):
+    state = dict(state)
+    class_weights = state.pop("class_weights")
+    model = HDF5PopulationModel(path, **state)
+    model._class_weights = dict(class_weights)
+    return model
+
+
+class _HDF5ClassSamples:
+    """
+    Read-only mapping of class names to full sample arrays, read from the
+    per-parameter datasets of an HDF5 ``class_data`` group on access.
+    """
+
+    def __init__(self, class_data, classes, parameters):
+        self._class_data = class_data
+        self._classes = classes
+        self._parameters = parameters
+
+    def group(self, class_name):
+        return self._class_data[class_name]
+
+    def num_samples(self, class_name):
+        group = self.group(class_name)
+        return len(group[self._parameters[0]])
+
+    def keys(self):
+        return list(self._classes)
+
+    def items(self):
+        return [(class_name, self[class_name]) for class_name in self._classes]
+
+    def __getitem__(self, class_name):
+        group = self.group(class_name)
+        return np.column_stack([group[p][:] for p in self._parameters])
+
+    def __contains__(self, class_name):
+        return class_name in self._classes
+
+    def __iter__(self):
+        return iter(self._classes)
+
+    def __len__(self):
+        return len(self._classes)
+
+
+def validate_asdf_population_model(asdf_object):
+    """
+    Check if PopulationModel asdf file is valid.
+    Only array shapes and dtypes are inspected, so for a file opened with
+    ``lazy_load=True`` no array data is read.
+
+    Args:
+        asdf_object (asdf): asdf file to validate against a
+            Population model required format.
+
+    Returns:
+        True if asdf is valid. False otherwise.
+    """
+    valid_key_set = [
+        "model_name",
+        "class_weights",
+        "parameters",
+        "class_data",
+        "citation",
+    ]
+    keys_present = [name in asdf_object for name in valid_key_set]
+
+    if all(keys_present) and isinstance(asdf_object["class_data"], Mapping):
+        number_of_classes = len(asdf_object["class_data"])
+        number_of_parameters = len(asdf_object["parameters"])
+        # valid_class_data = [isinstance(data, np.ndarray) for data in asdf_object['class_data'].values()]
+        valid_class_data_dim = [
+            hasattr(data, "shape")
+            and len(data.shape) == 2
+            and data.shape[1] == number_of_parameters
+            and np.issubdtype(np.dtype(data.dtype), np.number)
+            for data in asdf_object["class_data"].values()
+        ]
+
+        # Validating the citation field
+        citation = asdf_object["citation"]
+        valid_citation = isinstance(citation, list) and all(
+            isinstance(doi, str) for doi in citation
+        )
+
+        valid = all(valid_class_data_dim) and valid_citation
+    else:
+        valid = False
+    return valid
+
+
+def validate_asdf_population_model_file(path, verify_checksums=False):
+    """
+    Check if a PopulationModel asdf file is valid from the tree and array
+    metadata alone, without loading the class arrays.
+
+    Args:
+        path (str): path to the asdf file
+        verify_checksums (bool, optional):
+            additionally read every class array block, one at a time, and check
+            it against the checksum stored in the file. Default: False.
+
+    Returns:
+        True if the file is valid. False otherwise, including when the file
+        cannot be read, its tree is malformed or a checksum does not match.
+    """
+    try:
+        with asdf.open(
+            path, lazy_load=True, memmap=False, validate_checksums=verify_checksums
+        ) as tree:
+            valid = validate_asdf_population_model(tree)
+            if valid and verify_checksums:
+                for data in tree["class_data"].values():
+                    # Reading the block verifies its checksum.
+                    np.asarray(data)
+    except (OSError, ValueError, AttributeError, KeyError, TypeError):
+        return False
+    return valid
+
+
+class CustomKernelDensity:
+    """An example of defining a custom kernel for a PopulationModel. Wraps sklearn.neighbors.KernelDensity to conform to the template needed by PopulationModel and classify.
+
+    The sklearn tree is built once when the estimator is created, and the estimator pickles together with its built tree, so worker processes can receive it already fitted.
+    """
+
+    def __init__(self, data, **kwargs):
+        """Initialization. Fits the sklearn KernelDensity tree.
+
+        Args:
+            data (numpy.array): shape [# dims, # samples]. Same as scipy.stats.gaussian_kde
+            kernel (str): matches 'kernel' argument of KernelDensity. Default: "gaussian".
+            bandwidth (float): matches 'bandwidth' argument of KernelDensity. Default: 1.0.
+            algorithm (str): tree algorithm, "kd_tree", "ball_tree" or "auto". Default: "auto".
+            leaf_size (int): leaf size of the tree. Default: 40.
+            atol (float): absolute tolerance of the tree evaluation. Larger values give faster, approximate evaluation. Default: 0.
+            rtol (float): relative tolerance of the tree evaluation. Larger values give faster, approximate evaluation. Default: 0.
+            breadth_first (bool): breadth-first (True) or depth-first (False) tree traversal. Default: True.
+        Returns:
+            None
+        """
+        self.density_kwargs = kwargs
+        self.kernel = KernelDensity(**kwargs).fit(data.T)
+
+    @property
+    def data(self):
+        """Samples the estimator was fit to, shape [# dims, # samples]."""
+        return np.asarray(self.kernel.tree_.data).T
+
+    def evaluate(self, pts):
+        """Evaluation method for calculating the pdf of the kernel at a set of points.
+
+        Args:
+            pts (numpy.array): array of points to evaluate the density on. Shape: [# dimensions, # of points].
+        Returns:
+            evaluated_density (numpy.array): the probability density values at each of the corresponding points.
+        """
+        return np.exp(self.kernel.score_samples(pts.T))
+
+
+def _block_moments(blocks):
+    """
+    Count, mean, scatter matrix, minimum and maximum of samples in blocks of
+    shape [# dims, # block samples], merged in one pass.
+    """
+    n, mean, scatter, lower, upper = 0, None, None, None, None
+    for block in blocks:
+        block = np.atleast_2d(block)
+        n_new = block.shape[1]
+        if n_new == 0:
+            continue
+        mean_new = np.mean(block, axis=1)
+        deviations = block - mean_new[:, np.newaxis]
+        block_min, block_max = np.min(block, axis=1), np.max(block, axis=1)
+        if n == 0:
+            mean, scatter = mean_new, deviations @ deviations.T
+            lower, upper = block_min, block_max
+        else:
+            delta = mean_new - mean
+            scatter = (
+                scatter
+                + deviations @ deviations.T
+                + np.outer(delta, delta) * n * n_new / (n + n_new)
+            )
+            mean = (n * mean + n_new * mean_new) / (n + n_new)
+            lower, upper = np.minimum(lower, block_min), np.maximum(upper, block_max)
+        n += n_new
+    return n, mean, scatter, lower, upper
+
+
+class BlockedGaussianKDE:
+    """Gaussian kernel density estimator over samples streamed in row blocks, for populations too large to hold in memory. Matches scipy.stats.gaussian_kde (unweighted) in bandwidth and normalization, but computes the data covariance in one pass over the blocks and evaluates by accumulating the kernel sums block by block, so memory scales with the block size rather than the number of samples. Used by HDF5PopulationModel for large classes."""
+
+    def __init__(self, blocks, bw_method="scott", max_elements=2**22):
+        """Initialization. Reads every block once to compute the sample covariance.
+
+        Args:
+            blocks (callable): called with no arguments, returns an iterator over sample blocks of shape [# dims, # block samples]. Called again for every evaluation.
+            bw_method (str, float or callable): "scott", "silverman", a scalar bandwidth factor, or a callable taking this estimator and returning the factor, as in scipy.stats.gaussian_kde. The samples are not held in memory, so a callable can use ``n``, ``neff``, ``d`` and ``data_covariance`` (and ``scotts_factor``/``silverman_factor``) but not ``dataset``. Default: "scott".
+            max_elements (int): largest number of point-sample pairs evaluated at once. Default: 2**22.
+        Returns:
+            None
+        """
+        self.blocks = blocks
+        self.max_elements = max_elements
+
+        n, mean, scatter, _, _ = _block_moments(blocks())
+        self.n = n
+        self.neff = n
+        self.d = len(mean)
+        self.data_covariance = scatter / (n - 1)
+
+        if bw_method == "scott":
+            self.factor = self.scotts_factor()
+        elif bw_method == "silverman":
+            self.factor = self.silverman_factor()
+        elif callable(bw_method):
+            self.factor = float(bw_method(self))
+        else:
+            self.factor = float(bw_method)
+        self.covariance = self.data_covariance * self.factor**2
+
+        cholesky = np.linalg.cholesky(self.covariance)
+        self._whiten = np.linalg.inv(cholesky)
+        self._norm = 1.0 / (
+            n * (2 * np.pi) ** (self.d / 2.0) * np.prod(np.diag(cholesky))
+        )
+
+    def evaluate(self, pts):
+        """Evaluation method for calculating the pdf of the kernel at a set of points.
+
+        Args:
+            pts (numpy.array): array of points to evaluate the density on. Shape: [# dimensions, # of points].
+        Returns:
+            evaluated_density (numpy.array): the probability density values at each of the corresponding points.
+        """
+        points = self._whiten @ np.reshape(pts, (self.d, -1))
+        points_sq = np.sum(points**2, axis=0)
+        density = np.zeros(points.shape[1])
+        for block in self.blocks():
+            block = self._whiten @ np.atleast_2d(block)
+            if block.shape[1] == 0:
+                continue
+            block_sq = np.sum(block**2, axis=0)
+            step = max(1, self.max_elements // block.shape[1])
+            for start in range(0, points.shape[1], step):
+                rows = slice(start, start + step)
+                distance_sq = (
+                    points_sq[rows, np.newaxis]
+                    + block_sq[np.newaxis, :]
+                    - 2 * points[:, rows].T @ block
+                )
+                density[rows] += np.sum(
+                    np.exp(-0.5 * np.maximum(distance_sq, 0)), axis=1
+                )
+        return density * self._norm
+
+    def scotts_factor(self):
+        """Scott's rule bandwidth factor, ``n**(-1/(d+4))``."""
+        return self.neff ** (-1.0 / (self.d + 4))
+
+    def silverman_factor(self):
+        """Silverman's rule bandwidth factor, ``(n*(d+2)/4)**(-1/(d+4))``."""
+        return (self.neff * (self.d + 2) / 4.0) ** (-1.0 / (self.d + 4))
@@ -3,7 +3,9 @@ Utilities for creating the posterior and inference data objects for interfacing
 with ``popclass``' classification function.
 """
 import copy
+import hashlib
 
+import asdf
 import numpy as np
 
 
@@ -16,7 +18,7 @@ class InferenceData:
     to be passed to the classifier.
     """
 
-    def __init__(self, posterior, prior_density):
+    def __init__(self, posterior, prior_density, weights=None):
         """
         Initialize the InferenceData object.
 
@@ -24,11 +26,244 @@ class InferenceData:
             posterior (popclass.Posterior):
                 A posterior object in popclass formatting convention, containing posterior
                 samples of the shape (number of samples, number of parameters)
-            prior_density (array-like):
-                1D array representing the prior density with an expected shape of (number of samples,)
+            prior_density (array-like, popclass.Prior or callable):
+                1D array representing the prior density with an expected shape of (number of samples,),
+                or a ``popclass.Prior`` evaluated lazily on the posterior samples. A plain callable is
+                wrapped as a ``Prior`` over all posterior parameters.
+            weights (array-like, optional):
+                1D array of posterior sample weights with an expected shape of (number of samples,).
+                If None, samples are equally weighted. Default: None.
         """
         self.posterior = posterior
         self.prior_density = prior_density
+        self.weights = weights
+
+    @property
+    def posterior(self):
+        """
+        Posterior samples of the event.
+        """
+        return self._posterior
+
+    @posterior.setter
+    def posterior(self, posterior):
+        self._posterior = posterior
+        self._importance_weights = None
+        self._fingerprint = None
+
+    @property
+    def prior_density(self):
+        """
+        Prior density as supplied, either an array or a ``popclass.Prior``.
+        """
+        return self._prior_density
+
+    @prior_density.setter
+    def prior_density(self, prior_density):
+        if callable(prior_density) and not isinstance(prior_density, Prior):
+            prior_density = Prior(prior_density, self.posterior.parameter_labels)
+        self._prior_density = prior_density
+        self._importance_weights = None
+        self._fingerprint = None
+
+    @property
+    def weights(self):
+        """
+        Posterior sample weights, or None for equally weighted samples.
+        """
+        return self._weights
+
+    @weights.setter
+    def weights(self, weights):
+        self._weights = weights
+        self._importance_weights = None
+        self._fingerprint = None
+
+    @property
+    def prior_values(self):
+        """
+        Prior density evaluated at every posterior sample.
+
+        Returns:
+            prior_values (numpy.ndarray):
+                1D array with shape (number of samples,).
+        """
+        if isinstance(self.prior_density, Prior):
+            return self.prior_density.evaluate(self.posterior)
+        return np.asarray(self.prior_density)
+
+    @property
+    def importance_weights(self):
+        """
+        Per-sample weights for integrating over the posterior with the prior divided out,
+        i.e. the inverse prior density times the sample weights normalized to unit mean.
+        Computed once and cached, so the classifier and uncertainty quantification share a
+        single prior evaluation.
+
+        Returns:
+            importance_weights (numpy.ndarray):
+                1D array with shape (number of samples,).
+        """
+        if self._importance_weights is None:
+            if isinstance(self.prior_density, Prior) and self.prior_density.log:
+                importance_weights = np.exp(
+                    -self.prior_density.log_evaluate(self.posterior)
+                )
+            else:
+                importance_weights = 1.0 / self.prior_values
+            if self.weights is not None:
+                weights = np.asarray(self.weights)
+                importance_weights = (
+                    importance_weights * weights * (len(weights) / np.sum(weights))
+                )
+            self._importance_weights = importance_weights
+        return self._importance_weights
+
+    @property
+    def fingerprint(self):
+        """
+        Return a content hash of the inference data.
+
+        The hash covers the posterior samples and parameter labels, the prior
+        density at the samples and the sample weights. It is computed once and
+        cached until the posterior, prior density or weights are reassigned.
+
+        Returns:
+            Hex digest string.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            arrays = [self.posterior.samples, self.prior_values]
+            if self.weights is not None:
+                arrays.append(self.weights)
+            digest.update(repr(list(self.posterior.parameter_labels)).encode())
+            for array in arrays:
+                array = np.ascontiguousarray(array)
+                digest.update(repr((array.dtype.str, array.shape)).encode())
+                digest.update(array.tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def to_asdf(self, path):
+        """
+        Save the inference data to an uncompressed asdf file that can be memory-mapped on load.
+        The samples are stored one parameter per row, so a memory-mapped marginal only
+        reads the columns it selects.
+
+        Args:
+            path (str): path to save the asdf file
+        """
+        tree = {
+            "parameter_samples": np.ascontiguousarray(
+                np.asarray(self.posterior.samples).T
+            ),
+            "parameter_labels": list(self.posterior.parameter_labels),
+            "prior_density": self.prior_values,
+            "validated": bool(self.posterior.validated),
+        }
+        if self.weights is not None:
+            tree["weights"] = np.asarray(self.weights)
+        af = asdf.AsdfFile(tree)
+        af.write_to(path, all_array_compression=None)
+
+    @classmethod
+    def from_asdf(cls, path, memmap=True):
+        """
+        Load inference data saved with ``InferenceData.to_asdf``.
+
+        Args:
+            path (str): path to the asdf file
+            memmap (bool, optional):
+                Memory-map the arrays so only the parts that are used are read from disk.
+                Default: True.
+
+        Returns:
+            popclass.InferenceData:
+                An ``InferenceData`` object backed by the arrays in the file. The NaN scan
+                of the posterior samples is skipped if the file records them as validated.
+        """
+        with asdf.open(path, lazy_load=memmap, memmap=memmap) as tree:
+            if "parameter_samples" in tree:
+                samples = np.asarray(tree["parameter_samples"]).T
+            else:
+                samples = np.asarray(tree["samples"])
+            parameter_labels = list(tree["parameter_labels"])
+            prior_density = np.asarray(tree["prior_density"])
+            weights = np.asarray(tree["weights"]) if "weights" in tree else None
+            validated = bool(tree["validated"])
+
+        posterior = Posterior(samples, parameter_labels, validate=not validated)
+        posterior.validated = True
+        return cls(posterior=posterior, prior_density=prior_density, weights=weights)
+
+
+class Prior:
+    """
+    Vectorized prior density over a subset of the posterior parameters, for priors that are
+    the same analytic function for every event. Only the columns of the parameters it
+    depends on are passed to the function.
+    """
+
+    def __init__(self, function, parameters, log=False):
+        """
+        Initialize the Prior object.
+
+        Args:
+            function (callable):
+                Vectorized function taking an array of shape (number of samples, len(parameters)),
+                with columns ordered as ``parameters``, and returning the prior density (or its
+                logarithm if ``log``) with shape (number of samples,).
+            parameters (list[str]):
+                Parameters the prior depends on.
+            log (bool, optional):
+                Whether ``function`` returns the log prior density. Default: False.
+        """
+        self.function = function
+        self.parameters = list(parameters)
+        self.log = log
+
+    def _function_values(self, posterior):
+        missing = [p for p in self.parameters if p not in posterior.parameter_labels]
+        if missing:
+            raise ValueError(f"Prior parameters {missing} not found in the posterior.")
+        columns = [list(posterior.parameter_labels).index(p) for p in self.parameters]
+        return np.asarray(self.function(posterior.samples[:, columns]))
+
+    def log_evaluate(self, posterior):
+        """
+        Log prior density at every sample of a posterior.
+
+        Args:
+            posterior (popclass.Posterior):
+                Posterior containing at least the prior's parameters.
+
+        Returns:
+            log_prior (numpy.ndarray):
+                1D array with shape (number of samples,).
+
+        Raises:
+            ValueError: if a prior parameter is not in the posterior.
+        """
+        values = self._function_values(posterior)
+        return values if self.log else np.log(values)
+
+    def evaluate(self, posterior):
+        """
+        Prior density at every sample of a posterior.
+
+        Args:
+            posterior (popclass.Posterior):
+                Posterior containing at least the prior's parameters.
+
+        Returns:
+            prior (numpy.ndarray):
+                1D array with shape (number of samples,).
+
+        Raises:
+            ValueError: if a prior parameter is not in the posterior.
+        """
+        values = self._function_values(posterior)
+        return np.exp(values) if self.log else values
 
 
 class Posterior:
@@ -43,7 +278,7 @@ class Posterior:
     * BAGLE (Microlensing specific, see below)
     """
 
-    def __init__(self, samples, parameter_labels):
+    def __init__(self, samples, parameter_labels, validate=True):
         """
         Initialize posterior object.
 
@@ -56,13 +291,17 @@ class Posterior:
                 List of strings representing the labels of the parameters.
                 There should be an equal number of labels to columns in samples representing
                 individual parameters (i.e. the number of parameters).
+            validate (bool, optional):
+                Scan the samples for NaNs. Only skip this for samples that are known to be
+                valid, e.g. loaded from a file saved from a validated ``Posterior``. Default: True.
 
         Raises:
             ValueError: if the number of parameters is not less than the number of samples.
         """
-        testnan = np.isnan(samples)
-        if True in testnan:
-            raise ValueError("Posterior samples cannot be NaN")
+        if validate:
+            testnan = np.isnan(samples)
+            if True in testnan:
+                raise ValueError("Posterior samples cannot be NaN")
 
         # Check that number of samples > number of parameters
         if samples.shape[0] <= samples.shape[1]:
@@ -72,6 +311,7 @@ class Posterior:
 
         self.parameter_labels = parameter_labels
         self.samples = samples
+        self.validated = validate
 
     def marginal(self, parameter_list):
         """
@@ -84,7 +324,8 @@ class Posterior:
 
         Returns:
             New instance of the ``Posterior`` object only containing
-            samples determined and ordered by `parameter_list`.
+            samples determined and ordered by `parameter_list`. Only the selected
+            columns are copied, and the samples are not validated again.
 
         Raises:
             ValueError: if the number of parameters is not less than the number of samples.
@@ -93,7 +334,7 @@ class Posterior:
         _1, id_arr_labels, id_arr_list = np.intersect1d(
             self.parameter_labels, parameter_list, return_indices=True
         )
-        marginal = copy.deepcopy(self)
+        marginal = copy.copy(self)
         marginal.parameter_labels = list([parameter_list[i] for i in id_arr_list])
         marginal.samples = self.samples[:, id_arr_labels]
 
@@ -116,7 +357,7 @@ class Posterior:
         """
         return self.parameter_labels
 
-    def to_inference_data(self, prior_density):
+    def to_inference_data(self, prior_density, weights=None):
         """
         Go from the ``Posterior`` object to a new ``InferenceData`` object.
 
@@ -127,34 +368,78 @@ class Posterior:
                 1D array representing the prior density with an expected shape of (number of samples,).
                 Prior density corresponds to samples in posterior_object, as the number of entries must
                 match the number of rows in the posterior samples array.
+            weights (array-like, optional):
+                1D array of sample weights with an expected shape of (number of samples,).
+                Default: None.
 
         Returns:
             popclass.InferenceData:
                 An ``InferenceData`` object that contains all the information needed
                 to pass to a classifier.
         """
-        return InferenceData(posterior=self, prior_density=prior_density)
+        return InferenceData(
+            posterior=self, prior_density=prior_density, weights=weights
+        )
 
     @classmethod
-    def from_arviz(cls, arviz_posterior_object):
+    def from_arviz(cls, arviz_posterior_object, var_names=None, burn_in=0, thin=1):
         """
         Utility to convert an ArViz posterior object directly to popclass posterior object.
 
+        Chains are stacked along the sample axis. Only the selected variables are
+        read, each with a single copy from the underlying buffer.
+
         Args:
             arviz_posterior_object (arviz.InferenceData):
                 InferenceData from an ArViz run.
+            var_names (list[str], optional):
+                Scalar posterior variables to convert, in the order of the returned
+                parameters. Default: all variables.
+            burn_in (int, optional):
+                Number of initial draws of every chain to drop. Default: 0.
+            thin (int, optional):
+                Keep every ``thin``-th draw after burn-in. Default: 1.
 
         Returns:
             popclass.Posterior:
                 A ``popclass.Posterior`` object generated from the ArViz posterior.
 
         Raises:
-            ValueError: if the number of parameters is not less than the number of samples.
+            ValueError: if ``burn_in`` is negative or drops every draw, if ``thin``
+                is less than one, if a selected variable is missing or not scalar,
+                or if the number of parameters is not less than the number of
+                samples.
         """
-        labels = list(arviz_posterior_object.posterior.data_vars.keys())
-        samples = arviz_posterior_object.posterior.to_dataarray().to_numpy().squeeze()
+        arviz_posterior = arviz_posterior_object.posterior
+        num_draws = arviz_posterior.sizes["draw"]
+        if not 0 <= burn_in < num_draws:
+            raise ValueError(
+                f"burn_in must be non-negative and less than the {num_draws} draws per chain, got {burn_in}."
+            )
+        if thin < 1:
+            raise ValueError(f"thin must be at least 1, got {thin}.")
 
-        samples_array = np.array(samples).swapaxes(0, 1)
+        labels = (
+            list(arviz_posterior.data_vars.keys())
+            if var_names is None
+            else list(var_names)
+        )
+        missing = [label for label in labels if label not in arviz_posterior.data_vars]
+        if missing:
+            raise ValueError(f"Variables {missing} not found in the arviz posterior.")
+
+        num_chains = arviz_posterior.sizes["chain"]
+        num_draws = len(range(burn_in, num_draws, thin))
+        stacked = np.empty((len(labels), num_chains, num_draws))
+        for counter, label in enumerate(labels):
+            values = arviz_posterior[label].transpose("chain", "draw", ...).values
+            if values.ndim != 2:
+                raise ValueError(
+                    f"Variable {label} is not scalar and cannot be used as a parameter."
+                )
+            stacked[counter] = values[:, burn_in::thin]
+
+        samples_array = stacked.reshape(len(labels), num_chains * num_draws).T
         # Shape check
         if samples_array.shape[0] <= samples_array.shape[1]:
             raise ValueError(
@@ -0,0 +1,265 @@
+"""
+Columnar on-disk store for bulk classification outputs.
+Rows of event id, model, parameters and per-class probabilities (optionally
+Monte Carlo errors and timings) are buffered and appended in chunks to
+compressed, resizable HDF5 datasets, one dataset per column, so a single
+column can be read for hundreds of thousands of events without building
+Python objects per event. Requires ``h5py``, installed with the ``hdf5``
+extra (``pip install popclass[hdf5]``).
+"""
+from collections.abc import Mapping
+
+import numpy as np
+
+from popclass.model import _import_h5py
+
+_STRING_COLUMNS = ["event_id", "model", "parameters"]
+
+
+class ResultStore:
+    """
+    Append-only columnar store of classification results in an HDF5 file.
+
+    The file holds one 1D dataset per column: ``event_id``, ``model`` and
+    ``parameters`` (strings, parameters joined with commas), ``timing``
+    (seconds, if enabled), and one dataset per class in the
+    ``probabilities`` and ``errors`` (if enabled) groups.
+    """
+
+    def __init__(
+        self,
+        path,
+        classes=None,
+        errors=False,
+        timings=False,
+        chunk_rows=4096,
+        compression="gzip",
+    ):
+        """
+        Open a result store, creating it if it does not exist.
+
+        The column layout of an existing store is read from the file, and the
+        layout arguments are only used when creating a new store.
+
+        Args:
+            path (str): path to the HDF5 file.
+            classes (list[str], optional):
+                class names. Default: the classes of the first appended batch.
+            errors (bool, optional): store per-class Monte Carlo errors. Default: False.
+            timings (bool, optional): store per-event timings. Default: False.
+            chunk_rows (int, optional):
+                rows per HDF5 chunk, and number of buffered rows written at once.
+                Default: 4096.
+            compression (str, optional): HDF5 compression filter. Default: "gzip".
+        """
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self._file = _import_h5py().File(path, "a")
+        if "event_id" in self._file:
+            self.classes = list(self._file["probabilities"].attrs["classes"])
+            self.errors = "errors" in self._file
+            self.timings = "timing" in self._file
+        else:
+            self.classes = None if classes is None else list(classes)
+            self.errors = errors
+            self.timings = timings
+            if self.classes is not None:
+                self._create_datasets()
+        self._buffer = []
+
+    def _create_datasets(self):
+        def create(group, name, dtype):
+            group.create_dataset(
+                name,
+                shape=(0,),
+                maxshape=(None,),
+                dtype=dtype,
+                chunks=(self.chunk_rows,),
+                compression=self.compression,
+            )
+
+        for name in _STRING_COLUMNS:
+            create(self._file, name, _import_h5py().string_dtype())
+        groups = ["probabilities"] + (["errors"] if self.errors else [])
+        for group_name in groups:
+            group = self._file.create_group(group_name)
+            for class_name in self.classes:
+                create(group, class_name, np.float64)
+        self._file["probabilities"].attrs["classes"] = self.classes
+        if self.timings:
+            create(self._file, "timing", np.float64)
+
+    def append(
+        self, event_ids, probabilities, model, parameters, errors=None, timings=None
+    ):
+        """
+        Append a batch of classification results.
+
+        Args:
+            event_ids (list[str]): event identifiers, one per row.
+            probabilities (list[dict] or dict):
+                per-event dictionaries as returned by ``classify``, or a
+                dictionary of class names and arrays with one value per row.
+                Classes missing from a row are stored as NaN.
+            model (str or list[str]): model name, for all rows or per row.
+            parameters (list[str] or list[list[str]]):
+                classification parameters, for all rows or per row.
+            errors (list[dict] or dict, optional):
+                Monte Carlo errors in the same layout as ``probabilities``, e.g.
+                from ``ClassificationResult.probability_errors``. Required if the
+                store has errors.
+            timings (array-like, optional):
+                seconds per event. Required if the store has timings.
+
+        Raises:
+            ValueError: if the batch has unknown classes or missing columns.
+        """
+        event_ids = [str(event_id) for event_id in event_ids]
+        num_rows = len(event_ids)
+        if self.classes is None:
+            self.classes = list(
+                probabilities
+                if isinstance(probabilities, Mapping)
+                else probabilities[0]
+            )
+            self._create_datasets()
+        if self.errors and errors is None:
+            raise ValueError("Result store has an errors column, but no errors given.")
+        if self.timings and timings is None:
+            raise ValueError("Result store has a timing column, but no timings given.")
+
+        if isinstance(model, str):
+            model = [model] * num_rows
+        if len(parameters) == 0 or isinstance(parameters[0], str):
+            parameters = [parameters] * num_rows
+
+        batch = {
+            "event_id": event_ids,
+            "model": list(model),
+            "parameters": [",".join(row) for row in parameters],
+        }
+        batch.update(self._class_columns("probabilities", probabilities, num_rows))
+        if self.errors:
+            batch.update(self._class_columns("errors", errors, num_rows))
+        if self.timings:
+            batch["timing"] = np.asarray(timings, dtype=np.float64)
+        if any(len(column) != num_rows for column in batch.values()):
+            raise ValueError("All columns of a batch must have one value per row.")
+
+        self._buffer.append(batch)
+        if sum(len(batch["event_id"]) for batch in self._buffer) >= self.chunk_rows:
+            self.flush()
+
+    def _class_columns(self, group, values, num_rows):
+        """
+        Per-class columns of a batch, keyed by dataset name.
+        """
+        if isinstance(values, Mapping):
+            unknown = set(values) - set(self.classes)
+            columns = {
+                class_name: np.asarray(
+                    values.get(class_name, np.full(num_rows, np.nan)), dtype=np.float64
+                )
+                for class_name in self.classes
+            }
+        else:
+            unknown = set().union(*values) - set(self.classes) if values else set()
+            columns = {
+                class_name: np.array(
+                    [row.get(class_name, np.nan) for row in values], dtype=np.float64
+                )
+                for class_name in self.classes
+            }
+        if unknown:
+            raise ValueError(
+                f"Classes {sorted(unknown)} not in result store classes {self.classes}."
+            )
+        return {f"{group}/{name}": column for name, column in columns.items()}
+
+    def flush(self):
+        """
+        Write buffered rows to the file.
+        """
+        if not self._buffer:
+            return
+        for name in self._buffer[0]:
+            column = np.concatenate([batch[name] for batch in self._buffer])
+            dataset = self._file[name]
+            start = dataset.shape[0]
+            dataset.resize((start + len(column),))
+            dataset[start:] = column
+        self._buffer = []
+        self._file.flush()
+
+    @property
+    def columns(self):
+        """
+        Names of the columns in the store, with class columns as ``group/class``.
+
+        Returns:
+            List of column names.
+        """
+        if self.classes is None:
+            return []
+        names = list(_STRING_COLUMNS)
+        names += [f"probabilities/{name}" for name in self.classes]
+        if self.errors:
+            names += [f"errors/{name}" for name in self.classes]
+        if self.timings:
+            names.append("timing")
+        return names
+
+    def read(self, column, rows=slice(None)):
+        """
+        Read a column, including rows that are still buffered.
+
+        Args:
+            column (str):
+                column name (see ``columns``). A class name on its own reads
+                its probabilities.
+            rows (slice or array-like, optional): rows to read. Default: all rows.
+
+        Returns:
+            numpy.ndarray of the column values, as ``str`` for string columns.
+        """
+        self.flush()
+        if self.classes is not None and column in self.classes:
+            column = f"probabilities/{column}"
+        dataset = self._file[column]
+        if column in _STRING_COLUMNS:
+            dataset = dataset.asstr()
+        return np.asarray(dataset[rows])
+
+    def probabilities(self, rows=slice(None)):
+        """
+        Read the class probabilities of all classes.
+
+        Args:
+            rows (slice or array-like, optional): rows to read. Default: all rows.
+
+        Returns:
+            Dictionary of class names and probability arrays.
+        """
+        return {
+            class_name: self.read(f"probabilities/{class_name}", rows)
+            for class_name in self.classes
+        }
+
+    def __len__(self):
+        stored = self._file["event_id"].shape[0] if "event_id" in self._file else 0
+        return stored + sum(len(batch["event_id"]) for batch in self._buffer)
+
+    def close(self):
+        """
+        Flush buffered rows and close the file.
+        """
+        if self._file.id.valid:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,11 +1,58 @@
 """
 The classification framework is susceptible to systematic error through a variety of sources, including model assumptions (e.g. incomplete populations) or simulation noise in the tails of the distribution. This set of utilities allows users to incorporate uncertainty quantification into the classification.
 """
+import hashlib
 import warnings
 
 import numpy as np
 from scipy.stats import gaussian_kde
 
+from popclass.cache import update_digest
+
+
+class UQContext:
+    """
+    Posterior preprocessing of one classification, shared by every UQ stage applied to it: the posterior marginalized onto the
+    classification parameters and the importance weights (inverse prior density times sample weights) of its samples.
+    """
+
+    def __init__(
+        self,
+        inference_data,
+        population_model,
+        parameters,
+        posterior=None,
+        importance_weights=None,
+    ):
+        """
+        Initialize UQContext.
+
+        Args:
+            inference_data (popclass.InferenceData):
+                popclass InferenceData object
+            population_model (popclass.PopulationModel):
+                popclass PopulationModel object
+            parameters (list):
+                Parameters to use for classification.
+            posterior (popclass.Posterior-like, optional):
+                posterior already marginalized onto ``parameters''. Default: computed from ``inference_data''.
+            importance_weights (numpy.array, optional):
+                importance weights of the posterior samples. Default: ``inference_data.importance_weights''.
+        """
+        self.inference_data = inference_data
+        self.population_model = population_model
+        self.parameters = parameters
+        self.posterior = (
+            inference_data.posterior.marginal(parameters)
+            if posterior is None
+            else posterior
+        )
+        self.importance_weights = (
+            inference_data.importance_weights
+            if importance_weights is None
+            else importance_weights
+        )
+
 
 class additiveUQ:
     def __init__(self):
@@ -14,11 +61,181 @@ class additiveUQ:
     def apply_uq(self, unnormalized_prob, inference_data, population_model, parameters):
         return unnormalized_prob
 
+    def apply_uq_context(self, unnormalized_prob, context):
+        """
+        Applies the uncertainty quantification with the shared posterior preprocessing of a ``UQContext''.
+        Stages that can reuse the marginalized posterior and importance weights override this; by default it calls ``apply_uq''.
+
+        Args:
+            unnormalized_prob (dictionary):
+                Dictionary containing the unnormalized class probabilities.
+            context (popclass.uq.UQContext):
+                shared posterior preprocessing of the classification.
+
+        Returns:
+            Dictionary of classes and associated unnormalized probability.
+        """
+        return self.apply_uq(
+            unnormalized_prob,
+            context.inference_data,
+            context.population_model,
+            context.parameters,
+        )
+
+
+class UQPipeline(additiveUQ):
+    """
+    Chain of additive UQ stages applied in order to the same classification. The posterior is marginalized and the
+    importance weights are computed once and shared by every stage through a ``UQContext''.
+    """
+
+    def __init__(self, stages):
+        """
+        Initialize UQPipeline.
+
+        Args:
+            stages (list[popclass.uq.additiveUQ]):
+                UQ stages, applied in order.
+        """
+        self.stages = list(stages)
+
+    def apply_uq(self, unnormalized_prob, inference_data, population_model, parameters):
+        """
+        Applies every stage to the classification results.
+
+        Args:
+            unnormalized_prob (dictionary):
+                Dictionary containing initial classification results, performed with the base population model.
+            inference_data (popclass.InferenceData):
+                popclass InferenceData object
+            population_model (popclass.PopulationModel):
+                popclass PopulationModel object
+            parameters (list):
+                Parameters to use for classification.
+
+        Returns:
+            Dictionary of classes and associated unnormalized probability after all stages.
+        """
+        return self.apply_uq_context(
+            unnormalized_prob, UQContext(inference_data, population_model, parameters)
+        )
+
+    def apply_uq_context(self, unnormalized_prob, context):
+        """
+        Applies every stage with the shared posterior preprocessing of a ``UQContext''.
+
+        Args:
+            unnormalized_prob (dictionary):
+                Dictionary containing the unnormalized class probabilities.
+            context (popclass.uq.UQContext):
+                shared posterior preprocessing of the classification.
+
+        Returns:
+            Dictionary of classes and associated unnormalized probability after all stages.
+        """
+        for stage in self.stages:
+            unnormalized_prob = stage.apply_uq_context(unnormalized_prob, context)
+        return unnormalized_prob
+
+    def integrand(self, inference_data, parameters, context=None):
+        """
+        None class integrand of the pipeline's None class stage, for ``classify(..., return_result=True)''.
+        A ``ClassificationResult'' keeps only the class integrals and the None class weight, so the pipeline must have
+        exactly one stage providing ``integrand'' (e.g. ``NoneClassUQ'') and every other stage must leave the
+        probabilities unchanged.
+
+        Args:
+            inference_data (popclass.InferenceData):
+                popclass InferenceData object
+            parameters (list):
+                Parameters to use for classification.
+            context (popclass.uq.UQContext, optional):
+                shared posterior preprocessing to reuse instead of marginalizing the posterior again. Default: None.
+
+        Returns:
+            numpy.ndarray of shape (number of samples,).
+
+        Raises:
+            ValueError: if the pipeline cannot be expressed by a single None class stage.
+        """
+        return self._integrand_stage().integrand(
+            inference_data, parameters, context=context
+        )
+
+    def integrate(self, inference_data, parameters, context=None):
+        """
+        Monte Carlo integral of the pipeline's None class stage, see ``integrand''.
+
+        Args:
+            inference_data (popclass.InferenceData):
+                popclass InferenceData object
+            parameters (list):
+                Parameters to use for classification.
+            context (popclass.uq.UQContext, optional):
+                shared posterior preprocessing to reuse instead of marginalizing the posterior again. Default: None.
+
+        Returns:
+            Tuple of the integral and its Monte Carlo variance.
+
+        Raises:
+            ValueError: if the pipeline cannot be expressed by a single None class stage.
+        """
+        return self._integrand_stage().integrate(
+            inference_data, parameters, context=context
+        )
+
+    @property
+    def none_class_weight(self):
+        """
+        None class weight of the pipeline's None class stage, see ``integrand''.
+
+        Raises:
+            ValueError: if the pipeline cannot be expressed by a single None class stage.
+        """
+        return self._integrand_stage().none_class_weight
+
+    def _integrand_stage(self):
+        """
+        The only stage providing ``integrand'', if every other stage is the identity ``additiveUQ''.
+        """
+        integrand_stages = [
+            stage for stage in self.stages if hasattr(stage, "integrand")
+        ]
+        others = [stage for stage in self.stages if not hasattr(stage, "integrand")]
+        if len(integrand_stages) != 1 or any(
+            type(stage) is not additiveUQ for stage in others
+        ):
+            raise ValueError(
+                "A UQ pipeline provides integrand() only with exactly one stage providing integrand() and no other stages changing the probabilities."
+            )
+        return integrand_stages[0]
+
+    @property
+    def fingerprint(self):
+        """
+        Return a content hash of the pipeline, combining the stage fingerprints in order.
+
+        Returns:
+            Hex digest string.
+
+        Raises:
+            AttributeError: if a stage does not provide a fingerprint.
+        """
+        digest = hashlib.sha256()
+        digest.update(type(self).__qualname__.encode())
+        for stage in self.stages:
+            if not hasattr(stage, "fingerprint"):
+                raise AttributeError(
+                    f"UQ stage {type(stage).__qualname__} does not provide a fingerprint."
+                )
+            digest.update(stage.fingerprint.encode())
+        return digest.hexdigest()
+
 
 class NoneClassUQ(additiveUQ):
     def __init__(
         self,
-        bounds,
+        bounds=None,
         grid_size=int(1e2),
         kde=gaussian_kde,
         kde_kwargs={"bw_method": 0.4},
@@ -26,15 +243,19 @@ class NoneClassUQ(additiveUQ):
         parameters=None,
         none_class_weight=0.01,
         base_model_kde=None,
+        use_model_density=False,
+        base_density_grid=None,
     ):
         """
         Initialize NoneClassUQ.
         The None class is constructed to have non-zero support in regions of low to no simulation support to reflect the epistemic uncertainty of the classifier.
 
         Args:
-            bounds (dictionary):
+            bounds (dictionary, optional):
                 Dictionary containing the lower and upper bounds of the parameter space, with keys
                 matching the supplied ``parameters'' list. Format: {key : [lower_bound, upper_bound]}
+                If None, the sample extent of ``population_model'' padded by 10%, read from its cached
+                class statistics. Default: None.
             grid_size (int, optional):
                 number of bin edges per dimension. Default: 1e2.
             kde (scipy.gaussian_kde-like):
@@ -49,7 +270,10 @@ class NoneClassUQ(additiveUQ):
                 Total weight assigned to the None class. Default: 0.01.
             base_model_kde (scipy.gaussian_kde instance-like, optional):
                 Pre-trained KDE to use (e.g. when classifying multiple objects with the same model). If not supplied, a new KDE will be constructed using ``kde'' and ``kde_kwargs'' arguments and ``population_model'' samples. Default: None.
-
+            use_model_density (bool, optional):
+                If True, the base density is the class-weighted sum of the ``population_model'' per-class density estimators evaluated on the grid, instead of a separate KDE fit to the pooled samples. ``kde'', ``kde_kwargs'' and ``base_model_kde'' are then ignored. Default: False.
+            base_density_grid (numpy.array, optional):
+                Precomputed base density at the raveled grid centers, shape [(grid_size-1)**dimensions] (e.g. from a binned density evaluation). If supplied, no density is evaluated and ``population_model'' is not required. Default: None.
 
         """
 
@@ -61,6 +285,21 @@ class NoneClassUQ(additiveUQ):
         self.kde = kde
         self.none_class_weight = none_class_weight
         self.kde_kwargs = kde_kwargs
+        self.use_model_density = use_model_density
+        self.base_density_grid = base_density_grid
+
+        if self.bounds is None:
+            if self.population_model is None or self.parameters is None:
+                raise ValueError(
+                    "No bounds supplied and no population model and parameters to derive them from. None class cannot be created."
+                )
+            self.bounds = {
+                parameter: list(parameter_bounds)
+                for parameter, parameter_bounds in zip(
+                    self.parameters, self.population_model.bounds(self.parameters)
+                )
+            }
+
         self._build_grids()
 
         if self.parameters is None:
@@ -68,7 +307,15 @@ class NoneClassUQ(additiveUQ):
                 "No parameters to use supplied. None class cannot be created."
             )
 
-        if self.base_model_kde is None:
+        if self.base_density_grid is not None:
+            # Base density supplied directly, nothing to build.
+            pass
+        elif self.use_model_density:
+            if self.population_model is None:
+                raise ValueError(
+                    "No population model supplied for building the None class PDF from model densities. None class cannot be created."
+                )
+        elif self.base_model_kde is None:
             if self.population_model is None:
                 raise ValueError(
                     "No pre-trained KDE or population samples supplied for building the None class PDF. None class cannot be created."
@@ -134,10 +381,40 @@ class NoneClassUQ(additiveUQ):
         ) * np.ones(self.grid_centers_raveled.shape[0])
         return
 
-    def _build_none_pdf_binned(self):
-        pop_model_eval_centers = self.base_model_kde.evaluate(
-            self.grid_centers_raveled.T
+    def _evaluate_model_density(self, points):
+        """
+        Evaluate the class-weighted sum of the population model densities.
+
+        Args:
+            points (numpy.array):
+                points to evaluate on, shape [# points, dimensions] with the
+                dimensions ordered as the grid.
+        Returns:
+            density (numpy.array): summed density at each point.
+        """
+        grid_parameters = list(self.grid.keys())
+        return np.sum(
+            [
+                self.population_model.class_weight(class_name)
+                * self.population_model.evaluate_density(
+                    class_name=class_name, parameters=grid_parameters, points=points
+                )
+                for class_name in self.population_model.classes
+            ],
+            axis=0,
         )
+
+    def _build_none_pdf_binned(self):
+        if self.base_density_grid is not None:
+            pop_model_eval_centers = np.asarray(self.base_density_grid)
+        elif self.use_model_density:
+            pop_model_eval_centers = self._evaluate_model_density(
+                self.grid_centers_raveled
+            )
+        else:
+            pop_model_eval_centers = self.base_model_kde.evaluate(
+                self.grid_centers_raveled.T
+            )
         max_pop_model_eval_centers = np.amax(pop_model_eval_centers)
 
         none_class_pdf_centers_unnormed = (
@@ -153,6 +430,7 @@ class NoneClassUQ(additiveUQ):
         self.none_pdf_binned = none_class_pdf_centers.reshape(
             self.grid_mesh_centers[0].shape
         )
+        self._none_pdf_digest = None
 
     def apply_uq(self, unnormalized_prob, inference_data, population_model, parameters):
         """
@@ -177,21 +455,101 @@ class NoneClassUQ(additiveUQ):
 
         """
 
+        return self.apply_uq_context(
+            unnormalized_prob, UQContext(inference_data, population_model, parameters)
+        )
+
+    def apply_uq_context(self, unnormalized_prob, context):
+        """
+        Applies ``None'' class uncertainty quantification, reusing the marginalized posterior and importance weights of a ``UQContext''.
+
+        Args:
+            unnormalized_prob (dictionary):
+                Dictionary containing initial classification results, performed with the base population model.
+            context (popclass.uq.UQContext):
+                shared posterior preprocessing of the classification.
+
+        Returns:
+            Dictionary of classes and associated unnormalized probability, with the appended ``None'' class.
+        """
         for class_name, value in unnormalized_prob.items():
             unnormalized_prob[class_name] = value * (1 - self.none_class_weight)
 
-        posterior = inference_data.posterior.marginal(parameters)
-
-        none_evaluated = (
-            np.mean(self.evaluate(posterior) / inference_data.prior_density)
-            if self.none_pdf_binned is not None
-            else 0.0
+        none_evaluated, _ = self.integrate(
+            context.inference_data, context.parameters, context=context
         )
 
         unnormalized_prob["None"] = self.none_class_weight * none_evaluated
 
         return unnormalized_prob
 
+    @property
+    def fingerprint(self):
+        """
+        Return a content hash of the None class configuration.
+
+        The hash covers the binned None class PDF, its grid and the None class
+        weight, which together fix the output of ``apply_uq''.
+
+        Returns:
+            Hex digest string.
+        """
+        if self._none_pdf_digest is None and self.none_pdf_binned is not None:
+            none_pdf_binned = np.ascontiguousarray(self.none_pdf_binned)
+            digest = hashlib.sha256()
+            digest.update(
+                repr((none_pdf_binned.dtype.str, none_pdf_binned.shape)).encode()
+            )
+            digest.update(none_pdf_binned.tobytes())
+            self._none_pdf_digest = digest.hexdigest()
+
+        digest = hashlib.sha256()
+        digest.update(type(self).__qualname__.encode())
+        update_digest(digest, [str(parameter) for parameter in self.parameters])
+        update_digest(digest, dict(self.bounds))
+        digest.update(repr((self.grid_size, float(self.none_class_weight))).encode())
+        digest.update(repr(self._none_pdf_digest).encode())
+        return digest.hexdigest()
+
+    def integrand(self, inference_data, parameters, context=None):
+        """
+        None class probability distribution at every posterior sample, with the prior divided out and without the None class weight applied.
+
+        Args:
+            inference_data (popclass.InferenceData):
+                popclass InferenceData object
+            parameters (list):
+                Parameters to use for classification.
+            context (popclass.uq.UQContext, optional):
+                shared posterior preprocessing to reuse instead of marginalizing the posterior again. Default: None.
+
+        Returns:
+            numpy.ndarray of shape (number of samples,).
+        """
+        if context is None:
+            context = UQContext(inference_data, None, parameters)
+        if self.none_pdf_binned is None:
+            return np.zeros(len(context.importance_weights))
+        return self.evaluate(context.posterior) * context.importance_weights
+
+    def integrate(self, inference_data, parameters, context=None):
+        """
+        Monte Carlo integral of the None class probability distribution over the posterior, with the prior divided out and without the None class weight applied.
+
+        Args:
+            inference_data (popclass.InferenceData):
+                popclass InferenceData object
+            parameters (list):
+                Parameters to use for classification.
+            context (popclass.uq.UQContext, optional):
+                shared posterior preprocessing to reuse instead of marginalizing the posterior again. Default: None.
+
+        Returns:
+            Tuple of the integral and its Monte Carlo variance.
+        """
+        integrand = self.integrand(inference_data, parameters, context=context)
+        return np.mean(integrand), np.var(integrand) / len(integrand)
+
     def evaluate(self, posterior):
         """
         Evaluates the pre-constructed None class probability for a popclass.Posterior object, returning p(sample parameter values | None class, model) for each sample in the provided posterior distribution.
@@ -231,6 +589,163 @@ class NoneClassUQ(additiveUQ):
         return eval_
 
 
+class BootstrapUQ:
+    """
+    Bootstrap uncertainty of the class probabilities under resampling of the population simulation.
+    Each replicate resamples every class with replacement and keeps the fitted kernel bandwidth. A class integral is linear in the
+    per-sample resampling weights, so the kernel contribution of every population sample to the posterior integral is computed
+    once, and all replicates are evaluated together as one matrix product instead of rerunning ``classify'' per replicate.
+    """
+
+    def __init__(
+        self,
+        n_bootstrap=200,
+        percentiles=(5, 95),
+        random_state=0,
+        executor=None,
+        max_elements=2**22,
+    ):
+        """
+        Initialize BootstrapUQ.
+
+        Args:
+            n_bootstrap (int, optional):
+                number of bootstrap replicates. Default: 200.
+            percentiles (tuple, optional):
+                lower and upper percentiles of the probability intervals. Default: (5, 95).
+            random_state (int, optional):
+                seed of the resampling. Default: 0.
+            executor (concurrent.futures.Executor, optional):
+                executor computing the kernel contributions of the classes in parallel, e.g. a ``ThreadPoolExecutor''
+                or ``ProcessPoolExecutor''. If None, classes are computed serially. Default: None.
+            max_elements (int, optional):
+                largest number of population-posterior sample pairs evaluated at once. Default: 2**22.
+        """
+        self.n_bootstrap = n_bootstrap
+        self.percentiles = percentiles
+        self.random_state = random_state
+        self.executor = executor
+        self.max_elements = max_elements
+
+    def bootstrap(self, inference_data, population_model, parameters):
+        """
+        Compute bootstrap replicates and percentile intervals of the class probabilities.
+        The class density estimators must be Gaussian kernel density estimates exposing ``dataset'' and ``covariance''
+        (e.g. ``scipy.stats.gaussian_kde'').
+
+        Args:
+            inference_data (popclass.InferenceData):
+                popclass InferenceData object
+            population_model (popclass.PopulationModel):
+                popclass PopulationModel object
+            parameters (list):
+                Parameters to use for classification.
+
+        Returns:
+            Dictionary with ``probabilities'' (class probabilities of the full population, as from ``classify''),
+            ``replicates'' (class name to array of shape [n_bootstrap]) and ``intervals'' (class name to the
+            (lower, upper) percentiles).
+
+        Raises:
+            ValueError: if a class density estimator is not a Gaussian kernel density estimate.
+        """
+        posterior = inference_data.posterior.marginal(parameters)
+        importance_weights = inference_data.importance_weights
+        class_names = population_model.classes
+
+        datasets, covariances, base_weights = [], [], []
+        for class_name in class_names:
+            estimator = population_model.density_estimator(
+                class_name, posterior.parameter_labels
+            )
+            if not (hasattr(estimator, "dataset") and hasattr(estimator, "covariance")):
+                raise ValueError(
+                    f"Density estimator of {class_name} does not expose the dataset and covariance of a Gaussian KDE. Bootstrap cannot be computed."
+                )
+            datasets.append(np.atleast_2d(estimator.dataset))
+            covariances.append(np.atleast_2d(estimator.covariance))
+            base_weights.append(getattr(estimator, "weights", None))
+
+        map_ = map if self.executor is None else self.executor.map
+        contributions = list(
+            map_(
+                _kernel_contributions,
+                datasets,
+                covariances,
+                [posterior.samples] * len(class_names),
+                [importance_weights] * len(class_names),
+                [self.max_elements] * len(class_names),
+            )
+        )
+
+        rng = np.random.default_rng(self.random_state)
+        integrals, replicate_integrals = [], []
+        for dataset, weights, contribution in zip(
+            datasets, base_weights, contributions
+        ):
+            n = dataset.shape[1]
+            weights = np.full(n, 1.0 / n) if weights is None else np.asarray(weights)
+            integrals.append(weights @ contribution)
+            resample_weights = rng.multinomial(n, weights, size=self.n_bootstrap) / n
+            replicate_integrals.append(resample_weights @ contribution)
+
+        class_weights = np.array(
+            [population_model.class_weight(class_name) for class_name in class_names]
+        )
+        weighted = np.array(integrals) * class_weights
+        probabilities = weighted / np.sum(weighted)
+        replicates = np.array(replicate_integrals) * class_weights[:, np.newaxis]
+        replicates = replicates / np.sum(replicates, axis=0)
+
+        return {
+            "probabilities": dict(zip(class_names, probabilities.tolist())),
+            "replicates": dict(zip(class_names, replicates)),
+            "intervals": {
+                class_name: tuple(np.percentile(replicate, self.percentiles).tolist())
+                for class_name, replicate in zip(class_names, replicates)
+            },
+        }
+
+
+def _kernel_contributions(
+    dataset, covariance, points, importance_weights, max_elements
+):
+    """
+    Contribution of every population sample to the Monte Carlo integral of a Gaussian KDE over the posterior:
+    the mean over posterior points of the sample's kernel times the importance weights.
+
+    Args:
+        dataset (numpy.array): population samples, shape [dimensions, # samples].
+        covariance (numpy.array): kernel covariance, shape [dimensions, dimensions].
+        points (numpy.array): posterior samples, shape [# points, dimensions].
+        importance_weights (numpy.array): importance weights of the posterior samples, shape [# points].
+        max_elements (int): largest number of sample-point pairs evaluated at once.
+    Returns:
+        contributions (numpy.array): shape [# samples].
+    """
+    cholesky = np.linalg.cholesky(covariance)
+    whiten = np.linalg.inv(cholesky)
+    norm = 1.0 / ((2 * np.pi) ** (len(covariance) / 2.0) * np.prod(np.diag(cholesky)))
+
+    samples = (whiten @ dataset).T
+    points = (whiten @ np.asarray(points).T).T
+    samples_sq = np.sum(samples**2, axis=1)
+    points_sq = np.sum(points**2, axis=1)
+    weights = np.asarray(importance_weights) * norm / len(points)
+
+    contributions = np.zeros(len(samples))
+    step = max(1, max_elements // len(points))
+    for start in range(0, len(samples), step):
+        rows = slice(start, start + step)
+        distance_sq = (
+            samples_sq[rows, np.newaxis]
+            + points_sq[np.newaxis, :]
+            - 2 * samples[rows] @ points.T
+        )
+        contributions[rows] = np.exp(-0.5 * np.maximum(distance_sq, 0)) @ weights
+    return contributions
+
+
 def calculate_square_grid_coordinates(grid_size, bounds):
     """
         Calculates the coordinates of the corners for a grid bounded in some domain in arbitrary dimension.
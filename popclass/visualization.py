@@ -1,10 +1,18 @@
 """
 Light visualization library.
 """
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from mpl_toolkits.axes_grid1 import make_axes_locatable
+from scipy.signal import fftconvolve
+from scipy.stats import multivariate_normal
 
 color_cycler = [
     "#009988",
@@ -19,10 +27,12 @@ cmap_cycler = ["Greens", "RdPu", "Oranges", "Blues", "Reds", "Purples"]
 
 marker_cycler = ["o", "^", "*", "s", "H"]
 
+DENSITY_METHODS = ["exact", "fft"]
+
 
 def get_bounds(PopulationModel, parameters):
     """
-    Creates bounds on the basis of a PopulationModel and given parameters, if they are not specified by the user. Bounds are automatically constructed to be 10% of the extent in samples beyond the minimum and maximum value found in samples for each parameter.
+    Creates bounds on the basis of a PopulationModel and given parameters, if they are not specified by the user. Bounds are automatically constructed to be 10% of the extent in samples beyond the minimum and maximum value found in samples for each parameter, read from the cached class statistics (``PopulationModel.class_statistics'') rather than the samples.
 
     Args:
         PopulationModel (class) - as defined in model.py, class containing the population samples and parameters
@@ -34,29 +44,220 @@ def get_bounds(PopulationModel, parameters):
         bounds (numpy.ndarray) - pairs of upper and lower bounds for each parameter. Shape (N_dim, 2), where N_dim is equal to the number of parameters and has the same order.
     """
 
-    ndim = len(parameters)
-    classes = PopulationModel.classes
-    bounds = np.array([[0.0, 0.0] for i in range(ndim)])
-
-    samples_all = np.concatenate(
-        (
-            [
-                PopulationModel.samples(class_name=class_name, parameters=parameters)
-                for class_name in classes
-            ]
-        )
+    return PopulationModel.bounds(parameters, padding=0.1)
+
+
+def binned_density(samples, bins, covariance, kernel_extent=4.0, floor=1e-10):
+    """
+    Approximate a Gaussian kernel density estimate on a regular grid by binning the samples and convolving the histogram with the kernel using FFTs. The cost is roughly O(N_samples + N_grid log N_grid) instead of O(N_samples * N_grid) for direct evaluation. Samples outside the grid still contribute if they lie within ``kernel_extent'' kernel widths of it.
+
+    The FFT leaves round-off noise, including small negative values, far from the samples. Densities below ``floor'' times the peak density are raised to that level, so the noise neither goes negative nor shows up as spurious low-level contours.
+
+    Args:
+        samples (numpy.ndarray) - samples of shape (N_samples, N_dim)
+
+        bins (numpy.ndarray) - regular bin edges for each dimension, shape (N_dim, N_bins + 1)
+
+        covariance (numpy.ndarray) - kernel covariance matrix, shape (N_dim, N_dim) (e.g. ``scipy.stats.gaussian_kde.covariance``)
+
+        kernel_extent (float, optional) - number of kernel standard deviations the kernel is truncated at. Default: 4.
+
+        floor (float, optional) - lowest density returned, relative to the peak density. With 0, the density is only clipped at zero. Default: 1e-10.
+
+    Returns
+    -------
+        density (numpy.ndarray) - density at the bin centers. Shape (N_bins,) in 1D, otherwise oriented like ``np.meshgrid`` of the bin centers (first two axes swapped).
+    """
+    ndim, num_edges = bins.shape
+    num_bins = num_edges - 1
+    covariance = np.atleast_2d(covariance)
+    widths = bins[:, 1] - bins[:, 0]
+    half_widths = np.ceil(kernel_extent * np.sqrt(np.diag(covariance)) / widths)
+    half_widths = half_widths.astype(int)
+
+    edges = [
+        bins[d][0] + widths[d] * np.arange(-half_widths[d], num_edges + half_widths[d])
+        for d in range(ndim)
+    ]
+    hist, _ = np.histogramdd(samples, bins=edges)
+
+    offsets = np.meshgrid(
+        *[
+            widths[d] * np.arange(-half_widths[d], half_widths[d] + 1)
+            for d in range(ndim)
+        ],
+        indexing="ij",
     )
-    for counter, param in enumerate(parameters):
-        param_min, param_max = np.min(samples_all[:, counter]), np.max(
-            samples_all[:, counter]
+    offset_points = np.stack([a.ravel() for a in offsets], axis=-1)
+    kernel = multivariate_normal(
+        mean=np.zeros(ndim), cov=covariance, allow_singular=True
+    ).pdf(offset_points)
+    kernel = np.reshape(kernel, offsets[0].shape)
+
+    density = fftconvolve(hist, kernel, mode="same") / len(samples)
+    density = density[
+        tuple(slice(half_widths[d], half_widths[d] + num_bins) for d in range(ndim))
+    ]
+    density = np.maximum(density, max(floor * np.max(density), 0.0))
+
+    if ndim > 1:
+        density = np.swapaxes(density, 0, 1)
+    return density
+
+
+def evaluate_density_grid(
+    PopulationModel, class_name, parameters, bins, density_method="exact"
+):
+    """
+    Evaluate the density of a class at the centers of a regular grid.
+
+    Args:
+        PopulationModel (class) - as defined in model.py, class containing the population samples, parameters, and a method for evaluating density
+
+        class_name (str) - class to evaluate the density of
+
+        parameters (list of str) - parameters spanning the grid (must be found in PopulationModel.parameters)
+
+        bins (numpy.ndarray) - regular bin edges for each parameter, shape (N_dim, N_bins + 1)
+
+        density_method (str, optional) - "exact" evaluates the PopulationModel density estimator at every bin center. "fft" uses ``binned_density'' with the covariance of the class density estimator (Scott's rule if the estimator has no ``covariance'' attribute), which approximates a Gaussian KDE in O(N_samples + N_grid log N_grid). Default: "exact".
+
+    Returns
+    -------
+        density (numpy.ndarray) - density at the bin centers. Shape (N_bins,) in 1D, otherwise oriented like ``np.meshgrid`` of the bin centers.
+    """
+    if density_method not in DENSITY_METHODS:
+        raise ValueError(
+            f"Density method {density_method} not supported. Supported methods are: {DENSITY_METHODS}"
+        )
+
+    bin_centers = (bins[:, 1:] + bins[:, :-1]) / 2
+    if density_method == "exact":
+        mesh = np.meshgrid(*bin_centers)
+        coords_eval = np.vstack([a.ravel() for a in mesh])
+        density_eval = PopulationModel.evaluate_density(
+            class_name=class_name,
+            parameters=parameters,
+            points=coords_eval.swapaxes(0, 1),
         )
-        param_lower, param_upper = (
-            param_min - (param_max - param_min) / 10,
-            param_max + (param_max - param_min) / 10,
+        return np.reshape(density_eval, mesh[0].shape)
+
+    samples = PopulationModel.samples(class_name=class_name, parameters=parameters)
+    estimator = PopulationModel.density_estimator(class_name, parameters)
+    covariance = getattr(estimator, "covariance", None)
+    if covariance is None:
+        statistics = PopulationModel.class_statistics(class_name, parameters)
+        covariance = statistics["covariance"] * statistics["count"] ** (
+            -2.0 / (len(parameters) + 4)
         )
-        bounds[counter] = param_lower, param_upper
+    return binned_density(samples, bins, covariance)
+
+
+class DensityGridCache:
+    """
+    Least-recently-used cache of plotting bounds and class density grids, shared between visualization calls.
 
-    return bounds
+    Bounds are keyed by the population model fingerprint and parameters. Density grids are keyed by the class fingerprint, parameters, grid bounds, number of bins and density method, so changing figure styling (or toggling options such as ``plot_samples'') reuses the grids, while changing a class only invalidates that class.
+
+    Caching across calls is opt-in: pass the same DensityGridCache as ``grid_cache'' to the plotting functions. The grids it keeps are bounded by ``max_bytes'', and ``clear'' (or dropping the cache object) releases them.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, max_bounds=64):
+        """
+        Initialize DensityGridCache.
+
+        Args:
+            max_bytes (int, optional) - maximum total size of the density grids kept. Grids larger than this are not cached. Default: 64 MiB.
+
+            max_bounds (int, optional) - maximum number of bounds kept. Default: 64.
+        """
+        self.max_bytes = max_bytes
+        self.max_bounds = max_bounds
+        self.nbytes = 0
+        self._bounds = OrderedDict()
+        self._grids = OrderedDict()
+
+    def bounds(self, PopulationModel, parameters):
+        """
+        Cached version of ``get_bounds''.
+
+        Args:
+            PopulationModel (class) - as defined in model.py
+
+            parameters (list of str) - parameters to get the bounds for
+
+        Returns
+        -------
+            bounds (numpy.ndarray) - see ``get_bounds''.
+        """
+        key = (PopulationModel.fingerprint, tuple(parameters))
+        if key not in self._bounds:
+            self._bounds[key] = get_bounds(PopulationModel, parameters)
+        self._bounds.move_to_end(key)
+        bounds = self._bounds[key].copy()
+        while len(self._bounds) > self.max_bounds:
+            self._bounds.popitem(last=False)
+        return bounds
+
+    def density_grid(
+        self, PopulationModel, class_name, parameters, bins, density_method="exact"
+    ):
+        """
+        Cached version of ``evaluate_density_grid''. The returned array is read-only.
+
+        Args:
+            PopulationModel (class) - as defined in model.py
+
+            class_name (str) - class to evaluate the density of
+
+            parameters (list of str) - parameters spanning the grid
+
+            bins (numpy.ndarray) - regular bin edges for each parameter, shape (N_dim, N_bins + 1)
+
+            density_method (str, optional) - "exact" or "fft". Default: "exact".
+
+        Returns
+        -------
+            density (numpy.ndarray) - see ``evaluate_density_grid''.
+        """
+        key = (
+            PopulationModel.class_fingerprint(class_name),
+            tuple(parameters),
+            tuple(bins[:, 0]),
+            tuple(bins[:, -1]),
+            bins.shape[1] - 1,
+            density_method,
+        )
+        if key in self._grids:
+            self._grids.move_to_end(key)
+            return self._grids[key]
+
+        grid = evaluate_density_grid(
+            PopulationModel,
+            class_name=class_name,
+            parameters=parameters,
+            bins=bins,
+            density_method=density_method,
+        )
+        grid.setflags(write=False)
+        if grid.nbytes <= self.max_bytes:
+            self._grids[key] = grid
+            self.nbytes += grid.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._grids.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return grid
+
+    def clear(self):
+        """
+        Remove all cached bounds and grids.
+        """
+        self._bounds.clear()
+        self._grids.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._grids)
 
 
 def plot_population_model(
@@ -69,6 +270,8 @@ def plot_population_model(
     N_hist=40,
     levels=5,
     legend=False,
+    density_method="exact",
+    grid_cache=None,
 ):
     """
      Represent the population samples and/or their KDEs in the defined parameter space for each individual class in a figure.
@@ -92,6 +295,10 @@ def plot_population_model(
 
         legend (bool) - flag for including plot legend. Default: False.
 
+        density_method (str, optional) - "exact" or "fft". How the KDEs are evaluated on the grid, see ``evaluate_density_grid''. Default: "exact".
+
+        grid_cache (DensityGridCache or None, optional) - cache for bounds and density grids, reused across calls. If None, nothing is kept after the call. Default: None.
+
     Returns
     -------
         fig, ax (matplotlib objects) - figure visualising population distributions in the specified parameter space
@@ -101,10 +308,13 @@ def plot_population_model(
 
     ndim = len(parameters)
 
+    if grid_cache is None:
+        grid_cache = DensityGridCache()
+
     fig, ax = plt.subplots()
 
     if bounds is None:
-        bounds = get_bounds(PopulationModel, parameters)
+        bounds = grid_cache.bounds(PopulationModel, parameters)
 
     bins = np.linspace(bounds.T[:][0], bounds.T[:][1], N_bins + 1).T
     bin_centers = (bins[:, 1:] + bins[:, :-1]) / 2
@@ -113,7 +323,6 @@ def plot_population_model(
         coords_eval = bin_centers
     elif ndim == 2:
         X, Y = np.meshgrid(bin_centers[0], bin_centers[1])
-        coords_eval = np.vstack((X.ravel(), Y.ravel()))
     else:
         raise ValueError(
             "Only plotting 1D and 2D distributions is currently supported."
@@ -144,12 +353,14 @@ def plot_population_model(
                 )
 
         if plot_kdes:
+            eval_ = grid_cache.density_grid(
+                PopulationModel,
+                class_name=class_name,
+                parameters=parameters,
+                bins=bins,
+                density_method=density_method,
+            )
             if ndim == 1:
-                eval_ = PopulationModel.evaluate_density(
-                    class_name=class_name,
-                    parameters=parameters,
-                    points=coords_eval.swapaxes(0, 1),
-                )
                 ax.plot(
                     coords_eval[0],
                     eval_,
@@ -157,15 +368,10 @@ def plot_population_model(
                     label=f"{class_name} density estimate",
                 )
             else:
-                eval_ = PopulationModel.evaluate_density(
-                    class_name=class_name,
-                    parameters=parameters,
-                    points=coords_eval.swapaxes(0, 1),
-                )
                 ax.contour(
                     X,
                     Y,
-                    eval_.reshape(np.shape(X)),
+                    eval_,
                     colors=color_cycler[counter % 6],
                     linewidths=2,
                     levels=levels,
@@ -201,6 +407,8 @@ def plot_rel_prob_surfaces(
     create_none_class=None,
     none_kde=None,
     none_kde_kwargs={},
+    density_method="exact",
+    grid_cache=None,
 ):
     """
     Plots 2D relative probability surfaces (p(class | parameters, model)). A visualisation of probability the classifier would return, for points with exactly known parameters, of belonging to the given class, taking into account distributions and weights of all classes.
@@ -222,6 +430,10 @@ def plot_rel_prob_surfaces(
 
         none_kde_kwargs (dictionary) - extra arguments for evaluating the overall sample density in the process of building the None class. Passed as the ``kde_kwargs'' argument when initializing the None class object. Default: {}.
 
+        density_method (str, optional) - "exact" or "fft". How the class densities are evaluated on the grid, see ``evaluate_density_grid''. With "fft", the None class base density is the class-weighted sum of the class surfaces (passed as ``base_density_grid''), so ``none_kde'' and ``none_kde_kwargs'' are not used. Default: "exact".
+
+        grid_cache (DensityGridCache or None, optional) - cache for bounds and density grids, reused across calls. If None, nothing is kept after the call. Default: None.
+
 
     Returns
     -------
@@ -237,25 +449,25 @@ def plot_rel_prob_surfaces(
             "Only 2-parameter input is currently supported for plotting relative probability surfaces."
         )
     else:
+        if grid_cache is None:
+            grid_cache = DensityGridCache()
+
         if bounds is None:
-            bounds = get_bounds(PopulationModel, parameters)
+            bounds = grid_cache.bounds(PopulationModel, parameters)
 
         bins = np.linspace(bounds.T[:][0], bounds.T[:][1], N_bins + 1).T
-        bin_centers = (bins[:, 1:] + bins[:, :-1]) / 2
-
-        X, Y = np.meshgrid(bin_centers[0], bin_centers[1])
-        coords_eval = np.vstack((X.ravel(), Y.ravel()))
 
         maps_2d = []
         weights = []
 
         for class_name in classes:
-            density_eval = PopulationModel.evaluate_density(
+            map_2d = grid_cache.density_grid(
+                PopulationModel,
                 class_name=class_name,
                 parameters=parameters,
-                points=coords_eval.swapaxes(0, 1),
+                bins=bins,
+                density_method=density_method,
             )
-            map_2d = np.reshape(density_eval, X.shape)
 
             weight = PopulationModel.class_weight(class_name)
 
@@ -267,14 +479,26 @@ def plot_rel_prob_surfaces(
             for counter, parameter in enumerate(parameters):
                 bounds_dict[parameter] = bounds[counter]
 
-            none_class = create_none_class(
-                bounds=bounds_dict,
-                grid_size=N_bins + 1,
-                population_model=PopulationModel,
-                parameters=parameters,
-                kde=none_kde,
-                kde_kwargs=none_kde_kwargs,
-            )
+            if density_method == "fft":
+                none_class = create_none_class(
+                    bounds=bounds_dict,
+                    grid_size=N_bins + 1,
+                    population_model=PopulationModel,
+                    parameters=parameters,
+                    base_density_grid=np.sum(
+                        [weight * map_2d for weight, map_2d in zip(weights, maps_2d)],
+                        axis=0,
+                    ).ravel(),
+                )
+            else:
+                none_class = create_none_class(
+                    bounds=bounds_dict,
+                    grid_size=N_bins + 1,
+                    population_model=PopulationModel,
+                    parameters=parameters,
+                    kde=none_kde,
+                    kde_kwargs=none_kde_kwargs,
+                )
 
             classes.append("None")
             map_none = none_class.none_pdf_binned
@@ -336,3 +560,157 @@ def plot_rel_prob_surfaces(
             axes.append(ax)
 
         return figs, axes
+
+
+def render_corner_plots(
+    PopulationModel,
+    output_dir,
+    parameters=None,
+    classes=None,
+    bounds=None,
+    N_bins=100,
+    levels=5,
+    density_method="fft",
+    n_workers=1,
+    file_format="png",
+    dpi=150,
+    grid_cache=None,
+):
+    """
+    Headless batch export of corner-style figures, one per class, with the 1D class density of every parameter on the diagonal and the 2D class density of every parameter pair below it. Density grids are computed once per class and parameter pair in the calling process, and the figures are rendered with the Agg canvas in worker processes and written straight to disk, so no figure is kept alive.
+
+    Args:
+        PopulationModel (class) - as defined in model.py, class containing the population samples, parameters, and a method for evaluating density
+
+        output_dir (str) - directory to write the figures to. Created if it does not exist.
+
+        parameters (list of str or None, optional) - parameters spanning the corner plot. If None, all PopulationModel.parameters are used. Default: None.
+
+        classes (list of str or None, optional) - classes to render. If None, all PopulationModel.classes are rendered. Default: None.
+
+        bounds (array-like or None, optional) - pairs of upper and lower bounds for each parameter, shape (N_dim, 2). If None, constructed as in ``get_bounds''. Default: None.
+
+        N_bins (int, optional) - Resolution of the density grids. Default: 100.
+
+        levels (int or array-like, optional) - Number and/or positions of contour lines in the 2D panels. Default: 5.
+
+        density_method (str, optional) - "exact" or "fft", see ``evaluate_density_grid''. Default: "fft".
+
+        n_workers (int, optional) - number of worker processes rendering figures. With 1, figures are rendered in the calling process. Default: 1.
+
+        file_format (str, optional) - image file extension passed to ``savefig''. Default: "png".
+
+        dpi (int, optional) - resolution of the written images. Default: 150.
+
+        grid_cache (DensityGridCache or None, optional) - cache for bounds and density grids, reused across calls. Size its ``max_bytes'' to hold every panel of the figures (N_classes * N_dim * (N_dim + 1) / 2 grids) for a rerun to reuse them all. If None, the grids are computed without caching. Default: None.
+
+    Returns
+    -------
+        paths (list of str) - paths of the written figures, in the order of ``classes''.
+    """
+    if grid_cache is None:
+        density_grid = evaluate_density_grid
+    else:
+        density_grid = grid_cache.density_grid
+    if parameters is None:
+        parameters = list(PopulationModel.parameters)
+    all_classes = PopulationModel.classes
+    if classes is None:
+        classes = all_classes
+    if bounds is None:
+        if grid_cache is None:
+            bounds = get_bounds(PopulationModel, parameters)
+        else:
+            bounds = grid_cache.bounds(PopulationModel, parameters)
+    bounds = np.asarray(bounds, dtype=float)
+
+    ndim = len(parameters)
+    bins = np.linspace(bounds.T[:][0], bounds.T[:][1], N_bins + 1).T
+    bin_centers = (bins[:, 1:] + bins[:, :-1]) / 2
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = []
+    for class_name in classes:
+        panels = {}
+        for i in range(ndim):
+            panels[(i, i)] = density_grid(
+                PopulationModel,
+                class_name=class_name,
+                parameters=[parameters[i]],
+                bins=bins[[i]],
+                density_method=density_method,
+            )
+            for j in range(i):
+                panels[(i, j)] = density_grid(
+                    PopulationModel,
+                    class_name=class_name,
+                    parameters=[parameters[j], parameters[i]],
+                    bins=bins[[j, i]],
+                    density_method=density_method,
+                )
+        tasks.append(
+            {
+                "class_name": class_name,
+                "parameters": list(parameters),
+                "bounds": bounds,
+                "bin_centers": bin_centers,
+                "panels": panels,
+                "levels": levels,
+                "color": color_cycler[all_classes.index(class_name) % 6],
+                "path": os.path.join(output_dir, f"{class_name}.{file_format}"),
+                "dpi": dpi,
+            }
+        )
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(_render_corner_figure, tasks))
+    return [_render_corner_figure(task) for task in tasks]
+
+
+def _render_corner_figure(task):
+    """
+    Render one corner figure from precomputed density grids and write it to disk.
+    Uses the Agg canvas directly so no pyplot figure manager keeps it alive.
+    """
+    parameters = task["parameters"]
+    bounds = task["bounds"]
+    bin_centers = task["bin_centers"]
+    color = task["color"]
+    ndim = len(parameters)
+
+    fig = Figure(figsize=(2.5 * ndim, 2.5 * ndim))
+    FigureCanvasAgg(fig)
+    axes = np.atleast_2d(fig.subplots(ndim, ndim, squeeze=False))
+
+    for i in range(ndim):
+        for j in range(ndim):
+            ax = axes[i, j]
+            if j > i:
+                ax.set_axis_off()
+                continue
+            if i == j:
+                ax.plot(bin_centers[i], task["panels"][(i, i)], color=color)
+                ax.set_yticks([])
+            else:
+                ax.contour(
+                    bin_centers[j],
+                    bin_centers[i],
+                    task["panels"][(i, j)],
+                    colors=color,
+                    levels=task["levels"],
+                )
+                ax.set_ylim(bounds[i])
+            ax.set_xlim(bounds[j])
+            if i == ndim - 1:
+                ax.set_xlabel(f"{parameters[j]}")
+            else:
+                ax.set_xticklabels([])
+            if j == 0 and i > 0:
+                ax.set_ylabel(f"{parameters[i]}")
+            elif j > 0:
+                ax.set_yticklabels([])
+
+    fig.suptitle(f"{task['class_name']}")
+    fig.savefig(task["path"], dpi=task["dpi"])
+    return task["path"]
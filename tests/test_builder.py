@@ -0,0 +1,112 @@
+"""
+Tests for the streaming population model builder in builder.py
+"""
+import numpy as np
+import pytest
+
+from popclass.builder import PopulationModelBuilder
+from popclass.model import PopulationModel
+
+pytest.importorskip("h5py")
+
+
+def _catalog_chunks(num_chunks, chunk_size):
+    rng = np.random.default_rng(1)
+    for _ in range(num_chunks):
+        yield {
+            "t_E": 10 ** rng.normal(1.5, 0.3, size=chunk_size),
+            "pi_E": 10 ** rng.normal(-1.0, 0.3, size=chunk_size),
+            "mass": rng.uniform(0, 20, size=chunk_size),
+        }
+
+
+def _class_rule(chunk):
+    labels = np.where(chunk["mass"] < 1.4, "white_dwarf", "black_hole")
+    labels = labels.astype(object)
+    labels[chunk["mass"] < 1] = "star"
+    labels[chunk["mass"] > 18.5] = ""
+    labels[chunk["mass"] > 19] = None
+    return labels
+
+
+def test_builder_streams_catalog(tmp_path):
+    """
+    test streamed catalog chunks build the same model as the full catalog
+    """
+    path = tmp_path / "model.h5"
+    chunks = list(_catalog_chunks(5, 1000))
+    columns = {
+        "log10tE": lambda chunk: np.log10(chunk["t_E"]),
+        "log10piE": lambda chunk: np.log10(chunk["pi_E"]),
+        "mass": "mass",
+    }
+
+    with PopulationModelBuilder(
+        path,
+        "test_model",
+        ["log10tE", "log10piE", "mass"],
+        _class_rule,
+        columns=columns,
+        chunk_rows=256,
+    ) as builder:
+        for chunk in chunks:
+            builder.add_chunk(chunk)
+
+    catalog = {key: np.concatenate([c[key] for c in chunks]) for key in chunks[0]}
+    labels = _class_rule(catalog)
+    with PopulationModel.from_hdf5(path) as model:
+        assert set(model.classes) == {"star", "white_dwarf", "black_hole"}
+        total = sum(label is not None and label != "" for label in labels)
+        for class_name in model.classes:
+            rows = labels == class_name
+            assert model.class_weight(class_name) == pytest.approx(np.sum(rows) / total)
+            assert np.allclose(
+                model.samples(class_name, ["log10tE", "mass"]),
+                np.column_stack(
+                    [np.log10(catalog["t_E"][rows]), catalog["mass"][rows]]
+                ),
+            )
+
+
+def test_builder_reservoir(tmp_path):
+    """
+    test reservoir subsampling bounds the class size but keeps the class weights
+    """
+    path = tmp_path / "model.h5"
+    with PopulationModelBuilder(
+        path,
+        "test_model",
+        ["mass"],
+        _class_rule,
+        reservoir_size=300,
+    ) as builder:
+        for chunk in _catalog_chunks(10, 1000):
+            builder.add_chunk(chunk)
+        class_weights = builder.close()
+
+    with PopulationModel.from_hdf5(path) as model:
+        assert model.class_weight("black_hole") == class_weights["black_hole"]
+        assert class_weights["black_hole"] > 0.9
+        for class_name in model.classes:
+            assert model.num_samples(class_name) == min(
+                300, builder.class_counts[class_name]
+            )
+        masses = model.samples("black_hole", ["mass"])[:, 0]
+        # A uniform subsample of masses uniform on [1.4, 19].
+        assert np.all((masses >= 1.4) & (masses <= 19))
+        assert abs(np.mean(masses) - 10.2) < 1.0
+        assert len(np.unique(masses)) == 300
+
+
+def test_builder_removes_partial_file(tmp_path):
+    """
+    test a failed ingest removes the partial file instead of finalizing it
+    """
+    path = tmp_path / "model.h5"
+    with pytest.raises(RuntimeError):
+        with PopulationModelBuilder(
+            path, "test_model", ["mass"], _class_rule
+        ) as builder:
+            builder.add_chunk(next(_catalog_chunks(1, 100)))
+            raise RuntimeError("catalog read failed")
+    assert not path.exists()
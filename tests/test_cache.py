@@ -0,0 +1,233 @@
+"""
+Tests for the classification result cache in cache.py
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from popclass.cache import classification_key
+from popclass.cache import ResultCache
+from popclass.cache import update_digest
+from popclass.classify import classify
+from popclass.model import CustomKernelDensity
+from popclass.model import PopulationModel
+from popclass.posterior import Posterior
+from popclass.uq import additiveUQ
+from popclass.uq import NoneClassUQ
+
+
+def _inference_data(loc=1.5, num_samples=2000):
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=loc, scale=0.1, size=num_samples),
+            np.random.normal(loc=-1.0, scale=0.1, size=num_samples),
+        ]
+    ).swapaxes(0, 1)
+    posterior = Posterior(
+        samples=posterior_samples, parameter_labels=["log10tE", "log10piE"]
+    )
+    return posterior.to_inference_data(0.028 * np.ones(num_samples))
+
+
+def _put_entries(directory, start, stop):
+    cache = ResultCache(directory)
+    for i in range(start, stop):
+        cache.put(f"{i:064x}", {"value": i})
+    return stop - start
+
+
+def test_classify_with_cache(tmp_path):
+    """
+    test cached classifications match uncached ones and persist across instances
+    """
+    parameters = ["log10tE", "log10piE"]
+    inference_data = _inference_data()
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    none_class = NoneClassUQ(
+        population_model=popsycle,
+        parameters=parameters,
+        bounds={"log10tE": [-0.5, 4], "log10piE": [-3, 0]},
+        kde=CustomKernelDensity,
+        kde_kwargs={"kernel": "tophat", "bandwidth": 0.4},
+    )
+    cache = ResultCache(tmp_path)
+
+    for additive_uq in [None, none_class]:
+        expected = classify(
+            population_model=popsycle,
+            inference_data=inference_data,
+            parameters=parameters,
+            additive_uq=additive_uq,
+        )
+        for _ in range(2):
+            cached = classify(
+                population_model=popsycle,
+                inference_data=inference_data,
+                parameters=parameters,
+                additive_uq=additive_uq,
+                cache=cache,
+            )
+            assert cached == expected
+    assert len(cache) == 2
+
+    result = classify(
+        population_model=popsycle,
+        inference_data=inference_data,
+        parameters=parameters,
+        additive_uq=none_class,
+        return_result=True,
+        cache=cache,
+    )
+    reloaded = classify(
+        population_model=popsycle,
+        inference_data=inference_data,
+        parameters=parameters,
+        additive_uq=none_class,
+        return_result=True,
+        cache=ResultCache(tmp_path),
+    )
+    assert reloaded.evidence == result.evidence
+    assert reloaded.probabilities() == result.probabilities()
+
+    # Results never share their fields with the in-memory cache.
+    covariance = {name: dict(row) for name, row in result.evidence_covariance.items()}
+    result.evidence["star"] = -1.0
+    result.evidence_covariance["star"]["star"] = -1.0
+    hit = classify(
+        population_model=popsycle,
+        inference_data=inference_data,
+        parameters=parameters,
+        additive_uq=none_class,
+        return_result=True,
+        cache=cache,
+    )
+    assert hit.evidence == reloaded.evidence
+    assert hit.evidence_covariance == covariance
+
+    with pytest.raises(ValueError):
+        classify(
+            population_model=popsycle,
+            inference_data=inference_data,
+            parameters=parameters,
+            additive_uq=additiveUQ(),
+            cache=cache,
+        )
+
+
+def test_classification_key_changes():
+    """
+    test the cache key changes with the inputs that change the classification
+    """
+    parameters = ["log10tE", "log10piE"]
+    inference_data = _inference_data()
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    key = classification_key(inference_data, popsycle, parameters)
+
+    assert classification_key(inference_data, popsycle, parameters) == key
+    assert classification_key(_inference_data(loc=2.0), popsycle, parameters) != key
+    assert classification_key(inference_data, popsycle, parameters[::-1]) != key
+
+    inference_data.prior_density = 0.01 * np.ones(2000)
+    assert classification_key(inference_data, popsycle, parameters) != key
+    inference_data.prior_density = 0.028 * np.ones(2000)
+    assert classification_key(inference_data, popsycle, parameters) == key
+
+    popsycle.set_class_weight("star", 0.5)
+    assert classification_key(inference_data, popsycle, parameters) != key
+
+
+def test_update_digest_hashes_full_arrays():
+    """
+    test arrays that repr identically (truncated by numpy) hash differently
+    """
+    first = np.zeros(5000)
+    second = first.copy()
+    second[2500] = 1.0
+    assert repr(first) == repr(second)
+
+    def hexdigest(value):
+        digest = hashlib.sha256()
+        update_digest(digest, value)
+        return digest.hexdigest()
+
+    assert hexdigest({"weights": first}) != hexdigest({"weights": second})
+    assert hexdigest({"a": 1, "b": [first]}) == hexdigest({"b": [first], "a": 1})
+
+    parameters = ["log10tE", "log10piE"]
+    inference_data = _inference_data()
+    samples = np.random.randn(100, 2)
+    models = [
+        PopulationModel(
+            population_samples={"a": samples},
+            class_weights={"a": 1.0},
+            parameters=parameters,
+            density_estimator=CustomKernelDensity,
+            density_kwargs={"sample_weight": weights},
+        )
+        for weights in [first[:100], second[2450:2550]]
+    ]
+    assert classification_key(
+        inference_data, models[0], parameters
+    ) != classification_key(inference_data, models[1], parameters)
+
+
+def test_result_cache_eviction(tmp_path):
+    """
+    test least recently used entries are evicted once over the size bound
+    """
+    cache = ResultCache(tmp_path, max_bytes=10 * len('{"value": 0}'))
+    for i in range(10):
+        cache.put(f"{i:064x}", {"value": i})
+        os.utime(os.path.join(tmp_path, f"{i:064x}.json"), (i, i))
+    assert len(cache) == 10
+
+    # Reading refreshes an entry, so the oldest unread entry is evicted instead.
+    assert ResultCache(tmp_path).get(f"{0:064x}") == {"value": 0}
+    cache.put(f"{10:064x}", {"value": 10})
+    assert len(cache) <= 10
+    assert cache.get(f"{0:064x}") == {"value": 0}
+    assert ResultCache(tmp_path).get(f"{1:064x}") is None
+
+
+def test_result_cache_concurrent_writers(tmp_path):
+    """
+    test many processes writing to the same cache directory
+    """
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        written = list(
+            executor.map(_put_entries, [tmp_path] * 4, [0, 25, 0, 25], [50, 75, 50, 75])
+        )
+    assert sum(written) == 200
+
+    cache = ResultCache(tmp_path)
+    assert len(cache) == 75
+    for i in range(75):
+        assert cache.get(f"{i:064x}") == {"value": i}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_result_cache_scans_only_when_full(tmp_path, monkeypatch):
+    """
+    test the cache directory is only scanned once the size estimate is exceeded
+    """
+    entry_size = len('{"value": 0}')
+    cache = ResultCache(tmp_path, max_bytes=20 * entry_size)
+    scans = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scans.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    for i in range(20):
+        cache.put(f"{i:064x}", {"value": i % 10})
+    assert len(scans) == 1
+
+    cache.put(f"{20:064x}", {"value": 0})
+    assert len(scans) == 2
+    monkeypatch.undo()
+    assert len(cache) == 18
@@ -1,13 +1,25 @@
 """
 Test to check that classify.py works *as intended*
 """
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+import pytest
+from scipy.stats import gaussian_kde
 
 from popclass.classify import classify
+from popclass.classify import classify_async
+from popclass.classify import classify_batch_async
+from popclass.classify import classify_ensemble
+from popclass.classify import classify_subsets
 from popclass.model import AVAILABLE_MODELS
 from popclass.model import CustomKernelDensity
 from popclass.model import PopulationModel
 from popclass.posterior import Posterior
+from popclass.posterior import Prior
 from popclass.uq import NoneClassUQ
 
 
@@ -229,3 +241,395 @@ def test_classify_no_support_with_uq():
 
     assert abs(1.0 - classification["None"]) < 0.01
     assert classification["star"] < 0.01
+
+
+def test_classify_ensemble():
+    """
+    test ensemble classification matches per-model classify and averages
+    """
+    NUM_POSTERIOR_SAMPLES = 2000
+
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=1.5, scale=0.1, size=NUM_POSTERIOR_SAMPLES),
+            np.random.normal(loc=-1.0, scale=0.1, size=NUM_POSTERIOR_SAMPLES),
+        ]
+    ).swapaxes(0, 1)
+    parameters = ["log10tE", "log10piE"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+    inference_data = posterior.to_inference_data(0.028 * np.ones(NUM_POSTERIOR_SAMPLES))
+    models = [PopulationModel.from_library(name) for name in AVAILABLE_MODELS]
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ensemble = classify_ensemble(
+            inference_data=inference_data,
+            population_models=models,
+            parameters=parameters,
+            model_weights=[2, 1, 1],
+            executor=executor,
+        )
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        from_processes = classify_ensemble(
+            inference_data=inference_data,
+            population_models=models,
+            parameters=parameters,
+            model_weights=[2, 1, 1],
+            executor=executor,
+        )
+    assert from_processes == ensemble
+
+    for model, model_prob in zip(models, ensemble["models"]):
+        single = classify(
+            population_model=model, inference_data=inference_data, parameters=parameters
+        )
+        for class_name in model.classes:
+            assert abs(single[class_name] - model_prob[class_name]) < 1e-10
+
+    weights = np.array([0.5, 0.25, 0.25])
+    for class_name, value in ensemble["average"].items():
+        expected = sum(
+            w * probs[class_name] for w, probs in zip(weights, ensemble["models"])
+        )
+        assert abs(value - expected) < 1e-12
+    assert abs(sum(ensemble["average"].values()) - 1.0) < 1e-10
+
+
+def test_classify_subsets():
+    """
+    test multi-subset classification matches separate classify calls
+    """
+    NUM_POSTERIOR_SAMPLES = 2000
+
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=1.5, scale=0.1, size=NUM_POSTERIOR_SAMPLES),
+            np.random.normal(loc=-1.0, scale=0.1, size=NUM_POSTERIOR_SAMPLES),
+            np.random.uniform(low=0.2, high=0.8, size=NUM_POSTERIOR_SAMPLES),
+        ]
+    ).swapaxes(0, 1)
+    labels = ["log10tE", "log10piE", "f_blend_I"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=labels)
+    inference_data = posterior.to_inference_data(0.028 * np.ones(NUM_POSTERIOR_SAMPLES))
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    subsets = [["log10tE", "log10piE"], ["log10piE", "log10tE", "f_blend_I"]]
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = classify_subsets(
+            inference_data=inference_data,
+            population_model=popsycle,
+            parameter_subsets=subsets,
+            executor=executor,
+        )
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        from_processes = classify_subsets(
+            inference_data=inference_data,
+            population_model=popsycle,
+            parameter_subsets=subsets,
+            executor=executor,
+        )
+    assert from_processes == results
+
+    assert list(results.keys()) == [tuple(subset) for subset in subsets]
+    for subset in subsets:
+        single = classify(
+            population_model=popsycle, inference_data=inference_data, parameters=subset
+        )
+        for class_name in popsycle.classes:
+            assert abs(single[class_name] - results[tuple(subset)][class_name]) < 1e-10
+
+
+def test_BH_example_mixture_model():
+    """
+    test high probability black hole with a Gaussian mixture compressed model
+    """
+    NUM_POSTERIOR_SAMPLES = 10000
+
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=2.2, scale=0.00001, size=NUM_POSTERIOR_SAMPLES),
+            np.random.normal(loc=-1.8, scale=0.00001, size=NUM_POSTERIOR_SAMPLES),
+        ]
+    ).swapaxes(0, 1)
+    parameters = ["log10tE", "log10piE"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+    inference_data = posterior.to_inference_data(0.028 * np.ones(NUM_POSTERIOR_SAMPLES))
+    popsycle = PopulationModel.from_library(
+        "popsycle_singles_sukhboldn20"
+    ).to_mixture_model(n_components=10)
+
+    classification = classify(
+        population_model=popsycle, inference_data=inference_data, parameters=parameters
+    )
+
+    assert classification["black_hole"] > 0.9
+
+
+def test_classify_with_callable_prior():
+    """
+    test classification with a lazily evaluated prior matches the precomputed array
+    """
+    NUM_POSTERIOR_SAMPLES = 2000
+
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=1.5, scale=0.1, size=NUM_POSTERIOR_SAMPLES),
+            np.random.normal(loc=-1.0, scale=0.1, size=NUM_POSTERIOR_SAMPLES),
+        ]
+    ).swapaxes(0, 1)
+    parameters = ["log10tE", "log10piE"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+    prior = Prior(lambda tE: 0.5 + 0.1 * tE[:, 0], ["log10tE"])
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+
+    lazy = classify(
+        population_model=popsycle,
+        inference_data=posterior.to_inference_data(prior),
+        parameters=parameters,
+    )
+    precomputed = classify(
+        population_model=popsycle,
+        inference_data=posterior.to_inference_data(0.5 + 0.1 * posterior_samples[:, 0]),
+        parameters=parameters,
+    )
+    for class_name in popsycle.classes:
+        assert abs(lazy[class_name] - precomputed[class_name]) < 1e-10
+
+
+def test_classification_result_reweighting():
+    """
+    test a ClassificationResult reproduces classify and re-weights without
+    re-evaluating the class densities
+    """
+    NUM_POSTERIOR_SAMPLES = 2000
+
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=1.5, scale=0.1, size=NUM_POSTERIOR_SAMPLES),
+            np.random.normal(loc=-1.0, scale=0.1, size=NUM_POSTERIOR_SAMPLES),
+        ]
+    ).swapaxes(0, 1)
+    parameters = ["log10tE", "log10piE"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+    inference_data = posterior.to_inference_data(0.028 * np.ones(NUM_POSTERIOR_SAMPLES))
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    none_class = NoneClassUQ(
+        population_model=popsycle,
+        parameters=parameters,
+        bounds={"log10tE": [-0.5, 4], "log10piE": [-3, 0]},
+        kde=CustomKernelDensity,
+        kde_kwargs={"kernel": "tophat", "bandwidth": 0.4},
+    )
+
+    for additive_uq in [None, none_class]:
+        expected = classify(
+            population_model=popsycle,
+            inference_data=inference_data,
+            parameters=parameters,
+            additive_uq=additive_uq,
+        )
+        result = classify(
+            population_model=popsycle,
+            inference_data=inference_data,
+            parameters=parameters,
+            additive_uq=additive_uq,
+            return_result=True,
+        )
+        probabilities = result.probabilities()
+        assert set(probabilities.keys()) == set(expected.keys())
+        for class_name, value in expected.items():
+            assert abs(probabilities[class_name] - value) < 1e-10
+        errors = result.probability_errors()
+        assert all(error >= 0 for error in errors.values())
+
+    # The errors account for the class integrals sharing the posterior samples:
+    # to first order they are the scatter of the linearized per-sample ratio.
+    plain = classify(
+        population_model=popsycle,
+        inference_data=inference_data,
+        parameters=parameters,
+        return_result=True,
+    )
+    probabilities = plain.probabilities()
+    errors = plain.probability_errors()
+    weighted = np.vstack(
+        [
+            popsycle.evaluate_density(class_name, parameters, posterior_samples)
+            * popsycle.class_weight(class_name)
+            / 0.028
+            for class_name in popsycle.classes
+        ]
+    )
+    total = weighted.sum(axis=0)
+    for class_name, row in zip(popsycle.classes, weighted):
+        linearized = (row - probabilities[class_name] * total) / np.mean(total)
+        expected_error = np.std(linearized) / np.sqrt(NUM_POSTERIOR_SAMPLES)
+        assert abs(errors[class_name] - expected_error) < 1e-8 * (1 + expected_error)
+
+    new_weights = {"star": 0.1, "white_dwarf": 0.2, "neutron_star": 0.3}
+    for class_name, weight in new_weights.items():
+        popsycle.set_class_weight(class_name, weight)
+    expected = classify(
+        population_model=popsycle, inference_data=inference_data, parameters=parameters
+    )
+    reweighted = result.probabilities(class_weights=new_weights, none_class_weight=0)
+    for class_name, value in expected.items():
+        assert abs(reweighted[class_name] - value) < 1e-10
+    assert reweighted["None"] == 0
+
+    subset = result.probabilities(classes=["star", "black_hole"])
+    assert set(subset.keys()) == {"star", "black_hole"}
+    assert abs(sum(subset.values()) - 1.0) < 1e-10
+
+
+class _CountingKDE(gaussian_kde):
+    """Gaussian KDE recording the number of points of every evaluation."""
+
+    evaluations = []
+
+    def evaluate(self, points):
+        type(self).evaluations.append(points.shape[1])
+        return super().evaluate(points)
+
+
+class _GatedKernel:
+    """Kernel recording its evaluations, each blocking until the gate opens."""
+
+    evaluations = []
+    started = threading.Event()
+    gate = threading.Event()
+
+    def __init__(self, data):
+        self.data = data
+
+    def evaluate(self, pts):
+        type(self).evaluations.append(pts.shape[1])
+        self.started.set()
+        self.gate.wait(timeout=10)
+        return np.ones(pts.shape[1])
+
+
+def _async_events(parameters, locs):
+    events = []
+    for loc in locs:
+        posterior_samples = np.vstack(
+            [
+                np.random.normal(loc=loc, scale=0.1, size=1000),
+                np.random.normal(loc=-1.0, scale=0.1, size=1000),
+            ]
+        ).swapaxes(0, 1)
+        posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+        events.append(posterior.to_inference_data(0.028 * np.ones(1000)))
+    return events
+
+
+def _gated_model(parameters):
+    return PopulationModel(
+        population_samples={"a": np.random.randn(10, 2)},
+        class_weights={"a": 1.0},
+        parameters=parameters,
+        density_estimator=_GatedKernel,
+    )
+
+
+def test_classify_async():
+    """
+    test async classification matches classify and coalesces concurrent requests
+    into one density evaluation per class
+    """
+    parameters = ["log10tE", "log10piE"]
+    events = _async_events(parameters, [1.0, 1.5, 2.0])
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    counting = PopulationModel(
+        population_samples={
+            class_name: popsycle.samples(class_name, popsycle.parameters)
+            for class_name in popsycle.classes
+        },
+        class_weights={
+            class_name: popsycle.class_weight(class_name)
+            for class_name in popsycle.classes
+        },
+        parameters=popsycle.parameters,
+        density_estimator=_CountingKDE,
+    )
+    none_class = NoneClassUQ(
+        population_model=counting, parameters=parameters, grid_size=30
+    )
+    expected = [
+        classify(data, counting, parameters, additive_uq=none_class) for data in events
+    ]
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return await classify_batch_async(
+                events, counting, parameters, additive_uq=none_class, executor=executor
+            )
+
+    _CountingKDE.evaluations.clear()
+    results = asyncio.run(run())
+    assert _CountingKDE.evaluations == [3000] * len(counting.classes)
+    for result, single in zip(results, expected):
+        for class_name, value in single.items():
+            assert abs(result[class_name] - value) < 1e-12
+
+
+def test_classify_async_timeout():
+    """
+    test async classification raises at its deadline and later calls still succeed
+    """
+    parameters = ["log10tE", "log10piE"]
+    events = _async_events(parameters, [1.0, 1.5])
+    gated = _gated_model(parameters)
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            _GatedKernel.gate.clear()
+            try:
+                with pytest.raises(asyncio.TimeoutError):
+                    await classify_async(
+                        events[0], gated, parameters, executor=executor, timeout=0.05
+                    )
+            finally:
+                _GatedKernel.gate.set()
+            return await classify_async(
+                events[1], gated, parameters, executor=executor, timeout=5
+            )
+
+    assert asyncio.run(run()) == {"a": 1.0}
+
+
+def test_classify_async_cancellation():
+    """
+    test cancelling an async classification drops its samples from the batch
+    and fails only the cancelled call
+    """
+    parameters = ["log10tE", "log10piE"]
+    events = _async_events(parameters, [1.0, 1.5, 2.0])
+    gated = _gated_model(parameters)
+
+    async def run():
+        cancelled = asyncio.ensure_future(classify_async(events[0], gated, parameters))
+        kept = asyncio.ensure_future(classify_async(events[1], gated, parameters))
+        # Both calls are queued, and the batch is flushed after this resumes.
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert await kept == {"a": 1.0}
+
+        # Cancelling a call whose batch is running resolves the others in it.
+        _GatedKernel.gate.clear()
+        _GatedKernel.started.clear()
+        running = asyncio.ensure_future(classify_async(events[1], gated, parameters))
+        other = asyncio.ensure_future(classify_async(events[2], gated, parameters))
+        loop = asyncio.get_running_loop()
+        assert await loop.run_in_executor(None, _GatedKernel.started.wait, 10)
+        running.cancel()
+        _GatedKernel.gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        assert await other == {"a": 1.0}
+
+    _GatedKernel.gate.set()
+    _GatedKernel.evaluations.clear()
+    asyncio.run(run())
+    assert _GatedKernel.evaluations == [1000, 2000]
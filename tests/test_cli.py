@@ -0,0 +1,142 @@
+"""
+Tests for the popclass console command in cli.py
+"""
+import json
+
+import numpy as np
+import pytest
+
+from popclass.classify import classify
+from popclass.cli import main
+from popclass.cli import read_checkpoint
+from popclass.model import PopulationModel
+from popclass.posterior import Posterior
+
+PARAMETERS = ["log10tE", "log10piE"]
+
+
+def _write_events(directory, num_events, num_samples=500):
+    inference_data = {}
+    for i in range(num_events):
+        samples = np.vstack(
+            [
+                np.random.normal(loc=1.0 + 0.1 * i, scale=0.1, size=num_samples),
+                np.random.normal(loc=-1.0, scale=0.1, size=num_samples),
+            ]
+        ).swapaxes(0, 1)
+        posterior = Posterior(samples=samples, parameter_labels=PARAMETERS)
+        inference_data[f"event_{i}.asdf"] = posterior.to_inference_data(
+            0.028 * np.ones(num_samples)
+        )
+        inference_data[f"event_{i}.asdf"].to_asdf(directory / f"event_{i}.asdf")
+    return inference_data
+
+
+def _read_output(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_cli_directory_with_workers(tmp_path):
+    """
+    test the console command classifies a directory with worker processes
+    """
+    events = tmp_path / "events"
+    events.mkdir()
+    inference_data = _write_events(events, 5)
+    output = tmp_path / "out.jsonl"
+
+    status = main(
+        [
+            str(events),
+            "--model",
+            "popsycle_singles_sukhboldn20",
+            "--parameters",
+            *PARAMETERS,
+            "--output",
+            str(output),
+            "--workers",
+            "2",
+        ]
+    )
+
+    assert status == 0
+    records = {record["event"]: record for record in _read_output(output)}
+    assert set(records) == set(inference_data)
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    for name, data in inference_data.items():
+        expected = classify(data, popsycle, PARAMETERS)
+        for class_name, value in expected.items():
+            assert abs(records[name]["probabilities"][class_name] - value) < 1e-10
+
+
+def test_cli_manifest_resume(tmp_path):
+    """
+    test an interrupted run over a manifest resumes without redoing events
+    """
+    _write_events(tmp_path, 4)
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(
+        "# events\n" + "".join(f"event_{i}.asdf\n" for i in range(4)) + "missing.asdf\n"
+    )
+    output = tmp_path / "out.jsonl"
+    # A finished event and a partially written line from an interrupted run.
+    output.write_text(
+        json.dumps({"event": "event_0.asdf", "probabilities": {"star": 1.0}})
+        + '\n{"event": "event_1.as'
+    )
+    assert read_checkpoint(str(output)) == {"event_0.asdf"}
+
+    argv = [
+        str(manifest),
+        "--model",
+        "popsycle_singles_sukhboldn20",
+        "--parameters",
+        *PARAMETERS,
+        "--output",
+        str(output),
+        "--workers",
+        "1",
+    ]
+    assert main(argv) == 1
+
+    records = _read_output(output)
+    assert [record["event"] for record in records] == [
+        "event_0.asdf",
+        "event_1.asdf",
+        "event_2.asdf",
+        "event_3.asdf",
+        "missing.asdf",
+    ]
+    assert records[0]["probabilities"] == {"star": 1.0}
+    assert "error" in records[-1]
+
+    # Failed events are retried, and the status reflects the final state.
+    assert main(argv) == 1
+    assert [record["event"] for record in _read_output(output)][5:] == ["missing.asdf"]
+    (tmp_path / "event_0.asdf").rename(tmp_path / "missing.asdf")
+    assert main(argv) == 0
+    records = _read_output(output)
+    assert len(records) == 7
+    assert "probabilities" in records[-1]
+    assert main(argv) == 0
+    assert len(_read_output(output)) == 7
+
+
+def test_read_checkpoint_skips_records_without_event(tmp_path):
+    """
+    test malformed and failed records do not count as finished events
+    """
+    output = tmp_path / "out.jsonl"
+    output.write_text(
+        json.dumps({"probabilities": {"star": 1.0}})
+        + "\n"
+        + json.dumps(["event_0.asdf"])
+        + "\n"
+        + json.dumps({"event": "event_1.asdf", "error": "ValueError: bad"})
+        + "\n"
+        + json.dumps({"event": "event_2.asdf", "probabilities": {"star": 1.0}})
+        + "\n"
+    )
+    with pytest.warns(UserWarning, match="Skipped 2 records"):
+        assert read_checkpoint(str(output)) == {"event_2.asdf"}
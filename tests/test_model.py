@@ -3,6 +3,11 @@ Tests to make sure model.py works
 """
 import fnmatch
 import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
 
 import asdf
 import numpy as np
@@ -12,10 +17,15 @@ from scipy.stats import multivariate_normal
 from scipy.stats import norm
 
 from popclass.model import AVAILABLE_MODELS
+from popclass.model import BlockedGaussianKDE
 from popclass.model import CustomKernelDensity
+from popclass.model import GaussianMixtureDensity
+from popclass.model import HDF5PopulationModel
+from popclass.model import MixturePopulationModel
 from popclass.model import MultivariateGaussianKernel
 from popclass.model import PopulationModel
 from popclass.model import validate_asdf_population_model
+from popclass.model import validate_asdf_population_model_file
 from popclass.posterior import Posterior
 
 
@@ -241,6 +251,82 @@ def test_evaluate_transpose():
             ) == model2.evaluate_density(key, parameter, np.array([[2]]))
 
 
+def test_density_estimator_cached():
+    """Test the per-class density estimator is fit once and reused."""
+    population_samples = {
+        key: norm.rvs(size=200, loc=0, scale=1).reshape((100, 2)) for key in ["A", "B"]
+    }
+    model = PopulationModel(
+        population_samples=population_samples,
+        class_weights={"A": 0.5, "B": 0.5},
+        parameters=["p1", "p2"],
+    )
+    estimator = model.density_estimator("A", ["p1", "p2"])
+    assert model.density_estimator("A", ["p1", "p2"]) is estimator
+    assert model.density_estimator("A", ["p2", "p1"]) is not estimator
+    assert model.density_estimator("B", ["p1", "p2"]) is not estimator
+
+    points = np.array([[0.1, -0.2], [1.0, 0.5]])
+    direct = gaussian_kde(population_samples["A"].T).evaluate(points.T)
+    assert np.allclose(model.evaluate_density("A", ["p1", "p2"], points), direct)
+
+
+class _GatedKernel(MultivariateGaussianKernel):
+    """Kernel counting its fits, each blocking until the gate opens."""
+
+    fits = 0
+    gate = threading.Event()
+
+    def __init__(self, data):
+        type(self).fits += 1
+        self.gate.wait(timeout=10)
+        super().__init__(data)
+
+
+def test_density_estimator_fit_once_across_threads():
+    """Test concurrent threads fit a shared density estimator once."""
+    model = PopulationModel(
+        population_samples={"A": norm.rvs(size=200, loc=0, scale=1).reshape((100, 2))},
+        class_weights={"A": 1.0},
+        parameters=["p1", "p2"],
+        density_estimator=_GatedKernel,
+    )
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(model.density_estimator, "A", ["p1", "p2"])
+            for _ in range(8)
+        ]
+        _GatedKernel.gate.set()
+        estimators = [future.result() for future in futures]
+    assert _GatedKernel.fits == 1
+    assert all(estimator is estimators[0] for estimator in estimators)
+
+    restored = pickle.loads(pickle.dumps(model))
+    assert restored.density_estimator("A", ["p1", "p2"]).n == 100
+
+
+def test_fingerprint():
+    """Test model and class fingerprints track content."""
+    population_samples = {
+        key: norm.rvs(size=200, loc=0, scale=1).reshape((100, 2)) for key in ["A", "B"]
+    }
+    kwargs = dict(class_weights={"A": 0.5, "B": 0.5}, parameters=["p1", "p2"])
+    model = PopulationModel(population_samples=population_samples, **kwargs)
+    same = PopulationModel(
+        population_samples={k: v.copy() for k, v in population_samples.items()},
+        **kwargs,
+    )
+    assert model.fingerprint == same.fingerprint
+    assert model.class_fingerprint("A") != model.class_fingerprint("B")
+
+    other_estimator = PopulationModel(
+        population_samples=population_samples,
+        density_estimator=MultivariateGaussianKernel,
+        **kwargs,
+    )
+    assert other_estimator.class_fingerprint("A") != model.class_fingerprint("A")
+
+
 def test_MultivariateGaussianKernel():
     mean = [0, 1]
     cov = [[1, 0.1], [0.1, 1]]
@@ -250,3 +336,493 @@ def test_MultivariateGaussianKernel():
     assert round(custom_kernel.evaluate(vals), 3) == round(
         multivariate_normal.pdf(vals, mean=mean, cov=cov), 3
     )
+
+
+def test_CustomKernelDensity_fit_once():
+    """Test the sklearn tree is built once, honours tree options and survives pickling."""
+    data = norm.rvs(size=2000, loc=0, scale=1).reshape((2, 1000))
+    pts = norm.rvs(size=20, loc=0, scale=1).reshape((2, 10))
+
+    exact = CustomKernelDensity(data, kernel="gaussian", bandwidth=0.3)
+    tree = exact.kernel.tree_
+    first = exact.evaluate(pts)
+    assert exact.kernel.tree_ is tree
+    assert np.array_equal(exact.evaluate(pts), first)
+    assert np.allclose(exact.data, data)
+
+    approximate = CustomKernelDensity(
+        data,
+        kernel="gaussian",
+        bandwidth=0.3,
+        algorithm="kd_tree",
+        leaf_size=80,
+        rtol=1e-4,
+    )
+    assert np.allclose(approximate.evaluate(pts), first, rtol=1e-3)
+
+    restored = pickle.loads(pickle.dumps(exact))
+    assert np.array_equal(restored.evaluate(pts), first)
+
+
+def test_GaussianMixtureDensity():
+    """Test the mixture density against scipy for one and two components."""
+    mean = [0, 1]
+    cov = [[1, 0.3], [0.3, 2]]
+    pts = np.array([[0.0, 1.0], [2.0, -1.0], [-1.0, 3.0]]).T
+
+    single = GaussianMixtureDensity.from_components([1.0], [mean], [cov])
+    assert np.allclose(
+        single.evaluate(pts), multivariate_normal.pdf(pts.T, mean=mean, cov=cov)
+    )
+    assert np.allclose(
+        single.marginal([1]).evaluate(pts[[1]]), norm.pdf(pts[1], loc=1, scale=2**0.5)
+    )
+
+    np.random.seed(seed=3)
+    data = np.vstack(
+        [
+            multivariate_normal.rvs(size=2000, mean=[-3, 0], cov=np.eye(2)),
+            multivariate_normal.rvs(size=2000, mean=[3, 0], cov=np.eye(2)),
+        ]
+    )
+    fitted = GaussianMixtureDensity(data.T, n_components=2)
+    pts = np.array([[-3.0, 0.0], [3.0, 0.5], [2.5, -0.5]]).T
+    truth = 0.5 * multivariate_normal.pdf(
+        pts.T, mean=[-3, 0], cov=np.eye(2)
+    ) + 0.5 * multivariate_normal.pdf(pts.T, mean=[3, 0], cov=np.eye(2))
+    assert np.allclose(fitted.evaluate(pts), truth, rtol=0.1)
+
+
+def test_mixture_model_round_trip(tmp_path):
+    """Test converting a library model to a mixture model and saving/loading it."""
+    model = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    mixture_model = model.to_mixture_model(n_components=10)
+    assert mixture_model.classes == model.classes
+    assert mixture_model.parameters == model.parameters
+
+    parameters = ["log10tE", "log10piE"]
+    pts = np.array([[2.2, -1.8], [0.7, -0.65]])
+    assert mixture_model.samples("star", parameters).shape == (
+        len(model.samples("star", parameters)),
+        2,
+    )
+
+    path = str(tmp_path / "mixture.asdf")
+    mixture_model.to_asdf(path, "mixture")
+    loaded = MixturePopulationModel.from_asdf(path)
+    assert os.path.getsize(path) < 50000
+    for class_name in model.classes:
+        assert np.allclose(
+            loaded.evaluate_density(class_name, parameters, pts),
+            mixture_model.evaluate_density(class_name, parameters, pts),
+        )
+        assert np.all(mixture_model.evaluate_density(class_name, parameters, pts) >= 0)
+    assert loaded.fingerprint == mixture_model.fingerprint
+
+
+def test_mixture_model_fit_settings_round_trip(tmp_path):
+    """Test mixture fit settings survive saving, so refits after loading match."""
+    samples = {
+        "A": norm.rvs(size=(400, 2), random_state=1),
+        "B": norm.rvs(loc=3, size=(400, 2), random_state=2),
+    }
+    model = PopulationModel(
+        population_samples=samples,
+        class_weights={"A": 0.5, "B": 0.5},
+        parameters=["p1", "p2"],
+    )
+    mixture_model = model.to_mixture_model(n_components=3, random_state=5, tol=1e-4)
+
+    path = str(tmp_path / "mixture.asdf")
+    mixture_model.to_asdf(path, "mixture")
+    loaded = MixturePopulationModel.from_asdf(path)
+    assert loaded.n_components == 3
+    assert loaded.mixture_kwargs == {"random_state": 5, "tol": 1e-4}
+
+    extra = norm.rvs(loc=1, size=(100, 2), random_state=3)
+    pts = np.array([[0.0, 0.0], [1.0, 1.0], [3.0, 3.0]])
+    for updated in [mixture_model, loaded]:
+        updated.add_samples("A", extra)
+        updated.add_class("C", extra, 0.2)
+    for class_name in ["A", "C"]:
+        assert len(loaded.density_estimator(class_name, ["p1", "p2"]).weights) == 3
+        assert np.allclose(
+            loaded.evaluate_density(class_name, ["p1", "p2"], pts),
+            mixture_model.evaluate_density(class_name, ["p1", "p2"], pts),
+        )
+
+
+def _evaluate_all_classes(model):
+    pts = np.array([[2.2, -1.8], [0.7, -0.65]])
+    return [
+        model.evaluate_density(class_name, ["log10tE", "log10piE"], pts)
+        for class_name in model.classes
+    ]
+
+
+def test_shared_memory_model():
+    """Test a shared memory model pickles as handles, works in workers and is unlinked on close."""
+    model = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    expected = _evaluate_all_classes(model)
+
+    with model.to_shared_memory(
+        estimator_parameters=[["log10tE", "log10piE"]]
+    ) as shared:
+        assert shared.classes == model.classes
+        assert len(pickle.dumps(shared)) < 10000
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            for result in executor.map(_evaluate_all_classes, [shared] * 2):
+                for value, truth in zip(result, expected):
+                    assert np.allclose(value, truth)
+        segment_name = shared._handles[("samples", "star")][0]
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=segment_name)
+
+
+def test_incremental_updates():
+    """Test adding samples and classes and changing weights only invalidates the affected class."""
+    np.random.seed(seed=4)
+    parameters = ["p1", "p2"]
+    first = {key: norm.rvs(size=400).reshape((200, 2)) for key in ["A", "B"]}
+    extra = norm.rvs(loc=1, size=100).reshape((50, 2))
+    class_weights = {"A": 0.5, "B": 0.5}
+    model = PopulationModel(
+        population_samples=first,
+        class_weights=class_weights,
+        parameters=parameters,
+    )
+    mixture_model = model.to_mixture_model(n_components=2)
+    pts = np.array([[0.0, 0.0], [1.0, 0.5]])
+
+    estimator_b = model.density_estimator("B", parameters)
+    fingerprint_b = model.class_fingerprint("B")
+    fingerprint_a = model.class_fingerprint("A")
+    model.density_estimator("A", parameters)
+
+    model.add_samples("A", extra)
+    fresh = PopulationModel(
+        population_samples={"A": np.vstack([first["A"], extra]), "B": first["B"]},
+        class_weights={"A": 0.5, "B": 0.5},
+        parameters=parameters,
+    )
+    assert np.allclose(
+        model.evaluate_density("A", parameters, pts),
+        fresh.evaluate_density("A", parameters, pts),
+    )
+    assert model.density_estimator("B", parameters) is estimator_b
+    assert model.class_fingerprint("B") == fingerprint_b
+    assert model.class_fingerprint("A") != fingerprint_a
+
+    model.add_class("C", extra, 0.2)
+    assert model.classes == ["A", "B", "C"]
+    model.set_class_weight("C", 0.1)
+    assert model.class_weight("C") == 0.1
+    with pytest.raises(ValueError):
+        model.add_class("C", extra, 0.2)
+    with pytest.raises(ValueError):
+        model.add_samples("A", np.ones((3, 3)))
+
+    # Updates do not leak into the caller's dictionaries or derived models.
+    assert class_weights == {"A": 0.5, "B": 0.5}
+    assert list(first) == ["A", "B"] and len(first["A"]) == 200
+    assert mixture_model.classes == ["A", "B"]
+    mixture_model.set_class_weight("A", 0.9)
+    assert model.class_weight("A") == 0.5
+
+
+def test_MultivariateGaussianKernel_update():
+    """Test the Gaussian kernel updates exactly with new samples."""
+    data = norm.rvs(size=600).reshape((3, 200))
+    updated = MultivariateGaussianKernel(data[:, :120])
+    updated.update(data[:, 120:])
+    full = MultivariateGaussianKernel(data)
+    assert np.allclose(updated.mean, full.mean)
+    assert np.allclose(updated.cov, full.cov)
+
+    model = PopulationModel(
+        population_samples={"A": data[:, :120].T},
+        class_weights={"A": 1.0},
+        parameters=["p1", "p2", "p3"],
+        density_estimator=MultivariateGaussianKernel,
+    )
+    estimator = model.density_estimator("A", ["p3", "p1"])
+    model.add_samples("A", data[:, 120:].T)
+    assert model.density_estimator("A", ["p3", "p1"]) is estimator
+    assert np.allclose(estimator.cov, np.cov(data[[2, 0]]))
+
+
+def test_BlockedGaussianKDE_bandwidth():
+    """Test the blocked KDE matches gaussian_kde for every kind of bw_method."""
+    data = norm.rvs(size=(2, 1000))
+    pts = norm.rvs(size=(2, 20))
+
+    def blocks():
+        return (data[:, start : start + 300] for start in range(0, 1000, 300))
+
+    for bw_method in ["scott", "silverman", 0.3, lambda kde: 0.5 * kde.scotts_factor()]:
+        blocked = BlockedGaussianKDE(blocks, bw_method=bw_method)
+        direct = gaussian_kde(data, bw_method=bw_method)
+        assert blocked.factor == pytest.approx(direct.factor)
+        assert np.allclose(blocked.evaluate(pts), direct.evaluate(pts), rtol=1e-10)
+
+
+def test_hdf5_model_round_trip(tmp_path):
+    """
+    test an HDF5 backed model matches the in-memory model, in memory and streamed
+    """
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    path = tmp_path / "popsycle.h5"
+    popsycle.to_hdf5(path, "popsycle_singles_sukhboldn20", chunk_rows=500)
+    parameters = ["log10piE", "log10tE"]
+    points = np.random.uniform(low=[-2, 0.5], high=[0, 2.5], size=(50, 2))
+
+    with PopulationModel.from_hdf5(path) as in_memory, PopulationModel.from_hdf5(
+        path, max_memory_rows=0, block_rows=700
+    ) as streamed:
+        assert isinstance(streamed, HDF5PopulationModel)
+        assert streamed.classes == popsycle.classes
+        assert streamed.parameters == popsycle.parameters
+        for class_name in popsycle.classes:
+            assert streamed.class_weight(class_name) == popsycle.class_weight(
+                class_name
+            )
+            assert np.array_equal(
+                streamed.samples(class_name, parameters),
+                popsycle.samples(class_name, parameters),
+            )
+            assert streamed.class_fingerprint(class_name) != ""
+            expected = popsycle.evaluate_density(class_name, parameters, points)
+            assert np.allclose(
+                in_memory.evaluate_density(class_name, parameters, points), expected
+            )
+            assert np.allclose(
+                streamed.evaluate_density(class_name, parameters, points),
+                expected,
+                rtol=1e-10,
+            )
+        assert isinstance(
+            streamed.density_estimator("star", parameters), BlockedGaussianKDE
+        )
+
+        restored = pickle.loads(pickle.dumps(streamed))
+        assert restored.max_memory_rows == 0
+        assert np.allclose(
+            restored.evaluate_density("star", parameters, points),
+            streamed.evaluate_density("star", parameters, points),
+        )
+        restored.close()
+
+    with PopulationModel.from_hdf5(
+        path, density_estimator=CustomKernelDensity, max_memory_rows=0
+    ) as streamed:
+        with pytest.raises(ValueError):
+            streamed.density_estimator("star", parameters)
+
+
+def test_updates_of_derived_models(tmp_path):
+    """
+    test adding classes and samples to HDF5, shared memory and mixture models
+    """
+    np.random.seed(seed=5)
+    parameters = ["p1", "p2"]
+    first = {key: norm.rvs(size=1200).reshape((600, 2)) for key in ["A", "B"]}
+    extra = norm.rvs(loc=1, size=400).reshape((200, 2))
+    model = PopulationModel(
+        population_samples=first,
+        class_weights={"A": 0.5, "B": 0.5},
+        parameters=parameters,
+    )
+    pts = np.array([[0.0, 0.0], [1.0, 0.5]])
+    updated = PopulationModel(
+        population_samples={"A": np.vstack([first["A"], extra]), "B": first["B"]},
+        class_weights={"A": 0.5, "B": 0.5},
+        parameters=parameters,
+    )
+    updated.add_class("C", extra, 0.2)
+
+    path = tmp_path / "model.h5"
+    model.to_hdf5(path, "model")
+    with PopulationModel.from_hdf5(path) as hdf5_model:
+        hdf5_model.density_estimator("B", parameters)
+        fingerprint_b = hdf5_model.class_fingerprint("B")
+        hdf5_model.add_samples("A", extra)
+        hdf5_model.add_class("C", extra, 0.2)
+        assert hdf5_model.class_fingerprint("B") == fingerprint_b
+        with pytest.raises(ValueError):
+            hdf5_model.add_class("C", extra, 0.2)
+    with PopulationModel.from_hdf5(path) as hdf5_model:
+        assert hdf5_model.classes == ["A", "B", "C"]
+        assert hdf5_model.class_weight("C") == 0.2
+        for class_name in updated.classes:
+            assert np.allclose(
+                hdf5_model.evaluate_density(class_name, parameters, pts),
+                updated.evaluate_density(class_name, parameters, pts),
+            )
+
+    with model.to_shared_memory(estimator_parameters=[parameters]) as shared:
+        shared.add_samples("A", extra)
+        shared.add_class("C", extra, 0.2)
+        restored = pickle.loads(pickle.dumps(shared))
+        for class_name in updated.classes:
+            assert np.allclose(
+                restored.evaluate_density(class_name, parameters, pts),
+                updated.evaluate_density(class_name, parameters, pts),
+            )
+        with pytest.raises(ValueError):
+            restored.add_samples("A", extra)
+        restored.close()
+
+    mixture_model = model.to_mixture_model(n_components=2)
+    mixture_a = mixture_model.density_estimator("A", parameters)
+    mixture_b = mixture_model.density_estimator("B", parameters)
+    mixture_model.add_samples("A", extra)
+    mixture_model.add_class("C", extra, 0.2)
+    assert mixture_model.classes == ["A", "B", "C"]
+    assert mixture_model.density_estimator("B", parameters) is mixture_b
+    assert mixture_model.density_estimator("A", parameters) is not mixture_a
+    assert mixture_model.samples("A", parameters).shape == (800, 2)
+    reference = updated.to_mixture_model(n_components=2)
+    for class_name in ["A", "C"]:
+        assert np.allclose(
+            mixture_model.evaluate_density(class_name, parameters, pts),
+            reference.evaluate_density(class_name, parameters, pts),
+            rtol=0.3,
+        )
+
+
+def test_class_statistics(tmp_path):
+    """
+    test class statistics match the samples, persist in asdf and follow updates
+    """
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    parameters = ["log10piE", "log10tE"]
+    samples = popsycle.samples("star", parameters)
+
+    statistics = popsycle.class_statistics("star", parameters)
+    assert statistics["count"] == len(samples)
+    assert np.array_equal(statistics["min"], np.min(samples, axis=0))
+    assert np.array_equal(statistics["max"], np.max(samples, axis=0))
+    assert np.allclose(statistics["mean"], np.mean(samples, axis=0))
+    assert np.allclose(statistics["covariance"], np.cov(samples.T))
+    assert np.allclose(
+        statistics["quantiles"],
+        np.quantile(samples, statistics["quantile_levels"], axis=0),
+    )
+
+    path = tmp_path / "model.asdf"
+    popsycle.to_asdf(path, "popsycle_singles_sukhboldn20")
+    loaded = PopulationModel.from_asdf(path)
+    assert set(loaded._statistics) == set(popsycle.classes)
+    assert np.array_equal(loaded.bounds(parameters), popsycle.bounds(parameters))
+
+    popsycle.to_hdf5(tmp_path / "model.h5", "popsycle_singles_sukhboldn20")
+    with PopulationModel.from_hdf5(tmp_path / "model.h5", block_rows=100) as hdf5:
+        streamed = hdf5.class_statistics("star", parameters)
+        for key, value in statistics.items():
+            assert np.allclose(streamed[key], value)
+
+    popsycle.add_samples("star", np.full((1, len(popsycle.parameters)), 10.0))
+    updated = popsycle.class_statistics("star", parameters)
+    assert updated["count"] == len(samples) + 1
+    assert np.all(updated["max"] == 10.0)
+
+
+def test_compressed_reduced_precision_asdf(tmp_path):
+    """
+    test compressed and float32 model files load transparently, one class at a time
+    """
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    path = tmp_path / "model.asdf"
+    popsycle.to_asdf(path, "compressed", compression="zlib", dtype="float32")
+
+    with asdf.open(path) as tree:
+        assert tree["storage_dtype"] == "float32"
+        assert tree["class_data"]["star"].dtype == np.float32
+
+    loaded = PopulationModel.from_asdf(path)
+    assert loaded.classes == popsycle.classes
+    for class_name in popsycle.classes:
+        samples = loaded.samples(class_name, popsycle.parameters)
+        assert samples.dtype == np.float64
+        assert np.allclose(
+            samples, popsycle.samples(class_name, popsycle.parameters), rtol=1e-6
+        )
+
+    black_holes = PopulationModel.from_asdf(path, classes=["black_hole"])
+    assert black_holes.classes == ["black_hole"]
+    assert black_holes.class_weight("black_hole") == popsycle.class_weight("black_hole")
+    assert np.array_equal(
+        black_holes.samples("black_hole", ["log10tE"]),
+        loaded.samples("black_hole", ["log10tE"]),
+    )
+
+
+def test_stored_statistics_match_samples(tmp_path):
+    """
+    test stored statistics follow the cast samples and mismatching ones are ignored
+    """
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    path = tmp_path / "model.asdf"
+    popsycle.to_asdf(path, "float32", dtype="float32")
+
+    loaded = PopulationModel.from_asdf(path)
+    assert set(loaded._statistics) == set(popsycle.classes)
+    for class_name in popsycle.classes:
+        stored = loaded.class_statistics(class_name)
+        recomputed = loaded._compute_statistics(class_name)
+        for key, value in recomputed.items():
+            assert np.array_equal(stored[key], value)
+
+    with asdf.open(path) as tree:
+        tree["class_statistics"]["star"]["max"] = tree["class_statistics"]["star"][
+            "max"
+        ][:-1]
+        tree["class_statistics"]["black_hole"]["parameters"] = ["a", "b", "c"]
+        tree["class_statistics"]["white_dwarf"]["count"] += 1
+        tree["class_statistics"]["neutron_star"]["dtype"] = "float64"
+        tree.write_to(tmp_path / "tampered.asdf")
+
+    with pytest.warns(UserWarning, match="Ignoring stored statistics"):
+        tampered = PopulationModel.from_asdf(tmp_path / "tampered.asdf")
+    assert not tampered._statistics
+    samples = tampered.samples("star", tampered.parameters)
+    assert np.array_equal(
+        tampered.class_statistics("star")["max"], np.max(samples, axis=0)
+    )
+
+
+def test_validate_model_file(tmp_path):
+    """
+    test file validation from metadata, with and without checksum verification
+    """
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    path = tmp_path / "model.asdf"
+    popsycle.to_asdf(path, "popsycle_singles_sukhboldn20", compression="zlib")
+    assert validate_asdf_population_model_file(path)
+    assert validate_asdf_population_model_file(path, verify_checksums=True)
+
+    contents = bytearray(path.read_bytes())
+    first_block = contents.find(b"\xd3BLK")
+    contents[first_block + 100] ^= 0xFF
+    corrupted = tmp_path / "corrupted.asdf"
+    corrupted.write_bytes(bytes(contents))
+    assert validate_asdf_population_model_file(corrupted)
+    assert not validate_asdf_population_model_file(corrupted, verify_checksums=True)
+
+    invalid = tmp_path / "invalid.asdf"
+    asdf.AsdfFile({"class_data": {"star": np.zeros((3, 2))}}).write_to(invalid)
+    assert not validate_asdf_population_model_file(invalid)
+    tree = {
+        "model_name": "malformed",
+        "class_weights": {"star": 1.0},
+        "parameters": ["log10tE", "log10piE"],
+        "citation": [],
+    }
+    for class_data in [[np.zeros((3, 2))], {"star": [1.0, 2.0]}, 1.0]:
+        malformed = tmp_path / "malformed.asdf"
+        asdf.AsdfFile(dict(tree, class_data=class_data)).write_to(malformed)
+        assert not validate_asdf_population_model_file(malformed)
+    not_asdf = tmp_path / "not_asdf.asdf"
+    not_asdf.write_bytes(b"not an asdf file")
+    assert not validate_asdf_population_model_file(not_asdf)
@@ -1,10 +1,13 @@
 import arviz as az
+import asdf
 import numpy as np
 import pytest
 from dynesty.results import Results
 from pymultinest.analyse import Analyzer
 
+from popclass.posterior import InferenceData
 from popclass.posterior import Posterior
+from popclass.posterior import Prior
 
 
 def test_posterior_init_parameters():
@@ -146,6 +149,31 @@ def test_convert_arviz():
     assert np.allclose(test_samples, popclass_from_az_post.samples)
 
 
+def test_convert_arviz_selection():
+    """
+    Test variable selection, chain stacking, burn-in and thinning in the Arviz conversion.
+    """
+    chains = np.random.rand(3, 4, 500)
+    post = {"A": chains[0], "B": chains[1], "C": chains[2]}
+
+    az_post = az.convert_to_inference_data(post)
+    popclass_from_az_post = Posterior.from_arviz(
+        az_post, var_names=["C", "A"], burn_in=100, thin=2
+    )
+
+    assert popclass_from_az_post.parameter_labels == ["C", "A"]
+    expected = np.vstack(
+        [chains[2][:, 100::2].reshape(-1), chains[0][:, 100::2].reshape(-1)]
+    ).T
+    assert np.array_equal(popclass_from_az_post.samples, expected)
+
+    with pytest.raises(ValueError):
+        Posterior.from_arviz(az_post, var_names=["D"])
+    for burn_in, thin in [(-1, 1), (500, 1), (600, 1), (0, 0), (0, -2)]:
+        with pytest.raises(ValueError, match="burn_in|thin"):
+            Posterior.from_arviz(az_post, burn_in=burn_in, thin=thin)
+
+
 def test_shape_check_from_arviz():
     """
     Test that a ValueError is raised if the arviz array shape does not match the expected.
@@ -246,6 +274,98 @@ def test_to_InferenceData():
     assert np.array_equal(inference_data.prior_density, test_prior)
 
 
+def test_inference_data_asdf_round_trip(tmp_path):
+    """
+    Test that InferenceData saved to asdf loads back memory-mapped and skips the NaN scan.
+    """
+    test_samples = np.random.rand(1000, 3)
+    test_params = ["A", "B", "C"]
+    test_prior = np.random.rand(1000) + 0.5
+    test_weights = np.random.rand(1000)
+    post = Posterior(samples=test_samples, parameter_labels=test_params)
+    inference_data = post.to_inference_data(test_prior, weights=test_weights)
+
+    path = str(tmp_path / "event.asdf")
+    inference_data.to_asdf(path)
+    loaded = InferenceData.from_asdf(path)
+
+    assert np.array_equal(loaded.posterior.samples, test_samples)
+    assert loaded.posterior.parameter_labels == test_params
+    assert np.array_equal(loaded.prior_density, test_prior)
+    assert np.array_equal(loaded.weights, test_weights)
+    assert loaded.posterior.validated
+    assert np.allclose(loaded.importance_weights, inference_data.importance_weights)
+
+    marginal = loaded.posterior.marginal(["C", "A"])
+    assert np.array_equal(marginal.samples, test_samples[:, [0, 2]])
+    assert marginal.validated
+    assert loaded.posterior.parameter_labels == test_params
+
+    # Files storing the samples one sample per row still load.
+    asdf.AsdfFile(
+        {
+            "samples": test_samples,
+            "parameter_labels": test_params,
+            "prior_density": test_prior,
+            "validated": True,
+        }
+    ).write_to(path)
+    assert np.array_equal(InferenceData.from_asdf(path).posterior.samples, test_samples)
+
+    unvalidated = Posterior(test_samples, test_params, validate=False)
+    unvalidated.samples = np.full_like(test_samples, np.nan)
+    unvalidated.to_inference_data(test_prior).to_asdf(path)
+    with pytest.raises(ValueError):
+        InferenceData.from_asdf(path)
+
+
+def test_importance_weights():
+    """
+    Test that importance weights combine the inverse prior with normalized sample weights.
+    """
+    test_samples = np.random.rand(1000, 3)
+    post = Posterior(samples=test_samples, parameter_labels=["A", "B", "C"])
+    test_prior = np.random.rand(1000) + 0.5
+    test_weights = np.random.rand(1000)
+
+    assert np.allclose(
+        post.to_inference_data(test_prior).importance_weights, 1.0 / test_prior
+    )
+    weighted = post.to_inference_data(test_prior, weights=test_weights)
+    values = np.random.rand(1000)
+    assert np.isclose(
+        np.mean(values * weighted.importance_weights),
+        np.average(values / test_prior, weights=test_weights),
+    )
+
+
+def test_callable_prior():
+    """
+    Test that a Prior is evaluated lazily on its own columns and cached on the InferenceData.
+    """
+    test_samples = np.random.rand(1000, 3) + 0.5
+    post = Posterior(samples=test_samples, parameter_labels=["A", "B", "C"])
+    calls = []
+
+    def log_prior(columns):
+        calls.append(columns.shape)
+        return -2.0 * np.log(columns[:, 0]) + columns[:, 1]
+
+    inference_data = post.to_inference_data(Prior(log_prior, ["C", "A"], log=True))
+    expected = test_samples[:, 2] ** 2 * np.exp(-test_samples[:, 0])
+
+    assert np.allclose(inference_data.importance_weights, expected)
+    assert inference_data.importance_weights is inference_data.importance_weights
+    assert calls == [(1000, 2)]
+    assert np.allclose(inference_data.prior_values, 1.0 / expected)
+
+    plain = post.to_inference_data(lambda samples: samples[:, 1])
+    assert np.allclose(plain.importance_weights, 1.0 / test_samples[:, 1])
+
+    with pytest.raises(ValueError):
+        post.to_inference_data(Prior(log_prior, ["D"])).importance_weights
+
+
 # def test_convert_dynesty():
 #    """
 #    Test that conversion from dynesty works
@@ -0,0 +1,94 @@
+"""
+Tests for the columnar result store in results.py
+"""
+import sys
+
+import numpy as np
+import pytest
+
+from popclass.results import ResultStore
+
+pytest.importorskip("h5py")
+
+CLASSES = ["star", "white_dwarf", "neutron_star", "black_hole"]
+
+
+def _random_probabilities(num_rows):
+    values = np.random.dirichlet(np.ones(len(CLASSES)), size=num_rows)
+    return [dict(zip(CLASSES, row)) for row in values]
+
+
+def test_result_store_append_and_read(tmp_path):
+    """
+    test batches appended across chunk boundaries and reopening read back intact
+    """
+    path = tmp_path / "results.h5"
+    rows = _random_probabilities(250)
+    timings = np.random.uniform(size=250)
+
+    with ResultStore(path, errors=True, timings=True, chunk_rows=64) as store:
+        for start in range(0, 250, 30):
+            batch = slice(start, start + 30)
+            store.append(
+                event_ids=[f"event_{i}" for i in range(250)[batch]],
+                probabilities=rows[batch],
+                model="popsycle_singles_sukhboldn20",
+                parameters=["log10tE", "log10piE"],
+                errors=rows[batch],
+                timings=timings[batch],
+            )
+        assert len(store) == 250
+        assert store.read("event_id")[-1] == "event_249"
+
+    with ResultStore(path) as store:
+        assert store.classes == CLASSES
+        assert len(store) == 250
+        assert store.columns[:3] == ["event_id", "model", "parameters"]
+        assert list(store.read("event_id")) == [f"event_{i}" for i in range(250)]
+        assert set(store.read("parameters")) == {"log10tE,log10piE"}
+        for class_name in CLASSES:
+            expected = [row[class_name] for row in rows]
+            assert np.array_equal(store.read(class_name), expected)
+            assert np.array_equal(store.read(f"errors/{class_name}"), expected)
+        assert np.array_equal(store.read("timing"), timings)
+        probabilities = store.probabilities(rows=slice(10, 20))
+        assert np.allclose(sum(probabilities.values()), 1.0)
+
+
+def test_result_store_columns_and_missing_classes(tmp_path):
+    """
+    test appending columns of arrays, missing classes and unknown classes
+    """
+    with ResultStore(tmp_path / "results.h5", classes=CLASSES + ["None"]) as store:
+        store.append(
+            event_ids=["a", "b"],
+            probabilities={"star": [0.5, 0.2], "black_hole": [0.5, 0.8]},
+            model=["m1", "m2"],
+            parameters=[["log10tE"], ["log10tE", "log10piE"]],
+        )
+        store.append(
+            event_ids=["c"],
+            probabilities=[{"star": 0.1, "None": 0.9}],
+            model="m1",
+            parameters=["log10tE"],
+        )
+        assert list(store.read("model")) == ["m1", "m2", "m1"]
+        assert np.isnan(store.read("None")[0])
+        assert store.read("None")[2] == 0.9
+
+        with pytest.raises(ValueError):
+            store.append(
+                event_ids=["d"],
+                probabilities=[{"planet": 1.0}],
+                model="m1",
+                parameters=["log10tE"],
+            )
+
+
+def test_result_store_requires_h5py(tmp_path, monkeypatch):
+    """
+    test a missing h5py raises an ImportError naming the hdf5 extra
+    """
+    monkeypatch.setitem(sys.modules, "h5py", None)
+    with pytest.raises(ImportError, match=r"popclass\[hdf5\]"):
+        ResultStore(tmp_path / "results.h5")
@@ -1,13 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pytest
 from pytest import approx
 from scipy.stats import multivariate_normal
 from scipy.stats import norm
 
+from popclass.classify import classify
+from popclass.classify import classify_ensemble
+from popclass.classify import classify_subsets
+from popclass.model import CustomKernelDensity
 from popclass.model import PopulationModel
 from popclass.posterior import Posterior
 from popclass.uq import additiveUQ
+from popclass.uq import BootstrapUQ
 from popclass.uq import NoneClassUQ
+from popclass.uq import UQPipeline
 
 
 def test_additiveUQ():
@@ -206,3 +214,316 @@ def test_uq_input_errors():
             grid_size=grid_size,
             kde=None,
         )
+
+
+def test_none_class_from_model_density():
+    """Test the None class built from the population model's own class densities"""
+    np.random.seed(seed=2)
+    bounds = {"p1": [-5, 5], "p2": [-5, 5]}
+    grid_size = 21
+    parameters = ["p1", "p2"]
+    samples = {
+        "A": multivariate_normal.rvs(size=500, mean=[1, 1], cov=np.eye(2)),
+        "B": multivariate_normal.rvs(size=500, mean=[-1, -1], cov=np.eye(2)),
+    }
+    class_weights = {"A": 0.3, "B": 0.7}
+    population_model = PopulationModel(
+        population_samples=samples, class_weights=class_weights, parameters=parameters
+    )
+
+    none_class = NoneClassUQ(
+        bounds=bounds,
+        grid_size=grid_size,
+        population_model=population_model,
+        parameters=parameters,
+        use_model_density=True,
+    )
+    assert none_class.base_model_kde is None
+
+    centers = none_class.grid_centers_raveled
+    base = np.sum(
+        [
+            class_weights[cname]
+            * population_model.evaluate_density(cname, parameters, centers)
+            for cname in samples
+        ],
+        axis=0,
+    )
+    expected = 1.0 - base / np.amax(base)
+    expected /= np.sum(expected * none_class.grid_volumes)
+
+    assert np.allclose(none_class.none_pdf_binned.ravel(), expected)
+
+    with pytest.raises(ValueError):
+        NoneClassUQ(
+            bounds=bounds,
+            grid_size=grid_size,
+            parameters=parameters,
+            use_model_density=True,
+        )
+
+
+def test_none_class_default_bounds():
+    """
+    test the None class bounds default to the padded extent of the population model
+    """
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    parameters = ["log10tE", "log10piE"]
+
+    none_class = NoneClassUQ(
+        population_model=popsycle, parameters=parameters, grid_size=20
+    )
+
+    expected = popsycle.bounds(parameters)
+    for parameter, parameter_bounds in zip(parameters, expected):
+        assert none_class.bounds[parameter] == approx(list(parameter_bounds))
+    assert expected[0][0] < min(
+        popsycle.class_statistics(class_name, ["log10tE"])["min"][0]
+        for class_name in popsycle.classes
+    )
+
+    with pytest.raises(ValueError):
+        NoneClassUQ(parameters=parameters, base_density_grid=np.ones(19 * 19))
+
+
+def test_bootstrap_replicates():
+    """
+    test bootstrap replicates match the classification with the kernels of each
+    resampled population, evaluated with a fixed bandwidth
+    """
+    parameters = ["x", "y"]
+    population_model = PopulationModel(
+        population_samples={
+            "a": norm.rvs(size=(300, 2), random_state=1),
+            "b": norm.rvs(loc=1.0, size=(200, 2), random_state=2),
+        },
+        class_weights={"a": 0.7, "b": 0.3},
+        parameters=parameters,
+    )
+    posterior = Posterior(norm.rvs(size=(150, 2), random_state=3), parameters)
+    inference_data = posterior.to_inference_data(np.random.uniform(0.5, 2, size=150))
+
+    # A small max_elements evaluates the population samples in several blocks.
+    result = BootstrapUQ(n_bootstrap=20, random_state=4, max_elements=1000).bootstrap(
+        inference_data, population_model, parameters
+    )
+
+    rng = np.random.default_rng(4)
+    replicates = []
+    for class_name in population_model.classes:
+        estimator = population_model.density_estimator(class_name, parameters)
+        kernels = np.array(
+            [
+                multivariate_normal(mean=center, cov=estimator.covariance).pdf(
+                    posterior.samples
+                )
+                for center in estimator.dataset.T
+            ]
+        )
+        n = len(kernels)
+        resample_weights = rng.multinomial(n, np.full(n, 1.0 / n), size=20) / n
+        integrals = np.mean(
+            resample_weights @ kernels * inference_data.importance_weights, axis=1
+        )
+        replicates.append(integrals * population_model.class_weight(class_name))
+    replicates = np.array(replicates) / np.sum(replicates, axis=0)
+
+    for class_name, expected in zip(population_model.classes, replicates):
+        assert result["replicates"][class_name] == approx(expected, rel=1e-8)
+
+
+def test_bootstrap_uq():
+    """
+    test bootstrap intervals are centered on the classify probabilities, and
+    serial and multi-process runs agree
+    """
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=1.7, scale=0.2, size=2000),
+            np.random.normal(loc=-1.2, scale=0.2, size=2000),
+        ]
+    ).swapaxes(0, 1)
+    parameters = ["log10tE", "log10piE"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+    inference_data = posterior.to_inference_data(0.028 * np.ones(2000))
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+
+    result = BootstrapUQ(n_bootstrap=100).bootstrap(
+        inference_data, popsycle, parameters
+    )
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        parallel = BootstrapUQ(n_bootstrap=100, executor=executor).bootstrap(
+            inference_data, popsycle, parameters
+        )
+
+    expected = classify(inference_data, popsycle, parameters)
+    for class_name, value in expected.items():
+        assert result["probabilities"][class_name] == approx(value, rel=1e-10)
+        lower, upper = result["intervals"][class_name]
+        assert lower <= value <= upper
+        assert result["replicates"][class_name].shape == (100,)
+        assert np.allclose(
+            parallel["replicates"][class_name], result["replicates"][class_name]
+        )
+    assert np.allclose(sum(result["replicates"].values()), 1.0)
+
+    custom_kernel_model = PopulationModel(
+        population_samples={"a": np.random.randn(50, 2)},
+        class_weights={"a": 1.0},
+        parameters=parameters,
+        density_estimator=CustomKernelDensity,
+    )
+    with pytest.raises(ValueError):
+        BootstrapUQ().bootstrap(inference_data, custom_kernel_model, parameters)
+
+
+class _DoubleClassUQ(additiveUQ):
+    """Doubles the unnormalized probability of one class, through the legacy apply_uq."""
+
+    def __init__(self, class_name):
+        self.class_name = class_name
+
+    def apply_uq(self, unnormalized_prob, inference_data, population_model, parameters):
+        unnormalized_prob[self.class_name] *= 2
+        return unnormalized_prob
+
+
+def test_uq_pipeline():
+    """
+    test a UQ pipeline matches applying its stages in turn and marginalizes the
+    posterior once
+    """
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=1.7, scale=0.2, size=2000),
+            np.random.normal(loc=-1.2, scale=0.2, size=2000),
+        ]
+    ).swapaxes(0, 1)
+    parameters = ["log10tE", "log10piE"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+    inference_data = posterior.to_inference_data(0.028 * np.ones(2000))
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    none_class = NoneClassUQ(
+        population_model=popsycle, parameters=parameters, grid_size=30
+    )
+    pipeline = UQPipeline([_DoubleClassUQ("black_hole"), none_class])
+
+    expected = {
+        class_name: np.mean(
+            popsycle.evaluate_density(class_name, parameters, posterior_samples) / 0.028
+        )
+        * popsycle.class_weight(class_name)
+        for class_name in popsycle.classes
+    }
+    expected = none_class.apply_uq(
+        _DoubleClassUQ("black_hole").apply_uq(
+            expected, inference_data, popsycle, parameters
+        ),
+        inference_data,
+        popsycle,
+        parameters,
+    )
+    normalization = sum(expected.values())
+
+    marginal_calls = []
+    marginal = inference_data.posterior.marginal
+
+    def counting_marginal(*args, **kwargs):
+        marginal_calls.append(args)
+        return marginal(*args, **kwargs)
+
+    inference_data.posterior.marginal = counting_marginal
+    classification = classify(
+        inference_data=inference_data,
+        population_model=popsycle,
+        parameters=parameters,
+        additive_uq=pipeline,
+    )
+
+    assert len(marginal_calls) == 1
+    for class_name, value in expected.items():
+        assert classification[class_name] == approx(value / normalization)
+    with pytest.raises(AttributeError):
+        pipeline.fingerprint
+    assert UQPipeline([none_class]).fingerprint != none_class.fingerprint
+
+
+def test_uq_pipeline_integrand():
+    """
+    test a pipeline with one None class stage supports classification results,
+    and other stages changing the probabilities are rejected
+    """
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=1.7, scale=0.2, size=2000),
+            np.random.normal(loc=-1.2, scale=0.2, size=2000),
+        ]
+    ).swapaxes(0, 1)
+    parameters = ["log10tE", "log10piE"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+    inference_data = posterior.to_inference_data(0.028 * np.ones(2000))
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    none_class = NoneClassUQ(
+        population_model=popsycle, parameters=parameters, grid_size=30
+    )
+
+    pipeline = UQPipeline([additiveUQ(), none_class])
+    assert pipeline.none_class_weight == none_class.none_class_weight
+    assert pipeline.integrate(inference_data, parameters) == approx(
+        none_class.integrate(inference_data, parameters)
+    )
+    result = classify(inference_data, popsycle, parameters, pipeline, True)
+    expected = classify(inference_data, popsycle, parameters, none_class, True)
+    for class_name, value in expected.probabilities().items():
+        assert result.probabilities()[class_name] == approx(value)
+
+    for stages in [[_DoubleClassUQ("star"), none_class], [none_class, none_class]]:
+        with pytest.raises(ValueError):
+            classify(inference_data, popsycle, parameters, UQPipeline(stages), True)
+
+
+def test_uq_pipeline_ensemble_and_subsets():
+    """
+    test ensemble and subset classification share their marginalized posterior
+    with a UQ pipeline
+    """
+    posterior_samples = np.vstack(
+        [
+            np.random.normal(loc=1.7, scale=0.2, size=2000),
+            np.random.normal(loc=-1.2, scale=0.2, size=2000),
+        ]
+    ).swapaxes(0, 1)
+    parameters = ["log10tE", "log10piE"]
+    posterior = Posterior(samples=posterior_samples, parameter_labels=parameters)
+    inference_data = posterior.to_inference_data(0.028 * np.ones(2000))
+    popsycle = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    pipeline = UQPipeline(
+        [
+            _DoubleClassUQ("black_hole"),
+            NoneClassUQ(population_model=popsycle, parameters=parameters, grid_size=30),
+        ]
+    )
+    expected = classify(inference_data, popsycle, parameters, additive_uq=pipeline)
+
+    marginal_calls = []
+    marginal = inference_data.posterior.marginal
+
+    def counting_marginal(*args, **kwargs):
+        marginal_calls.append(args)
+        return marginal(*args, **kwargs)
+
+    inference_data.posterior.marginal = counting_marginal
+    ensemble = classify_ensemble(
+        inference_data, [popsycle], parameters, additive_uq=[pipeline]
+    )
+    subsets = classify_subsets(
+        inference_data,
+        popsycle,
+        [parameters],
+        additive_uq={tuple(parameters): pipeline},
+    )
+
+    assert len(marginal_calls) == 2
+    for class_name, value in expected.items():
+        assert ensemble["models"][0][class_name] == approx(value)
+        assert subsets[tuple(parameters)][class_name] == approx(value)
@@ -1,6 +1,8 @@
 """
 Tests for the visualization.py functions
 """
+import os
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pytest
@@ -8,9 +10,13 @@ import pytest
 from popclass.model import CustomKernelDensity
 from popclass.model import PopulationModel
 from popclass.uq import NoneClassUQ
+from popclass.visualization import binned_density
+from popclass.visualization import DensityGridCache
+from popclass.visualization import evaluate_density_grid
 from popclass.visualization import get_bounds
 from popclass.visualization import plot_population_model
 from popclass.visualization import plot_rel_prob_surfaces
+from popclass.visualization import render_corner_plots
 
 
 def test_get_bounds():
@@ -223,3 +229,147 @@ def test_none_class_all_figures():
     assert len(axes) == len(classes) + 1
     for counter in range(len(classes) + 1):
         assert axes[counter].figure == figs[counter]
+
+
+def test_fft_density_matches_exact():
+    """
+    Check the binned FFT density grid agrees with exact KDE evaluation
+    """
+    popmodel = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    parameters = ["log10tE", "log10piE"]
+    bounds = get_bounds(PopulationModel=popmodel, parameters=parameters)
+    bins = np.linspace(bounds.T[:][0], bounds.T[:][1], 101).T
+
+    for class_name in popmodel.classes:
+        exact = evaluate_density_grid(
+            popmodel, class_name, parameters, bins, density_method="exact"
+        )
+        fast = evaluate_density_grid(
+            popmodel, class_name, parameters, bins, density_method="fft"
+        )
+        assert fast.shape == exact.shape == (100, 100)
+        assert np.max(np.abs(fast - exact)) < 0.05 * np.max(exact)
+
+    bins_1d = bins[:1]
+    exact = evaluate_density_grid(popmodel, "star", ["log10tE"], bins_1d)
+    fast = evaluate_density_grid(
+        popmodel, "star", ["log10tE"], bins_1d, density_method="fft"
+    )
+    assert np.max(np.abs(fast - exact)) < 0.05 * np.max(exact)
+
+    with pytest.raises(ValueError):
+        evaluate_density_grid(
+            popmodel, "star", parameters, bins, density_method="not_a_method"
+        )
+
+
+def test_fft_rel_prob_with_none_class():
+    """
+    Check relative probability surfaces and population plots work with the fft density method
+    """
+    popmodel = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    classes = popmodel.classes
+    parameters = ["log10tE", "log10piE"]
+    plt.close("all")
+    figs, axes = plot_rel_prob_surfaces(
+        PopulationModel=popmodel,
+        parameters=parameters,
+        N_bins=50,
+        create_none_class=NoneClassUQ,
+        density_method="fft",
+    )
+    assert len(figs) == len(classes) + 1
+
+    fig, ax = plot_population_model(
+        PopulationModel=popmodel, parameters=parameters, density_method="fft"
+    )
+    assert fig
+    plt.close("all")
+
+
+def test_density_grid_cache_reuse():
+    """
+    Check density grids are computed once and shared between plotting calls
+    """
+    popmodel = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    parameters = ["log10tE", "log10piE"]
+    cache = DensityGridCache()
+    plt.close("all")
+
+    plot_rel_prob_surfaces(
+        PopulationModel=popmodel, parameters=parameters, N_bins=20, grid_cache=cache
+    )
+    assert len(cache) == len(popmodel.classes)
+    bounds = cache.bounds(popmodel, parameters)
+    bins = np.linspace(bounds.T[:][0], bounds.T[:][1], 21).T
+    grid = cache.density_grid(popmodel, "star", parameters, bins)
+
+    plot_rel_prob_surfaces(
+        PopulationModel=popmodel,
+        parameters=parameters,
+        N_bins=20,
+        plot_samples=True,
+        grid_cache=cache,
+    )
+    assert len(cache) == len(popmodel.classes)
+    assert cache.density_grid(popmodel, "star", parameters, bins) is grid
+
+    plot_rel_prob_surfaces(
+        PopulationModel=popmodel, parameters=parameters, N_bins=10, grid_cache=cache
+    )
+    assert len(cache) == 2 * len(popmodel.classes)
+    plt.close("all")
+
+    bounded = DensityGridCache(max_bytes=2 * grid.nbytes)
+    for class_name in popmodel.classes:
+        bounded.density_grid(popmodel, class_name, parameters, bins)
+    assert len(bounded) == 2
+    assert bounded.nbytes == 2 * grid.nbytes
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_render_corner_plots(tmp_path):
+    """
+    Check corner figures are written to disk for every class, in parallel workers
+    """
+    popmodel = PopulationModel.from_library("popsycle_singles_sukhboldn20")
+    parameters = ["log10tE", "log10piE", "f_blend_I"]
+    num_open = len(plt.get_fignums())
+    paths = render_corner_plots(
+        PopulationModel=popmodel,
+        output_dir=str(tmp_path / "corner"),
+        parameters=parameters,
+        N_bins=20,
+        n_workers=2,
+    )
+    assert len(paths) == len(popmodel.classes)
+    for path in paths:
+        assert os.path.getsize(path) > 0
+    assert len(plt.get_fignums()) == num_open
+
+    # A cache sized for every panel lets a rerun reuse all of them.
+    num_panels = len(popmodel.classes) * len(parameters) * (len(parameters) + 1) // 2
+    cache = DensityGridCache(max_bytes=num_panels * 20 * 20 * 8)
+    for _ in range(2):
+        render_corner_plots(
+            PopulationModel=popmodel,
+            output_dir=str(tmp_path / "cached"),
+            parameters=parameters,
+            N_bins=20,
+            grid_cache=cache,
+        )
+        assert len(cache) == num_panels
+
+
+def test_binned_density_floor():
+    """
+    Check the fft density is floored relative to its peak, or clipped at zero
+    """
+    samples = np.random.normal(size=(1000, 1))
+    bins = np.linspace(-20, 20, 401)[np.newaxis]
+    density = binned_density(samples, bins, [[0.1]])
+    assert np.min(density) == pytest.approx(1e-10 * np.max(density))
+    clipped = binned_density(samples, bins, [[0.1]], floor=0)
+    assert np.min(clipped) >= 0
+    assert np.allclose(clipped, density, rtol=0, atol=2e-10 * np.max(density))